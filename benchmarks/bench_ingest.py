@@ -0,0 +1,149 @@
+"""
+Compares the ingestion engines of src/ingest.py on a scaled up copy of ExampleBulkUpload.xlsx
+
+Run from the repository root:
+    python -m benchmarks.bench_ingest --rows 1000000 --output ingest_results.json
+"""
+
+import argparse
+import json
+import random
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+
+from src.ingest import UploadedWorkbook, calamine_available
+
+REPO_DIR = Path(__file__).parent.parent.resolve()
+EXAMPLE_PATH = REPO_DIR / "ExampleBulkUpload.xlsx"
+SAMPLE_WORDS = ["Lord", "Flies", "Ender", "Game", "Tale", "Two", "Cities", "Dune", "Foundation", "Hobbit"]
+
+
+def example_columns(sheet: str = "books") -> list[str]:
+    """
+    Reads the header row of a sheet in ExampleBulkUpload.xlsx
+    :param sheet: name of the sheet to model the synthetic rows on
+    :return: list of column names
+    """
+    workbook = load_workbook(EXAMPLE_PATH, read_only=True)
+    header = [str(name) for name in next(workbook[sheet].iter_rows(values_only=True))]
+    workbook.close()
+    return header
+
+
+def synthetic_row(columns: list[str], row_number: int) -> list:
+    row = []
+    for column in columns:
+        if column in ("Year", "Series_Number", "Edition", "Disc_Number", "Disc_Count", "Season"):
+            row.append(random.randint(1, 2024))
+        elif column == "ISBN":
+            row.append(9780000000000 + row_number)
+        else:
+            row.append(f"{random.choice(SAMPLE_WORDS)} {random.choice(SAMPLE_WORDS)} {row_number}")
+    return row
+
+
+def write_inputs(rows: int, work_dir: Path, sheet: str = "books") -> dict:
+    """
+    Writes the same synthetic rows as xlsx, csv and parquet files
+    :param rows: number of data rows to generate
+    :param work_dir: directory to write the files to
+    :param sheet: name of the sheet to model the synthetic rows on
+    :return: Dictionary of format to the written Path
+    """
+    random.seed(0)
+    columns = example_columns(sheet)
+    paths = {
+        "xlsx": work_dir / f"{sheet}_{rows}.xlsx",
+        "csv": work_dir / f"{sheet}_{rows}.csv",
+        "parquet": work_dir / f"{sheet}_{rows}.parquet",
+    }
+    if all(path.exists() for path in paths.values()):
+        return paths
+
+    workbook = Workbook(write_only=True)
+    worksheet = workbook.create_sheet(sheet)
+    worksheet.append(columns)
+    csv_rows = []
+    for row_number in range(rows):
+        row = synthetic_row(columns, row_number)
+        worksheet.append(row)
+        csv_rows.append(row)
+    workbook.save(paths["xlsx"])
+    df = pd.DataFrame(csv_rows, columns=columns)
+    df.to_csv(paths["csv"], index=False)
+    df.to_parquet(paths["parquet"], index=False)
+    return paths
+
+
+def measure(path: Path, engine: str, chunk_size: int, trace_memory: bool = False) -> dict:
+    """
+    Times the 10 row preview and a full chunked read of every sheet with one engine
+    :param path: Path of the input file
+    :param engine: ingestion engine to use
+    :param chunk_size: number of rows per chunk
+    :param trace_memory: also record the peak Python allocations, which slows the run down considerably
+    :return: Dictionary of the measurements
+    """
+    if trace_memory:
+        tracemalloc.start()
+    started = time.perf_counter()
+    workbook = UploadedWorkbook(path, engine=engine)
+    for sheet in workbook.sheets().values():
+        sheet.head(n=10)
+    preview_seconds = time.perf_counter() - started
+
+    rows = 0
+    for sheet in workbook.sheets().values():
+        for chunk in sheet.iter_chunks(chunk_size):
+            rows += len(chunk)
+    total_seconds = time.perf_counter() - started
+    peak_bytes = None
+    if trace_memory:
+        peak_bytes = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {
+        "file": path.name,
+        "engine": engine,
+        "rows": rows,
+        "preview_seconds": round(preview_seconds, 4),
+        "total_seconds": round(total_seconds, 4),
+        "rows_per_second": round(rows / total_seconds) if total_seconds else None,
+        "peak_python_mb": round(peak_bytes / 1024 / 1024, 1) if peak_bytes is not None else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000, help="number of synthetic rows to generate")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="rows per parsed chunk")
+    parser.add_argument("--work-dir", type=Path, default=Path(tempfile.gettempdir()) / "collections_bench")
+    parser.add_argument("--trace-memory", action="store_true", help="record peak Python allocations per engine")
+    parser.add_argument("--output", type=Path, help="optional JSON file to store the results in")
+    args = parser.parse_args()
+
+    args.work_dir.mkdir(parents=True, exist_ok=True)
+    paths = write_inputs(args.rows, args.work_dir)
+    runs = [(paths["xlsx"], "openpyxl"), (paths["csv"], "csv"), (paths["parquet"], "parquet")]
+    if calamine_available():
+        runs.insert(1, (paths["xlsx"], "calamine"))
+    # pandas.read_excel parsing the whole workbook up front is the baseline the engines replace
+    started = time.perf_counter()
+    pd.read_excel(paths["xlsx"], sheet_name=None)
+    baseline_seconds = round(time.perf_counter() - started, 4)
+    results = [{"file": paths["xlsx"].name, "engine": "pandas.read_excel", "total_seconds": baseline_seconds}]
+    results += [measure(path, engine, args.chunk_size, args.trace_memory) for path, engine in runs]
+
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
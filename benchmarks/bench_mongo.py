@@ -0,0 +1,234 @@
+"""
+Measures the MongoConnection hot paths (upload_bulk inserting or upserting, update_fields_cache, search_collection and
+delete_item) against a local stand-in on synthetic collections modeled on the books sheet of ExampleBulkUpload.xlsx.
+Every operation reports its throughput, p50/p99 latency and the peak RSS of the process after it ran; the results are
+stored with the current git commit so runs can be compared across commits.
+
+Run from the repository root against a local mongod (or --uri mongomock without a server):
+    python -m benchmarks.bench_mongo --uri mongodb://localhost:27017 --documents 100000 --output mongo_results.json
+Compare the insert and upsert upload throughput on a large file with --documents 500000.
+"""
+
+import argparse
+import json
+import platform
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+from pymongo.errors import OperationFailure
+
+from benchmarks.common import local_connection, synthetic_document
+from src.mongo import MongoConnection
+
+REPO_DIR = Path(__file__).parent.parent.resolve()
+COLLECTION = "books"
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux but in bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+
+def summarize(operation: str, latencies: list[float], items: int) -> dict:
+    """
+    Turns the per-call latencies of an operation into the reported figures
+    :param operation: name of the measured operation
+    :param latencies: list of the seconds every call took
+    :param items: number of documents (or rows) the calls handled in total
+    :return: Dictionary of the measurements
+    """
+    ordered = sorted(latencies)
+    total_seconds = sum(ordered)
+    return {
+        "operation": operation,
+        "calls": len(ordered),
+        "items": items,
+        "total_seconds": round(total_seconds, 4),
+        "items_per_second": round(items / total_seconds) if total_seconds else None,
+        "p50_ms": round(1000 * statistics.median(ordered), 3),
+        "p99_ms": round(1000 * ordered[min(len(ordered) - 1, int(0.99 * len(ordered)))], 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def timed_calls(function, arguments: list[tuple]) -> list[float]:
+    latencies = []
+    for call_arguments in arguments:
+        started = time.perf_counter()
+        function(*call_arguments)
+        latencies.append(time.perf_counter() - started)
+    return latencies
+
+
+def bench_upload_bulk(mongo_conn: MongoConnection, documents: int, fields: int) -> dict:
+    """
+    Uploads the synthetic collection in one upload_bulk call, the collection is then used by the other operations
+    :param mongo_conn: MongoConnection against the benchmark database
+    :param documents: number of rows to upload
+    :param fields: number of additional filler fields per row
+    :return: Dictionary of the measurements
+    """
+    random.seed(0)
+    df = pd.DataFrame([synthetic_document(row_number, fields) for row_number in range(documents)])
+    mongo_conn.db.drop_collection(COLLECTION)
+    latencies = timed_calls(mongo_conn.upload_bulk, [({COLLECTION: df},)])
+    return summarize("upload_bulk", latencies, documents)
+
+
+def bench_upload_upsert(mongo_conn: MongoConnection, documents: int, fields: int) -> list[dict]:
+    """
+    Upserts the synthetic rows on ISBN into a fresh collection, with a tenth of the rows repeated in the file, and then
+    uploads the same file again so every row matches an existing document
+    :param mongo_conn: MongoConnection against the benchmark database
+    :param documents: number of distinct rows to upload
+    :param fields: number of additional filler fields per row
+    :return: list of the measurements of the first upload and the re-upload
+    """
+    random.seed(0)
+    df = pd.DataFrame([synthetic_document(row_number, fields) for row_number in range(documents)])
+    df = pd.concat([df, df.sample(frac=0.1, random_state=0)], ignore_index=True)
+    upsert_collection = f"{COLLECTION}_upsert"
+    mongo_conn.db.drop_collection(upsert_collection)
+    results = []
+    for operation in ("upload_bulk[upsert]", "upload_bulk[upsert, re-upload]"):
+        counts = {"inserted": 0, "updated": 0, "skipped": 0}
+        started = time.perf_counter()
+        for batch in mongo_conn.iter_upload_bulk({upsert_collection: df}, key_fields={upsert_collection: ["ISBN"]}):
+            for count in counts:
+                counts[count] += batch[count]
+        results.append({**summarize(operation, [time.perf_counter() - started], len(df)), **counts})
+    mongo_conn.db.drop_collection(upsert_collection)
+    return results
+
+
+def bench_fields_cache(mongo_conn: MongoConnection, mode: str, repeat: int, documents: int) -> dict:
+    """
+    Rebuilds the fields cache of the synthetic collection, incremental runs only see the documents added since
+    :param mongo_conn: MongoConnection against the benchmark database
+    :param mode: schema discovery mode passed to update_fields_cache
+    :param repeat: number of calls to time
+    :param documents: number of documents in the collection
+    :return: Dictionary of the measurements
+    """
+    latencies = timed_calls(mongo_conn.update_fields_cache, [(mode, [COLLECTION])] * repeat)
+    scanned = documents if mode == "full" else min(documents, 1000) if mode == "sample" else 0
+    return summarize(f"update_fields_cache[{mode}]", latencies, scanned * repeat)
+
+
+def bench_search(mongo_conn: MongoConnection, search_field: str, search_mode: str, repeat: int, documents: int) -> dict:
+    """
+    Runs searches for different values so none of them is served from the search cache
+    :param mongo_conn: MongoConnection against the benchmark database
+    :param search_field: field to search on
+    :param search_mode: search mode passed to search_collection
+    :param repeat: number of calls to time
+    :param documents: number of documents in the collection
+    :return: Dictionary of the measurements
+    """
+    random.seed(1)
+    arguments = []
+    for _ in range(repeat):
+        row_number = random.randrange(documents)
+        if search_mode == "contains":
+            search_value = f" {row_number}"
+        else:
+            search_value = mongo_conn.db[COLLECTION].find_one({"ISBN": 9780000000000 + row_number})[search_field]
+        arguments.append((COLLECTION, search_field, str(search_value), search_mode))
+    latencies = []
+    returned = 0
+    for call_arguments in arguments:
+        started = time.perf_counter()
+        returned += len(mongo_conn.search_collection(*call_arguments))
+        latencies.append(time.perf_counter() - started)
+    return summarize(f"search_collection[{search_field}:{search_mode}]", latencies, returned)
+
+
+def bench_delete_item(mongo_conn: MongoConnection, repeat: int) -> dict:
+    """
+    Deletes random documents one at a time like the Delete tab does
+    :param mongo_conn: MongoConnection against the benchmark database
+    :param repeat: number of documents to delete
+    :return: Dictionary of the measurements
+    """
+    item_ids = [str(document["_id"]) for document in mongo_conn.db[COLLECTION].find({}, {"_id": 1}).limit(repeat)]
+    latencies = timed_calls(mongo_conn.delete_item, [(COLLECTION, item_id) for item_id in item_ids])
+    return summarize("delete_item", latencies, len(item_ids))
+
+
+def run_benchmarks(mongo_conn: MongoConnection, documents: int, fields: int, repeat: int) -> list[dict]:
+    results = [bench_upload_bulk(mongo_conn, documents, fields)]
+    results += bench_upload_upsert(mongo_conn, documents, fields)
+    mongo_conn.create_search_index(COLLECTION, "Title", search_mode="exact")
+    for mode in ("full", "incremental", "sample"):
+        try:
+            results.append(
+                bench_fields_cache(mongo_conn, mode, repeat if mode != "full" else max(1, repeat // 10), documents)
+            )
+        except (NotImplementedError, OperationFailure) as unsupported_error:
+            # mongomock doesn't implement every aggregation expression schema discovery relies on ($type among them),
+            # whether it says so with NotImplementedError or OperationFailure depends on where the pipeline uses it
+            results.append({"operation": f"update_fields_cache[{mode}]", "skipped": str(unsupported_error)})
+    results.append(bench_search(mongo_conn, "Title", "exact", repeat, documents))
+    results.append(bench_search(mongo_conn, "ISBN", "exact", repeat, documents))
+    results.append(bench_search(mongo_conn, "Title", "contains", max(1, repeat // 10), documents))
+    results.append(bench_delete_item(mongo_conn, repeat))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017", help='local mongod, or "mongomock"')
+    parser.add_argument("--database", default="collections_bench")
+    parser.add_argument("--documents", type=int, default=100_000, help="number of synthetic documents")
+    parser.add_argument("--fields", type=int, default=0, help="additional filler fields per document")
+    parser.add_argument("--repeat", type=int, default=50, help="timed calls per latency measurement")
+    parser.add_argument("--output", type=Path, help="optional JSON file to store the results in")
+    args = parser.parse_args()
+
+    # The cache would turn repeated searches into dictionary lookups and hide the database latency
+    mongo_conn = local_connection(args.uri, args.database, search_cache_ttl_seconds=0)
+    # Keep the schema cache of the real collections out of the way
+    mongo_conn.CACHE_PATH = Path(tempfile.gettempdir()) / "collections_bench_fields_cache.json"
+    mongo_conn.CACHE_PATH.unlink(missing_ok=True)
+    results = run_benchmarks(mongo_conn, args.documents, args.fields, args.repeat)
+    mongo_conn.db.drop_collection(COLLECTION)
+
+    for result in results:
+        print(json.dumps(result))
+    # Upserts report a count of skipped rows, an operation that couldn't run has the reason instead
+    skipped = [result["operation"] for result in results if isinstance(result.get("skipped"), str)]
+    if skipped:
+        # A skipped operation has no number at all, rather than a misleading one from a partial run
+        print(f"Not measured against {args.uri}, run against a mongod for these: {', '.join(skipped)}")
+    if args.output:
+        run = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "uri": "mongomock" if args.uri == "mongomock" else "mongod",
+            "documents": args.documents,
+            "fields": args.fields,
+            "repeat": args.repeat,
+            "results": results,
+        }
+        with open(args.output, "w") as output_file:
+            json.dump(run, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
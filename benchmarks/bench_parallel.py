@@ -0,0 +1,136 @@
+"""
+Measures how the parallel bulk upload of src/parallel.py scales with the number of worker processes, on a scaled up
+copy of the books sheet of ExampleBulkUpload.xlsx. Against a local mongod every run uploads the file into a fresh
+collection; with --uri mongomock (which can't be shared between processes) the workers only parse and BSON encode the
+rows, which is the CPU-bound part the process pool spreads over the cores.
+
+Run from the repository root against a local mongod:
+    python -m benchmarks.bench_parallel --uri mongodb://localhost:27017 --rows 500000 --output parallel_results.json
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from benchmarks.bench_ingest import write_inputs
+from benchmarks.common import local_connection
+from src.ingest import UploadedWorkbook, calamine_available
+from src.parallel import encode_documents, iter_task_chunks, plan_upload_tasks
+from src.schema import coerce_chunk, frame_documents, infer_schema, validate_chunk
+
+COLLECTION = "books_parallel"
+
+
+def encode_task(task: dict) -> int:
+    # The work of run_upload_task without the writes
+    rows = 0
+    seen_unique = {}
+    for chunk in iter_task_chunks(task):
+        valid, invalid, _ = validate_chunk(chunk, [["_id"]], seen_unique)
+        coerced, rejected = coerce_chunk(valid, task["schema"])
+        rows += len(encode_documents(frame_documents(coerced))) + len(rejected) + len(invalid)
+    return rows
+
+
+def encode_only(workbook: UploadedWorkbook, workers: int, batch_size: int, task_rows: int) -> int:
+    """
+    Parses and encodes every sheet of a file on a pool of worker processes, or in this process for a single worker
+    :param workbook: the UploadedWorkbook to read
+    :param workers: number of worker processes
+    :param batch_size: number of rows per batch
+    :param task_rows: number of rows per task
+    :return: number of rows encoded
+    """
+    sheets = workbook.sheets()
+    schemas = {name: infer_schema(sheet.head(batch_size)) for name, sheet in sheets.items()}
+    tasks = [
+        {**task, "schema": schemas[task["collection"]]} for task in plan_upload_tasks(sheets, batch_size, task_rows)
+    ]
+    if workers == 1:
+        return sum(encode_task(task) for task in tasks)
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return sum(executor.map(encode_task, tasks))
+
+
+def measure(args, path: Path, engine: str, workers: int) -> dict:
+    """
+    Times one upload (or encode only run) of a file with a number of worker processes
+    :param args: parsed command line arguments
+    :param path: Path of the input file
+    :param engine: ingestion engine to read it with
+    :param workers: number of worker processes, 1 runs the sequential iter_upload_bulk instead
+    :return: Dictionary of the measurements
+    """
+    workbook = UploadedWorkbook(path, engine=engine)
+    sheets = {COLLECTION: next(iter(workbook.sheets().values()))}
+    started = time.perf_counter()
+    if args.uri == "mongomock":
+        rows = encode_only(workbook, workers, args.batch_size, args.task_rows)
+    else:
+        mongo_conn = local_connection(args.uri, args.database, bulk_upload_batch_size=args.batch_size)
+        mongo_conn.client_uri = args.uri
+        mongo_conn.db.drop_collection(COLLECTION)
+        mongo_conn.catalog.invalidate()
+        if workers == 1:
+            batches = mongo_conn.iter_upload_bulk(sheets)
+        else:
+            batches = mongo_conn.iter_parallel_upload(sheets, workers=workers, task_rows=args.task_rows)
+        rows = sum(batch["rows"] for batch in batches)
+        mongo_conn.mongo_client.close()
+    seconds = time.perf_counter() - started
+    return {
+        "file": path.name,
+        "engine": engine,
+        "mode": "encode" if args.uri == "mongomock" else "upload",
+        "workers": workers,
+        "rows": rows,
+        "seconds": round(seconds, 4),
+        "rows_per_second": round(rows / seconds) if seconds else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongomock", help="local mongod connection string, or mongomock")
+    parser.add_argument("--database", default="collections_bench", help="database to upload into")
+    parser.add_argument("--rows", type=int, default=200_000, help="number of synthetic rows to generate")
+    parser.add_argument("--batch-size", type=int, default=1000, help="rows per batch")
+    parser.add_argument("--task-rows", type=int, default=50_000, help="rows per worker task")
+    parser.add_argument(
+        "--workers", type=int, nargs="+", help="worker counts to compare, defaults to 1, 2, 4, ... up to the cores"
+    )
+    parser.add_argument("--work-dir", type=Path, default=Path(tempfile.gettempdir()) / "collections_bench")
+    parser.add_argument("--output", type=Path, help="optional JSON file to store the results in")
+    args = parser.parse_args()
+
+    worker_counts = args.workers
+    if not worker_counts:
+        cores = os.cpu_count() or 1
+        worker_counts = [1] + [2**power for power in range(1, cores.bit_length()) if 2**power < cores] + [cores]
+        worker_counts = sorted(set(worker_counts))
+    args.work_dir.mkdir(parents=True, exist_ok=True)
+    paths = write_inputs(args.rows, args.work_dir)
+    runs = [(paths["csv"], "csv"), (paths["parquet"], "parquet")]
+    runs.insert(0, (paths["xlsx"], "calamine" if calamine_available() else "openpyxl"))
+
+    results = []
+    for path, engine in runs:
+        baseline = None
+        for workers in worker_counts:
+            result = measure(args, path, engine, workers)
+            baseline = baseline or result["seconds"]
+            result["speedup"] = round(baseline / result["seconds"], 2) if result["seconds"] else None
+            print(json.dumps(result))
+            results.append(result)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""
+Compares searches answered by the server with the same searches answered by the local SQLite replica (src/replica.py):
+the time to copy a synthetic collection into the replica, the time of an incremental sync after a few more inserts,
+and the p50/p99 latency of a page of search results per search mode, from the server and from the replica. Point --uri
+at the Atlas cluster (a mongodb+srv:// connection string) to see what the replica saves over a WAN link.
+
+Run from the repository root against a local mongod (or --uri mongomock without a server):
+    python -m benchmarks.bench_replica --uri mongodb://localhost:27017 --documents 100000 --output replica.json
+"""
+
+import argparse
+import json
+import platform
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.bench_mongo import COLLECTION, git_commit, summarize, timed_calls
+from benchmarks.common import local_connection, seed_collection, synthetic_document
+from src.mongo import MongoConnection
+
+# (field, search mode) pairs the replica answers, "contains" has to scan on the server and on the replica alike
+SEARCHES = [("_id", "exact"), ("Title", "exact"), ("ISBN", "exact"), ("Title", "prefix"), ("Title", "contains")]
+
+
+def search_arguments(mongo_conn: MongoConnection, search_field: str, search_mode: str, repeat: int) -> list[tuple]:
+    """
+    Picks a different value for every search, so the calls can't be served from a cache
+    :param mongo_conn: MongoConnection against the benchmark database
+    :param search_field: field to search on
+    :param search_mode: search mode passed to search_collection_page
+    :param repeat: number of searches
+    :return: list of the search_collection_page arguments
+    """
+    random.seed(2)
+    documents = list(mongo_conn.db[COLLECTION].aggregate([{"$sample": {"size": repeat}}]))
+    arguments = []
+    for document in documents:
+        if search_mode == "contains":
+            search_value = f" {document['ISBN'] - 9780000000000}"
+        elif search_mode == "prefix":
+            search_value = document[search_field][:6]
+        else:
+            search_value = document[search_field]
+        arguments.append((COLLECTION, search_field, str(search_value), 1, 25, None, None, False, None, search_mode))
+    return arguments
+
+
+def run_benchmarks(mongo_conn: MongoConnection, documents: int, repeat: int) -> list[dict]:
+    results = []
+    seed_collection(mongo_conn, COLLECTION, documents)
+    replica = mongo_conn.replica
+    mongo_conn.replica = None  # keep the searches on the server until they have been measured there
+
+    for search_field, search_mode in SEARCHES:
+        calls = repeat if search_mode != "contains" else max(1, repeat // 10)
+        latencies = timed_calls(
+            mongo_conn.search_collection_page, search_arguments(mongo_conn, search_field, search_mode, calls)
+        )
+        results.append(summarize(f"server.search[{search_field}:{search_mode}]", latencies, calls))
+
+    latencies = timed_calls(replica.sync, [(mongo_conn.db[COLLECTION],)])
+    results.append(summarize("replica.sync_full", latencies, documents))
+    mongo_conn.db[COLLECTION].insert_many([synthetic_document(documents + row) for row in range(100)])
+    latencies = timed_calls(replica.sync, [(mongo_conn.db[COLLECTION],)])
+    results.append(summarize("replica.sync_incremental", latencies, 100))
+
+    mongo_conn.replica = replica
+    for search_field, search_mode in SEARCHES:
+        calls = repeat if search_mode != "contains" else max(1, repeat // 10)
+        latencies = timed_calls(
+            mongo_conn.search_collection_page, search_arguments(mongo_conn, search_field, search_mode, calls)
+        )
+        results.append(summarize(f"replica.search[{search_field}:{search_mode}]", latencies, calls))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017", help='local mongod, Atlas, or "mongomock"')
+    parser.add_argument("--database", default="collections_bench")
+    parser.add_argument("--documents", type=int, default=100_000, help="number of synthetic documents")
+    parser.add_argument("--repeat", type=int, default=50, help="timed searches per search mode")
+    parser.add_argument("--output", type=Path, help="optional JSON file to store the results in")
+    args = parser.parse_args()
+
+    replica_path = Path(tempfile.mkdtemp(prefix="collections_replica_")) / "replica.sqlite"
+    # The cache would turn repeated searches into dictionary lookups and hide the database latency
+    mongo_conn = local_connection(args.uri, args.database, search_cache_ttl_seconds=0, replica_path=str(replica_path))
+    results = run_benchmarks(mongo_conn, args.documents, args.repeat)
+    mongo_conn.db.drop_collection(COLLECTION)
+
+    for result in results:
+        print(json.dumps(result))
+    print(f"Replica file: {replica_path.stat().st_size / 1024 / 1024:.1f} MB")
+    if args.output:
+        run = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "uri": "mongomock" if args.uri == "mongomock" else "mongod",
+            "documents": args.documents,
+            "repeat": args.repeat,
+            "replica_mb": round(replica_path.stat().st_size / 1024 / 1024, 1),
+            "results": results,
+        }
+        with open(args.output, "w") as output_file:
+            json.dump(run, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
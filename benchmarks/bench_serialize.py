@@ -0,0 +1,121 @@
+"""
+Compares the old DataFrame round-trip of the search/verify tables with the single pass documents_to_table serializer.
+Every approach starts from the BSON bytes a cursor receives, so decoding is part of the measured time.
+
+Run from the repository root:
+    python -m benchmarks.bench_serialize --documents 100000 --output serialize_results.json
+"""
+
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import bson
+import pandas as pd
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+
+from benchmarks.common import synthetic_document
+from src.serialize import documents_to_table
+
+
+def synthetic_bson(documents: int, fields: int) -> list[bytes]:
+    """
+    Encodes synthetic documents with an ObjectId, a datetime, a nested document and an array on top of the books fields
+    :param documents: number of documents to generate
+    :param fields: number of additional filler fields per document
+    :return: list of the encoded documents
+    """
+    random.seed(0)
+    encoded = []
+    for row_number in range(documents):
+        document = {"_id": ObjectId(), **synthetic_document(row_number, fields)}
+        document["Added"] = datetime(2024, 1, 1) + timedelta(minutes=row_number)
+        document["Location"] = {"Room": "Study", "Shelf": row_number % 12}
+        document["Tags"] = ["signed", "first edition"][: row_number % 3]
+        encoded.append(bson.encode(document))
+    return encoded
+
+
+def dataframe_table(encoded: list[bytes]):
+    # The path the search and delete tabs used before: decode, DataFrame, records, then stringify ObjectIds per cell
+    documents = [bson.decode(document) for document in encoded]
+    input_df = pd.DataFrame(documents)
+    return_columns = [{"name": col, "label": col, "field": col} for col in input_df.columns]
+    return_rows = input_df.to_dict(orient="records") if not input_df.empty else []
+    for row in return_rows:
+        for key, value in row.items():
+            if isinstance(value, ObjectId):
+                row[key] = str(value)
+    return return_columns, return_rows
+
+
+def serializer_table(encoded: list[bytes]):
+    return documents_to_table([bson.decode(document) for document in encoded])
+
+
+def raw_serializer_table(encoded: list[bytes]):
+    return documents_to_table([RawBSONDocument(document) for document in encoded])
+
+
+APPROACHES = {
+    "dataframe": dataframe_table,
+    "serializer": serializer_table,
+    "raw_serializer": raw_serializer_table,
+}
+
+
+def measure(name: str, encoded: list[bytes], repeat: int) -> dict:
+    """
+    Times an approach (best of repeat runs) and records its peak Python allocations in a separate traced run
+    :param name: key of APPROACHES
+    :param encoded: list of encoded documents
+    :param repeat: number of timed runs
+    :return: Dictionary of the measurements
+    """
+    approach = APPROACHES[name]
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        approach(encoded)
+        timings.append(time.perf_counter() - started)
+    tracemalloc.start()
+    approach(encoded)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {
+        "approach": name,
+        "documents": len(encoded),
+        "best_seconds": round(min(timings), 4),
+        "median_seconds": round(sorted(timings)[len(timings) // 2], 4),
+        "documents_per_second": round(len(encoded) / min(timings)),
+        "peak_python_mb": round(peak_bytes / 1024 / 1024, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=100_000, help="number of synthetic documents")
+    parser.add_argument("--fields", type=int, default=0, help="additional filler fields per document")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per approach")
+    parser.add_argument("--output", type=Path, help="optional JSON file to store the results in")
+    args = parser.parse_args()
+
+    encoded = synthetic_bson(args.documents, args.fields)
+    # Both table builders must agree on what is shown
+    assert dataframe_table(encoded[:100])[0] == serializer_table(encoded[:100])[0]
+    results = [measure(name, encoded, args.repeat) for name in APPROACHES]
+
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
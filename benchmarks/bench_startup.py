@@ -0,0 +1,160 @@
+"""
+Measures the cold start of the app: how long importing src/main.py takes (broken down per module with
+python -X importtime), how long create_app takes to set up the connection, how long the page of a new session takes to
+build and how long each of the other tab panels takes to build the first time it is opened. Every run starts a fresh interpreter, so
+nothing is served from modules imported by an earlier run. The results are stored with the current git commit so
+cold starts can be compared across releases.
+
+Run from the repository root (no server needed, the app is set up against mongomock):
+    python -m benchmarks.bench_startup --runs 5 --output startup_results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+# Only the standard library is imported here, the child runs must not find anything the app imports already loaded
+REPO_DIR = Path(__file__).parent.parent.resolve()
+SRC_DIR = REPO_DIR / "src"
+HEAVY_MODULES = ("pandas", "numpy", "openpyxl", "pyarrow")
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def child_run() -> dict:
+    """
+    Imports and sets up the app in this (fresh) interpreter, then opens every tab once
+    :return: Dictionary of the phase timings in seconds and the heavy modules imported before and after the page
+    """
+    started = time.perf_counter()
+    import main
+
+    imported = time.perf_counter()
+    heavy_after_import = [module for module in HEAVY_MODULES if module in sys.modules]
+
+    import mongomock
+    from nicegui import events
+
+    from security import Settings
+    from session import UserSession
+
+    settings = Settings(
+        mongo_username="bench", mongo_password="bench", mongo_cluster="local", mongo_database="bench", mongo_uri="local"
+    )
+    created = time.perf_counter()
+    main.create_app(settings, mongo_client=mongomock.MongoClient())
+    app_seconds = time.perf_counter() - created
+    page_started = time.perf_counter()
+    session = UserSession("bench")
+    main.build_ui(session)
+    page_seconds = time.perf_counter() - page_started
+    heavy_after_page = [module for module in HEAVY_MODULES if module in sys.modules]
+
+    tab_seconds = {}
+    for tab_name in list(session.lazy_tab_panels):
+        tab_started = time.perf_counter()
+        main.build_lazy_tab_panel(session, events.ValueChangeEventArguments(sender=None, client=None, value=tab_name))
+        tab_seconds[tab_name] = round(time.perf_counter() - tab_started, 4)
+    return {
+        "import_seconds": round(imported - started, 4),
+        "create_app_seconds": round(app_seconds, 4),
+        "page_build_seconds": round(page_seconds, 4),
+        "tab_build_seconds": tab_seconds,
+        "heavy_modules_after_import": heavy_after_import,
+        "heavy_modules_after_page": heavy_after_page,
+    }
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    Reads the "import time: self [us] | cumulative | imported package" lines python -X importtime writes to stderr
+    :param stderr: standard error of the interpreter
+    :return: Dictionary of module name to its (self, cumulative) import time in microseconds
+    """
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|", 2)
+        modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return modules
+
+
+def measure(top: int) -> dict:
+    """
+    Runs child_run in a fresh interpreter with -X importtime
+    :param top: number of the slowest modules (by their own import time) to report
+    :return: Dictionary of the measurements
+    """
+    environment = {**os.environ, "PYTHONPATH": os.pathsep.join([str(SRC_DIR), str(REPO_DIR)])}
+    started = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-m", "benchmarks.bench_startup", "--child"],
+        cwd=REPO_DIR,
+        env=environment,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    process_seconds = time.perf_counter() - started
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    modules = parse_importtime(completed.stderr)
+    slowest = sorted(modules.items(), key=lambda item: item[1][0], reverse=True)[:top]
+    return {
+        **result,
+        "process_seconds": round(process_seconds, 4),
+        "main_cumulative_ms": round(modules.get("main", (0, 0))[1] / 1000, 1),
+        "slowest_modules_ms": {name: round(self_us / 1000, 1) for name, (self_us, _) in slowest},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=3, help="number of cold starts to measure")
+    parser.add_argument("--top", type=int, default=15, help="number of the slowest modules to report")
+    parser.add_argument("--output", type=Path, help="optional JSON file to store the results in")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(child_run()))
+        return
+
+    runs = []
+    for run in range(args.runs):
+        result = measure(args.top)
+        print(
+            f"run {run + 1}: import {result['import_seconds']:.3f}s, create_app {result['create_app_seconds']:.3f}s, "
+            f"page {result['page_build_seconds']:.3f}s, tabs {sum(result['tab_build_seconds'].values()):.3f}s, "
+            f"heavy modules after the page: {', '.join(result['heavy_modules_after_page']) or 'none'}"
+        )
+        runs.append(result)
+    summary = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "import_seconds_median": statistics.median(run["import_seconds"] for run in runs),
+        "create_app_seconds_median": statistics.median(run["create_app_seconds"] for run in runs),
+        "page_build_seconds_median": statistics.median(run["page_build_seconds"] for run in runs),
+        "runs": runs,
+    }
+    print(json.dumps({key: value for key, value in summary.items() if key != "runs"}))
+    print(json.dumps(runs[-1]["slowest_modules_ms"], indent=4))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(summary, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
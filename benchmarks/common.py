@@ -0,0 +1,75 @@
+import random
+
+from pymongo import MongoClient
+
+from src.mongo import MongoConnection
+from src.monitoring import CommandStatsListener, PoolStatsListener
+from src.security import Settings
+
+SAMPLE_WORDS = ["Lord", "Flies", "Ender", "Game", "Tale", "Two", "Cities", "Dune", "Foundation", "Hobbit"]
+BOOK_FIELDS = ["Title", "Series", "Series_Number", "Author", "Year", "Edition", "ISBN", "Genre", "Cover", "Condition"]
+
+
+def local_connection(uri: str, database: str, **settings_overrides) -> MongoConnection:
+    """
+    Builds a MongoConnection against a local stand-in instead of the Atlas cluster from mongo.env
+    :param uri: connection string of a local mongod, or "mongomock" for an in-process mock
+    :param database: name of the database to use
+    :param settings_overrides: any other Settings values, e.g. search_cache_ttl_seconds=0
+    :return: MongoConnection using the local client
+    """
+    settings = Settings(
+        mongo_username="bench",
+        mongo_password="bench",
+        mongo_cluster="local",
+        mongo_database=database,
+        mongo_uri="local",
+        **settings_overrides,
+    )
+    if uri == "mongomock":
+        import mongomock
+
+        return MongoConnection(settings, mongo_client=mongomock.MongoClient())
+    pool_stats = PoolStatsListener()
+    client = MongoClient(uri, event_listeners=[pool_stats, CommandStatsListener()], **settings.mongo_client_options)
+    connection = MongoConnection(settings, mongo_client=client)
+    connection.pool_stats = pool_stats
+    return connection
+
+
+def synthetic_document(row_number: int, extra_fields: int = 0) -> dict:
+    """
+    Builds a document shaped like the books sheet of ExampleBulkUpload.xlsx
+    :param row_number: sequence number of the document, used to make some values unique
+    :param extra_fields: number of additional filler fields to widen the document with
+    :return: Dictionary of the document
+    """
+    document = {}
+    for field in BOOK_FIELDS:
+        if field in ("Year", "Series_Number", "Edition"):
+            document[field] = random.randint(1, 2024)
+        elif field == "ISBN":
+            document[field] = 9780000000000 + row_number
+        else:
+            document[field] = f"{random.choice(SAMPLE_WORDS)} {random.choice(SAMPLE_WORDS)} {row_number}"
+    for extra_field in range(extra_fields):
+        document[f"Extra_{extra_field}"] = random.choice(SAMPLE_WORDS)
+    return document
+
+
+def seed_collection(connection: MongoConnection, collection: str, documents: int, extra_fields: int = 0) -> None:
+    """
+    Replaces a collection with synthetic documents
+    :param connection: MongoConnection to seed
+    :param collection: string value for the Collection name
+    :param documents: number of documents to insert
+    :param extra_fields: number of additional filler fields per document
+    :return: None
+    """
+    random.seed(0)
+    connection.db.drop_collection(collection)
+    for start in range(0, documents, 10_000):
+        connection.db[collection].insert_many(
+            [synthetic_document(row, extra_fields) for row in range(start, min(start + 10_000, documents))]
+        )
+    return
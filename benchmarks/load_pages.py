@@ -0,0 +1,205 @@
+"""
+Opens more and more concurrent browser sessions on the running app and reports, at every step, how long a new page
+takes to load and connect, how quickly the server still answers (a /metrics round trip on the same event loop) and
+the resident memory of the server per session. Sessions are simulated like a browser does it: the page is loaded over
+HTTP, then its socket.io connection is opened and handshaken, which is what keeps a NiceGUI client (and its
+UserSession) alive. At the end every session disconnects and the number of sessions the server still holds is
+reported, which should drop back to zero once the reconnect timeout has passed.
+
+Run from the repository root against a local mongod (or --uri mongomock without a server):
+    python -m benchmarks.load_pages --uri mongodb://localhost:27017 --sessions 1 10 25 50 100 --output pages.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+import aiohttp
+import socketio
+
+from benchmarks.load_sessions import percentile
+
+REPO_DIR = Path(__file__).parent.parent.resolve()
+SRC_DIR = REPO_DIR / "src"
+COLLECTION = "books"
+RECONNECT_TIMEOUT = 2.0
+
+
+def serve(args) -> None:
+    """
+    Runs the app in this process against the stand-in database, until the parent process stops it
+    :param args: parsed command line arguments
+    :return: None
+    """
+    from nicegui import ui
+    from pymongo import MongoClient
+
+    import main
+    from benchmarks.common import seed_collection
+    from security import Settings
+
+    settings = Settings(
+        mongo_username="bench",
+        mongo_password="bench",
+        mongo_cluster="local",
+        mongo_database=args.database,
+        mongo_uri="local",
+    )
+    if args.uri == "mongomock":
+        import mongomock
+
+        client = mongomock.MongoClient()
+    else:
+        client = MongoClient(args.uri, **settings.mongo_client_options)
+    main.create_app(settings, mongo_client=client)
+    # The fields cache of the benchmark database mustn't replace the one of the app
+    main.mongo_conn.CACHE_PATH = Path(tempfile.mkdtemp()) / "fields_cache.json"
+    seed_collection(main.mongo_conn, COLLECTION, args.documents)
+    ui.run(port=args.port, show=False, reload=False, reconnect_timeout=RECONNECT_TIMEOUT)
+
+
+def server_rss_mb(pid: int) -> float:
+    with open(f"/proc/{pid}/status") as status_file:
+        rss_kb = next(int(line.split()[1]) for line in status_file if line.startswith("VmRSS:"))
+    return rss_kb / 1024
+
+
+async def metrics(http: aiohttp.ClientSession, base_url: str) -> tuple[float, dict]:
+    """
+    Fetches the Prometheus metrics of the server
+    :param http: aiohttp ClientSession
+    :param base_url: URL of the running app
+    :return: Tuple of the round trip in seconds and a dictionary of the unlabelled gauges
+    """
+    started = time.perf_counter()
+    async with http.get(f"{base_url}/metrics") as response:
+        text = await response.text()
+    gauges = {}
+    for line in text.splitlines():
+        name, _, value = line.partition(" ")
+        if not line.startswith("#") and "{" not in name and value:
+            gauges[name] = float(value)
+    return time.perf_counter() - started, gauges
+
+
+async def open_session(http: aiohttp.ClientSession, base_url: str) -> tuple[socketio.AsyncClient, float, float]:
+    """
+    Loads the page and connects its socket the way the browser does
+    :param http: aiohttp ClientSession
+    :param base_url: URL of the running app
+    :return: Tuple of the connected socket.io client, the page load and the connect seconds
+    """
+    started = time.perf_counter()
+    async with http.get(f"{base_url}/") as response:
+        page = await response.text()
+    loaded = time.perf_counter()
+    client_id = re.search(r"[\"']client_id[\"']:\s*[\"']([\w-]+)", page).group(1)
+    sio = socketio.AsyncClient()
+    handshaken = asyncio.get_running_loop().create_future()
+    await sio.connect(
+        f"{base_url}?client_id={client_id}", socketio_path="/_nicegui_ws/socket.io", transports=["websocket"]
+    )
+    await sio.emit(
+        "handshake",
+        {"client_id": client_id, "tab_id": str(uuid.uuid4())},
+        callback=lambda ok: handshaken.set_result(ok),
+    )
+    if not await handshaken:
+        raise RuntimeError(f"The server refused the handshake of client {client_id}")
+    return sio, loaded - started, time.perf_counter() - loaded
+
+
+async def run(args, pid: int) -> list[dict]:
+    base_url = f"http://127.0.0.1:{args.port}"
+    results = []
+    sockets = []
+    async with aiohttp.ClientSession() as http:
+        for _ in range(600):
+            try:
+                await metrics(http, base_url)
+                break
+            except aiohttp.ClientError:
+                await asyncio.sleep(0.1)
+        idle_rss = server_rss_mb(pid)
+        for sessions in sorted(args.sessions):
+            opened = await asyncio.gather(*[open_session(http, base_url) for _ in range(sessions - len(sockets))])
+            sockets += [sio for sio, _, _ in opened]
+            load_latencies = [load for _, load, _ in opened]
+            connect_latencies = [connect for _, _, connect in opened]
+            probe_latencies = []
+            for _ in range(args.probes):
+                probe_seconds, gauges = await metrics(http, base_url)
+                probe_latencies.append(probe_seconds)
+            rss = server_rss_mb(pid)
+            result = {
+                "sessions": sessions,
+                "server_sessions": gauges.get("collections_sessions_active"),
+                "page_load_p50_ms": round(1000 * statistics.median(load_latencies), 2),
+                "page_load_p99_ms": round(1000 * percentile(load_latencies, 0.99), 2),
+                "connect_p50_ms": round(1000 * statistics.median(connect_latencies), 2),
+                "probe_p50_ms": round(1000 * statistics.median(probe_latencies), 2),
+                "probe_p99_ms": round(1000 * percentile(probe_latencies, 0.99), 2),
+                "server_rss_mb": round(rss, 1),
+                "rss_per_session_mb": round((rss - idle_rss) / sessions, 3),
+            }
+            print(json.dumps(result))
+            results.append(result)
+        await asyncio.gather(*[sio.disconnect() for sio in sockets])
+        # Sessions are only ended once the reconnect timeout has passed without the browser coming back
+        await asyncio.sleep(RECONNECT_TIMEOUT + 1)
+        _, gauges = await metrics(http, base_url)
+        closed = {
+            "sessions": 0,
+            "server_sessions": gauges.get("collections_sessions_active"),
+            "server_rss_mb": round(server_rss_mb(pid), 1),
+        }
+        print(json.dumps(closed))
+        results.append(closed)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017", help='local mongod, or "mongomock"')
+    parser.add_argument("--database", default="collections_bench")
+    parser.add_argument("--documents", type=int, default=10_000, help="number of synthetic documents to seed")
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 25, 50, 100], help="session counts")
+    parser.add_argument("--probes", type=int, default=20, help="/metrics round trips measured at every step")
+    parser.add_argument("--port", type=int, default=8181)
+    parser.add_argument("--output", type=Path, help="optional JSON file to store the results in")
+    parser.add_argument("--serve", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args)
+        return
+
+    environment = {**os.environ, "PYTHONPATH": os.pathsep.join([str(SRC_DIR), str(REPO_DIR)])}
+    server = subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.load_pages", "--serve", *sys.argv[1:]],
+        cwd=REPO_DIR,
+        env=environment,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        results = asyncio.run(run(args, server.pid))
+    finally:
+        server.terminate()
+        server.wait()
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
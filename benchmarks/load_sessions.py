@@ -0,0 +1,133 @@
+"""
+Simulates concurrent GUI sessions searching at the same time, once with the database calls made straight on the
+event loop (how the handlers used to work) and once awaited through AsyncMongoConnection.
+One session keeps running an unindexed "contains" search while the others run quick indexed lookups; with the
+blocking calls the quick sessions queue up behind the slow one, with the executor they don't.
+
+Run from the repository root against a local mongod (or --uri mongomock without a server):
+    python -m benchmarks.load_sessions --uri mongodb://localhost:27017 --sessions 20 --output load_results.json
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from pathlib import Path
+
+from benchmarks.common import local_connection, seed_collection
+from src.mongo import AsyncMongoConnection, MongoConnection
+
+COLLECTION = "books"
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+async def heartbeat(lags: list[float], interval: float, stop: asyncio.Event) -> None:
+    """
+    Measures how late the event loop wakes a sleeping task, which is what every other session feels
+    :param lags: list to append the lag (in seconds) of every tick to
+    :param interval: number of seconds to sleep between ticks
+    :param stop: event that ends the heartbeat
+    :return: None
+    """
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - started - interval)
+
+
+async def session(mongo_conn: MongoConnection, mongo_async: AsyncMongoConnection | None, slow: bool, searches: int):
+    """
+    One simulated session running searches back to back
+    :param mongo_conn: blocking MongoConnection
+    :param mongo_async: AsyncMongoConnection to await, or None to call mongo_conn on the event loop
+    :param slow: run the unindexed contains search instead of the indexed exact one
+    :param searches: number of searches to run
+    :return: list of the search latencies in seconds
+    """
+    latencies = []
+    for search_number in range(searches):
+        if slow:
+            arguments = (COLLECTION, "Author", "Dune", "contains")
+        else:
+            arguments = (COLLECTION, "Title", f"Dune Tale {search_number}", "exact")
+        started = time.perf_counter()
+        if mongo_async is None:
+            mongo_conn.search_collection(*arguments)
+        else:
+            await mongo_async.search_collection(*arguments)
+        latencies.append(time.perf_counter() - started)
+        # Give the other sessions a chance to run, like a user reading the results would
+        await asyncio.sleep(0)
+    return latencies
+
+
+async def run_mode(mongo_conn: MongoConnection, mode: str, sessions: int, searches: int) -> dict:
+    """
+    Runs every session concurrently in one of the two modes
+    :param mongo_conn: MongoConnection against the seeded database
+    :param mode: "blocking" or "executor"
+    :param sessions: number of concurrent quick sessions, plus one slow session
+    :param searches: number of searches per session
+    :return: Dictionary of the measurements
+    """
+    mongo_async = AsyncMongoConnection(mongo_conn) if mode == "executor" else None
+    lags = []
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(lags, 0.01, stop))
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        session(mongo_conn, mongo_async, True, max(1, searches // 10)),
+        *[session(mongo_conn, mongo_async, False, searches) for _ in range(sessions)],
+    )
+    total_seconds = time.perf_counter() - started
+    stop.set()
+    await beat
+    if mongo_async is not None:
+        mongo_async.shutdown()
+
+    quick_latencies = [latency for latencies in results[1:] for latency in latencies]
+    return {
+        "mode": mode,
+        "sessions": sessions + 1,
+        "searches": sum(len(latencies) for latencies in results),
+        "total_seconds": round(total_seconds, 4),
+        "quick_p50_ms": round(1000 * statistics.median(quick_latencies), 2),
+        "quick_p99_ms": round(1000 * percentile(quick_latencies, 0.99), 2),
+        "slow_p50_ms": round(1000 * statistics.median(results[0]), 2),
+        "max_loop_lag_ms": round(1000 * max(lags, default=0.0), 2),
+        "p99_loop_lag_ms": round(1000 * percentile(lags, 0.99), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--uri", default="mongodb://localhost:27017", help='local mongod, or "mongomock"')
+    parser.add_argument("--database", default="collections_bench")
+    parser.add_argument("--documents", type=int, default=200_000, help="number of synthetic documents to seed")
+    parser.add_argument("--sessions", type=int, default=20, help="number of concurrent quick sessions")
+    parser.add_argument("--searches", type=int, default=50, help="searches per quick session")
+    parser.add_argument("--output", type=Path, help="optional JSON file to store the results in")
+    args = parser.parse_args()
+
+    # The cache would turn every repeated search into a dictionary lookup and hide the database latency
+    mongo_conn = local_connection(args.uri, args.database, search_cache_ttl_seconds=0)
+    seed_collection(mongo_conn, COLLECTION, args.documents)
+    mongo_conn.create_search_index(COLLECTION, "Title", search_mode="exact")
+
+    results = [
+        asyncio.run(run_mode(mongo_conn, mode, args.sessions, args.searches)) for mode in ("blocking", "executor")
+    ]
+    for result in results:
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=4)
+
+
+if __name__ == "__main__":
+    main()
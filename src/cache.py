@@ -0,0 +1,86 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 60.0):
+        """
+        Thread-safe least-recently-used cache of query results that also expire after a time-to-live.
+        Keys are tuples that start with the collection name, so a write can invalidate just that collection.
+        :param max_entries: number of results to keep before evicting the least recently used one
+        :param ttl_seconds: number of seconds a result stays valid, 0 disables the cache
+        """
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def lookup(self, key: tuple) -> tuple[bool, object]:
+        """
+        Looks up a cached result, counting the hit or miss
+        :param key: tuple starting with the collection name
+        :return: Tuple of whether the key was found and the cached value (None on a miss)
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def store(self, key: tuple, value) -> None:
+        """
+        Stores a result, evicting the least recently used ones past max_entries
+        :param key: tuple starting with the collection name
+        :param value: result to cache
+        :return: None
+        """
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return
+
+    def invalidate(self, collection: str | None = None) -> None:
+        """
+        Drops the cached results of a collection after it has been written to
+        :param collection: string value for the Collection name, or None to drop everything
+        :return: None
+        """
+        with self._lock:
+            if collection is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == collection]:
+                    del self._entries[key]
+            self.invalidations += 1
+        return
+
+    def stats(self) -> dict:
+        """
+        Counters for monitoring how well the cache is doing
+        :return: Dictionary of the hits, misses, evictions, invalidations, entries and hit ratio
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "entries": len(self._entries),
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,275 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo.errors import PyMongoError
+
+BYTE_UNITS = ("B", "KB", "MB", "GB", "TB")
+# Change stream events that can add a collection or change the fields of its documents
+CATALOG_EVENTS = ("insert", "update", "replace", "drop", "rename", "dropDatabase")
+
+
+def format_bytes(size: int | float | None) -> str:
+    if size is None:
+        return "n/a"
+    for unit in BYTE_UNITS:
+        if size < 1024 or unit == BYTE_UNITS[-1]:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class CollectionCatalog:
+    def __init__(self, db, ttl_seconds: float = 300.0, max_workers: int = 8):
+        """
+        Cached catalog of the collections in the database and their statistics, shared by every caller so the
+        collection list is only asked for once per refresh interval.
+        Statistics only come from metadata (estimated counts and storage stats), never from scanning documents.
+        :param db: pymongo Database to describe
+        :param ttl_seconds: number of seconds the collection names and statistics stay valid
+        :param max_workers: number of collections to collect statistics for at the same time
+        """
+        self.db = db
+        self.ttl_seconds = ttl_seconds
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._names = None
+        self._names_expire = 0.0
+        self._stats = {}
+        self._stats_expire = 0.0
+        self._changes = {}  # collection name to the field names updates have set since the last pop_changes
+        self._dropped = set()
+        self._document_counts = None  # estimated counts of the last poll_changes
+        self.watched = False
+
+    def names(self, refresh: bool = False) -> list[str]:
+        """
+        Names of the collections in the database
+        :param refresh: ask the server even if the cached names are still valid
+        :return: list of the collection names
+        """
+        with self._lock:
+            if not refresh and self._names is not None and time.monotonic() < self._names_expire:
+                return list(self._names)
+        names = self.db.list_collection_names()
+        with self._lock:
+            self._names = names
+            self._names_expire = time.monotonic() + self.ttl_seconds
+        return list(names)
+
+    def add(self, name: str) -> None:
+        """
+        Records a collection this app just created, without asking the server again
+        :param name: string value for the Collection name
+        :return: None
+        """
+        with self._lock:
+            if self._names is not None and name not in self._names:
+                self._names.append(name)
+            self._stats_expire = 0.0
+        return
+
+    def remove(self, name: str) -> None:
+        """
+        Forgets a collection that has been dropped
+        :param name: string value for the Collection name
+        :return: None
+        """
+        with self._lock:
+            if self._names is not None and name in self._names:
+                self._names.remove(name)
+            self._stats.pop(name, None)
+        return
+
+    def invalidate(self) -> None:
+        """
+        Makes the next call ask the server for the names and statistics again
+        :return: None
+        """
+        with self._lock:
+            self._names_expire = 0.0
+            self._stats_expire = 0.0
+        return
+
+    def record_change(self, name: str, fields=()) -> None:
+        """
+        Notes a collection whose documents changed, to be picked up by the next pop_changes
+        :param name: string value for the Collection name
+        :param fields: top-level field names an update set, inserted documents are found by an incremental scan
+        :return: None
+        """
+        with self._lock:
+            if self._names is not None and name not in self._names:
+                self._names.append(name)
+                self._stats_expire = 0.0
+            self._changes.setdefault(name, set()).update(fields)
+            self._dropped.discard(name)
+        return
+
+    def record_drop(self, name: str) -> None:
+        """
+        Notes a dropped collection, to be picked up by the next pop_changes
+        :param name: string value for the Collection name
+        :return: None
+        """
+        self.remove(name)
+        with self._lock:
+            self._changes.pop(name, None)
+            self._dropped.add(name)
+        return
+
+    def pop_changes(self) -> tuple[dict, set]:
+        """
+        Hands over the changes recorded since the last call
+        :return: Tuple of a dictionary of changed collection name to the field names updates have set, and the set of
+        dropped collection names
+        """
+        with self._lock:
+            changes, dropped = self._changes, self._dropped
+            self._changes, self._dropped = {}, set()
+        return changes, dropped
+
+    def watch(self) -> bool:
+        """
+        Starts a background change stream recording the collections whose documents are inserted, updated or dropped
+        by any client, so the catalog and the fields cache follow the database without rescanning it
+        :return: True if the change stream is running, False if the deployment does not support change streams
+        """
+        pipeline = [
+            {"$match": {"operationType": {"$in": list(CATALOG_EVENTS)}}},
+            # Only the names of the updated fields are needed, never their values
+            {
+                "$project": {
+                    "operationType": 1,
+                    "ns": 1,
+                    "to": 1,
+                    "updatedFields": {
+                        "$map": {"input": {"$objectToArray": "$updateDescription.updatedFields"}, "in": "$$this.k"}
+                    },
+                }
+            },
+        ]
+        try:
+            change_stream = self.db.watch(pipeline)
+        except PyMongoError as watch_error:
+            print(f"Change streams unavailable, the collection catalog is polled instead: {watch_error}")
+            return False
+
+        def record_changes():
+            try:
+                with change_stream:
+                    for change in change_stream:
+                        self.record_event(change)
+            except PyMongoError as stream_error:
+                print(f"Collection catalog change stream stopped, polling instead: {stream_error}")
+            self.watched = False
+            self.invalidate()
+
+        self.watched = True
+        threading.Thread(target=record_changes, name="catalog-watch", daemon=True).start()
+        return True
+
+    def record_event(self, change: dict) -> None:
+        """
+        Records a single change stream event (see watch)
+        :param change: the change event document
+        :return: None
+        """
+        operation = change["operationType"]
+        name = change.get("ns", {}).get("coll")
+        if operation == "dropDatabase":
+            for dropped_name in self.names():
+                self.record_drop(dropped_name)
+        elif operation == "drop":
+            self.record_drop(name)
+        elif operation == "rename":
+            self.record_drop(name)
+            self.record_change(change["to"]["coll"])
+        elif name is not None:
+            # Updated paths such as "a.b" or "a.0" only add the top-level field "a"
+            self.record_change(name, {field.split(".")[0] for field in change.get("updatedFields") or []})
+        return
+
+    def poll_changes(self) -> None:
+        """
+        Records changes by comparing the collection names and estimated document counts with the last poll, the
+        fallback for deployments without change streams. Updates that don't change the number of documents are only
+        picked up by a full refresh of the fields cache.
+        :return: None
+        """
+        names = self.names(refresh=True)
+        counts = {}
+        for name in names:
+            try:
+                counts[name] = self.db[name].estimated_document_count()
+            except PyMongoError:
+                counts[name] = None
+        previous, self._document_counts = self._document_counts, counts
+        if previous is None:
+            # The first poll only sets the baseline, the startup refresh of the fields cache covers what came before
+            return
+        for name in previous.keys() - counts.keys():
+            self.record_drop(name)
+        for name, count in counts.items():
+            if name not in previous or count != previous[name]:
+                self.record_change(name)
+        return
+
+    def stats(self, refresh: bool = False) -> dict:
+        """
+        Statistics of every collection, collected concurrently across the collections
+        :param refresh: ask the server even if the cached statistics are still valid
+        :return: Dictionary of collection name to its statistics (see collection_stats)
+        """
+        with self._lock:
+            if not refresh and self._stats and time.monotonic() < self._stats_expire:
+                return dict(self._stats)
+        names = self.names(refresh=refresh)
+        if names:
+            with ThreadPoolExecutor(
+                max_workers=min(self.max_workers, len(names)), thread_name_prefix="mongo-catalog"
+            ) as executor:
+                stats = dict(zip(names, executor.map(self.collection_stats, names)))
+        else:
+            stats = {}
+        with self._lock:
+            self._stats = stats
+            self._stats_expire = time.monotonic() + self.ttl_seconds
+        return dict(stats)
+
+    def collection_stats(self, name: str) -> dict:
+        """
+        Statistics of a single collection from its metadata, values the server won't report (e.g. for views) are None
+        :param name: string value for the Collection name
+        :return: Dictionary of the estimated document count, data/storage/index sizes, index count and average
+        document size
+        """
+        stats = {
+            "name": name,
+            "documents": None,
+            "size_bytes": None,
+            "storage_bytes": None,
+            "index_bytes": None,
+            "indexes": None,
+            "avg_document_bytes": None,
+        }
+        try:
+            # Read from the collection metadata, unlike count_documents which scans
+            stats["documents"] = self.db[name].estimated_document_count()
+        except PyMongoError:
+            pass
+        try:
+            storage = next(self.db[name].aggregate([{"$collStats": {"storageStats": {}}}]), {}).get("storageStats", {})
+        except PyMongoError:
+            try:
+                # Servers (or tiers) without $collStats still answer the older collStats command
+                storage = self.db.command("collStats", name)
+            except PyMongoError:
+                storage = {}
+        stats.update(
+            size_bytes=storage.get("size"),
+            storage_bytes=storage.get("storageSize"),
+            index_bytes=storage.get("totalIndexSize"),
+            indexes=storage.get("nindexes"),
+            avg_document_bytes=storage.get("avgObjSize"),
+        )
+        return stats
@@ -0,0 +1,121 @@
+import csv
+import json
+import re
+from datetime import datetime
+from pathlib import Path
+
+from bson import ObjectId
+
+EXPORT_FORMATS = ("xlsx", "csv", "parquet")
+EXCEL_MAX_ROWS = 1_048_576
+EXCEL_MAX_TITLE = 31
+# Characters MongoDB allows in collection names but Excel doesn't allow in sheet titles
+EXCEL_TITLE_INVALID = re.compile(r"[\[\]:*?/\\]")
+# Control characters openpyxl refuses to write into a cell, the same as openpyxl.cell.cell.ILLEGAL_CHARACTERS_RE
+# (copied so openpyxl is still only imported once an export asks for it)
+EXCEL_ILLEGAL_CHARACTERS = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+
+
+def export_value(value, xlsx: bool = False):
+    """
+    Converts a BSON value into something every export format can hold
+    :param value: value of a document field
+    :param xlsx: the value goes into an Excel cell, which can't hold most control characters
+    :return: the value itself for plain scalars, otherwise a string representation
+    """
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        # Excel has no notion of time zones, MongoDB dates are always UTC
+        return value.replace(tzinfo=None)
+    if isinstance(value, (dict, list)):
+        # json.dumps escapes control characters itself
+        return json.dumps(value, default=str)
+    if not isinstance(value, str):
+        value = str(value)
+    return EXCEL_ILLEGAL_CHARACTERS.sub("", value) if xlsx else value
+
+
+def write_xlsx(path: Path, sheets) -> int:
+    """
+    Streams sheets into a write-only workbook, one sheet per collection like the bulk upload format.
+    Sheets longer than Excel's row limit carry on in numbered overflow sheets.
+    :param path: Path of the workbook to write
+    :param sheets: iterable of (sheet name, list of columns, iterable of row batches of export_value(value, xlsx=True))
+    :return: number of rows written
+    """
+    # Only imported once an export asks for it, openpyxl adds noticeably to the app's startup
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    written_rows = 0
+    for sheet_name, columns, batches in sheets:
+        sheet_number = 1
+        sheet_name = EXCEL_TITLE_INVALID.sub("_", sheet_name)
+        worksheet = workbook.create_sheet(title=sheet_name[:EXCEL_MAX_TITLE])
+        columns = [EXCEL_ILLEGAL_CHARACTERS.sub("", column) for column in columns]
+        worksheet.append(columns)
+        sheet_rows = 1
+        for batch in batches:
+            for row in batch:
+                if sheet_rows == EXCEL_MAX_ROWS:
+                    sheet_number += 1
+                    suffix = f"_{sheet_number}"
+                    worksheet = workbook.create_sheet(title=sheet_name[: EXCEL_MAX_TITLE - len(suffix)] + suffix)
+                    worksheet.append(columns)
+                    sheet_rows = 1
+                worksheet.append(row)
+                sheet_rows += 1
+            written_rows += len(batch)
+    if not workbook.worksheets:
+        workbook.create_sheet(title="empty")
+    workbook.save(path)
+    return written_rows
+
+
+def write_csv(path: Path, columns: list[str], batches) -> int:
+    """
+    Streams row batches into a CSV file
+    :param path: Path of the CSV file to write
+    :param columns: list of column names for the header
+    :param batches: iterable of row batches
+    :return: number of rows written
+    """
+    written_rows = 0
+    with open(path, "w", newline="", encoding="utf-8") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(columns)
+        for batch in batches:
+            writer.writerows(batch)
+            written_rows += len(batch)
+    return written_rows
+
+
+def write_parquet(path: Path, columns: list[str], batches) -> int:
+    """
+    Streams row batches into a Parquet file, one row group per batch.
+    Documents in a collection don't share a fixed type per field, so every column is stored as (nullable) text.
+    :param path: Path of the Parquet file to write
+    :param columns: list of column names
+    :param batches: iterable of row batches
+    :return: number of rows written
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ValueError("Exporting Parquet files needs the pyarrow package to be installed")
+
+    schema = pa.schema([(column, pa.string()) for column in columns])
+    written_rows = 0
+    with pq.ParquetWriter(path, schema) as writer:
+        for batch in batches:
+            arrays = [
+                pa.array([None if row[position] is None else str(row[position]) for row in batch], pa.string())
+                for position in range(len(columns))
+            ]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            written_rows += len(batch)
+    return written_rows
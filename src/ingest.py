@@ -0,0 +1,321 @@
+import shutil
+import tempfile
+from datetime import date, datetime
+from importlib.util import find_spec
+from itertools import islice
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from src.monitoring import timed
+
+EXCEL_SUFFIXES = (".xlsx", ".xlsm", ".xls")
+INGEST_ENGINES = ("auto", "calamine", "openpyxl", "csv", "parquet")
+UPLOAD_ACCEPT = ".xlsx,.xlsm,.xls,.csv,.parquet"
+SPOOL_CHUNK_BYTES = 1024 * 1024
+FIRST_DATA_ROW = 2  # spreadsheet row number of the first row below the header
+
+
+def spool_upload(upload_content, file_name: str) -> Path:
+    """
+    Copies an uploaded file into a temporary file in fixed-size chunks instead of reading it into memory
+    :param upload_content: readable binary file object of the upload
+    :param file_name: original name of the uploaded file, used to keep its extension
+    :return: Path of the temporary file, removed again by UploadedWorkbook.close
+    """
+    with tempfile.NamedTemporaryFile(suffix=Path(file_name).suffix.lower(), delete=False) as spool_file:
+        shutil.copyfileobj(upload_content, spool_file, SPOOL_CHUNK_BYTES)
+    return Path(spool_file.name)
+
+
+def calamine_available() -> bool:
+    """
+    Checks whether the optional python-calamine Excel reader is installed
+    :return: True if it can be imported
+    """
+    return find_spec("python_calamine") is not None
+
+
+def sheet_row_index(start: int, rows: int) -> pd.RangeIndex:
+    # Chunks are indexed by the spreadsheet row numbers of their rows, so a failed row can be traced back to the file
+    return pd.RangeIndex(start + FIRST_DATA_ROW, start + FIRST_DATA_ROW + rows)
+
+
+def iter_frame_chunks(df: pd.DataFrame, chunk_size: int):
+    """
+    Splits an already parsed DataFrame into fixed-size chunks
+    :param df: DataFrame to split
+    :param chunk_size: number of rows per chunk
+    :return: Generator of DataFrame chunks, indexed by spreadsheet row number
+    """
+    for start in range(0, len(df), chunk_size):
+        chunk = df.iloc[start : start + chunk_size]
+        yield chunk.set_axis(sheet_row_index(start, len(chunk)))
+
+
+def calamine_value(value):
+    """
+    Converts a cell read by python-calamine to what openpyxl (and pandas.read_excel) hand back for it
+    :param value: the cell value
+    :return: None for an empty cell, an int for a whole number, a datetime for a date, otherwise the value itself
+    """
+    if value == "":
+        return None
+    if type(value) is float and value.is_integer():
+        # Excel stores every number as a float, whole ones are read as ints like openpyxl does
+        return int(value)
+    if type(value) is date:
+        # BSON has no date without a time
+        return datetime(value.year, value.month, value.day)
+    return value
+
+
+def rows_to_frame(header: list, rows: list) -> pd.DataFrame:
+    """
+    Builds a DataFrame from raw spreadsheet rows, naming blank headers the same way pandas.read_excel does
+    :param header: values of the first row of the sheet
+    :param rows: list of row value tuples below the header
+    :return: DataFrame of the rows
+    """
+    columns = [str(name) if name is not None else f"Unnamed: {position}" for position, name in enumerate(header)]
+    # Rows ending in empty cells can come back shorter than the header (openpyxl leaves out the cells never written)
+    padding = (None,) * len(columns)
+    return pd.DataFrame(
+        [row[: len(columns)] if len(row) >= len(columns) else (*row, *padding[len(row) :]) for row in rows],
+        columns=columns,
+    )
+
+
+class UploadedSheet:
+    def __init__(self, workbook: "UploadedWorkbook", name: str):
+        """
+        Lazily parsed sheet of an uploaded file, rows are only read when asked for
+        :param workbook: the UploadedWorkbook this sheet belongs to
+        :param name: name of the sheet, used as the destination collection
+        """
+        self.workbook = workbook
+        self.name = name
+
+    @property
+    def rows(self) -> int | None:
+        """
+        Number of data rows in the sheet, or None if it can't be known without parsing the whole sheet
+        """
+        return self.workbook.row_count(self.name)
+
+    def head(self, n: int = 10) -> pd.DataFrame:
+        return self.workbook.head(self.name, n)
+
+    def iter_chunks(self, chunk_size: int, start: int = 0, stop: int | None = None):
+        return self.workbook.iter_chunks(self.name, chunk_size, start, stop)
+
+    def iter_column(self, column: str, chunk_size: int):
+        """
+        Streams the non-empty values of one column, e.g. a list of _ids to delete
+        :param column: name of the column
+        :param chunk_size: number of rows to parse at a time
+        :return: Generator of the values, nothing when the sheet has no such column
+        """
+        for chunk in self.iter_chunks(chunk_size):
+            if column in chunk:
+                yield from chunk[column].dropna()
+
+
+class UploadedWorkbook:
+    def __init__(self, path: Path, engine: str = "auto", file_name: str | None = None):
+        """
+        Pluggable reader for an uploaded Excel, CSV or Parquet file that only parses the rows it is asked for.
+        CSV and Parquet files are treated as a single sheet named after the file.
+        :param path: Path of the spooled upload
+        :param engine: one of "auto", "calamine", "openpyxl", "csv" or "parquet"
+        :param file_name: original name of the uploaded file, defaults to the name of the path
+        """
+        if engine not in INGEST_ENGINES:
+            raise ValueError(f"Unknown ingestion engine '{engine}', expected one of {INGEST_ENGINES}")
+        self.path = Path(path)
+        self.file_name = file_name or self.path.name
+        suffix = self.path.suffix.lower()
+        if engine == "auto":
+            if suffix == ".csv":
+                engine = "csv"
+            elif suffix == ".parquet":
+                engine = "parquet"
+            elif suffix in EXCEL_SUFFIXES:
+                engine = "calamine" if calamine_available() else "openpyxl"
+            else:
+                raise ValueError(f"Unsupported upload type '{suffix}', please upload an Excel, CSV or Parquet file")
+        if engine == "openpyxl" and suffix == ".xls":
+            raise ValueError("Reading .xls files needs the python-calamine package, please save the file as .xlsx")
+        self.engine = engine
+        self._reader = None
+        self._row_counts = {}
+        self._open()
+
+    def _open(self):
+        if self.engine == "openpyxl":
+            # Read-only workbooks stream each sheet's XML straight out of the spooled zip file
+            self._reader = load_workbook(self.path, read_only=True, data_only=True)
+            self.sheet_names = list(self._reader.sheetnames)
+        elif self.engine == "calamine":
+            from python_calamine import CalamineWorkbook
+
+            self._reader = CalamineWorkbook.from_path(str(self.path))
+            self.sheet_names = list(self._reader.sheet_names)
+        elif self.engine == "parquet":
+            try:
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise ValueError("Reading Parquet files needs the pyarrow package to be installed")
+
+            self._reader = pq.ParquetFile(self.path, memory_map=True)
+            self.sheet_names = [Path(self.file_name).stem]
+        else:
+            self.sheet_names = [Path(self.file_name).stem]
+        return
+
+    def sheets(self) -> dict:
+        """
+        Lazily parsed sheets of the file, in the shape expected by MongoConnection.iter_upload_bulk
+        :return: Dictionary of sheet name to UploadedSheet
+        """
+        return {name: UploadedSheet(self, name) for name in self.sheet_names}
+
+    def row_count(self, sheet: str) -> int | None:
+        """
+        Number of data rows in a sheet from the file's own metadata, without parsing the rows
+        :param sheet: name of the sheet
+        :return: number of rows below the header, or None if the file does not record it
+        """
+        if sheet not in self._row_counts:
+            row_count = None
+            if self.engine == "openpyxl":
+                max_row = self._reader[sheet].max_row
+                row_count = max(max_row - 1, 0) if max_row is not None else None
+            elif self.engine == "calamine":
+                row_count = max(self._reader.get_sheet_by_name(sheet).height - 1, 0)
+            elif self.engine == "parquet":
+                row_count = self._reader.metadata.num_rows
+            self._row_counts[sheet] = row_count
+        return self._row_counts[sheet]
+
+    @property
+    def seekable(self) -> bool:
+        """
+        Whether a range of rows further down a sheet can be read without parsing the rows before it, which lets
+        the parallel upload (see src/parallel.py) hand out row ranges of one sheet to several workers
+        """
+        return self.engine in ("calamine", "parquet")
+
+    @timed("ingest.preview")
+    def head(self, sheet: str, rows: int = 10) -> pd.DataFrame:
+        """
+        Parses only the first rows of a sheet, used for the upload preview
+        :param sheet: name of the sheet
+        :param rows: number of rows to parse
+        :return: DataFrame of the first rows
+        """
+        if self.engine == "csv":
+            return pd.read_csv(self.path, nrows=rows)
+        if self.engine == "parquet":
+            return next(self.iter_chunks(sheet, rows), self._reader.schema_arrow.empty_table().to_pandas())
+        header, row_iterator = self._iter_sheet_rows(sheet, limit=rows)
+        return self._rows_to_chunk(header, list(islice(row_iterator, rows)))
+
+    @timed("ingest.parse_chunk")
+    def iter_chunks(self, sheet: str, chunk_size: int, start: int = 0, stop: int | None = None):
+        """
+        Streams a sheet as DataFrames of at most chunk_size rows
+        :param sheet: name of the sheet
+        :param chunk_size: number of rows per chunk
+        :param start: number of data rows to skip before the first chunk
+        :param stop: optional number of the data row to stop before, defaults to the end of the sheet
+        :return: Generator of DataFrame chunks, indexed by spreadsheet row number
+        """
+        if self.engine == "csv":
+            position = start
+            for chunk in pd.read_csv(
+                self.path,
+                chunksize=chunk_size,
+                memory_map=True,
+                skiprows=range(1, start + 1),
+                nrows=stop - start if stop is not None else None,
+            ):
+                # Blank lines are skipped by pandas, the row numbers of the lines after them come out too low
+                yield chunk.set_axis(sheet_row_index(position, len(chunk)))
+                position += len(chunk)
+            return
+        if self.engine == "parquet":
+            yield from self._iter_parquet_chunks(chunk_size, start, stop)
+            return
+        header, row_iterator = self._iter_sheet_rows(sheet, start=start, stop=stop)
+        while rows := list(islice(row_iterator, chunk_size)):
+            yield self._rows_to_chunk(header, rows)
+        return
+
+    def _iter_parquet_chunks(self, chunk_size: int, start: int = 0, stop: int | None = None):
+        metadata = self._reader.metadata
+        stop = metadata.num_rows if stop is None else min(stop, metadata.num_rows)
+        # Only the row groups overlapping the range are read, the rows around it are sliced off the first and last
+        row_groups = []
+        first_row = None
+        group_start = 0
+        for row_group in range(metadata.num_row_groups):
+            group_stop = group_start + metadata.row_group(row_group).num_rows
+            if group_stop > start and group_start < stop:
+                row_groups.append(row_group)
+                first_row = group_start if first_row is None else first_row
+            group_start = group_stop
+        if not row_groups:
+            return
+        position = first_row
+        for record_batch in self._reader.iter_batches(batch_size=chunk_size, row_groups=row_groups):
+            batch_start = max(start - position, 0)
+            batch_stop = min(stop - position, record_batch.num_rows)
+            if batch_stop > batch_start:
+                chunk = record_batch.slice(batch_start, batch_stop - batch_start).to_pandas()
+                yield chunk.set_axis(sheet_row_index(position + batch_start, len(chunk)))
+            position += record_batch.num_rows
+            if position >= stop:
+                return
+        return
+
+    def _iter_sheet_rows(self, sheet: str, limit: int | None = None, start: int = 0, stop: int | None = None):
+        if self.engine == "openpyxl":
+            row_iterator = self._reader[sheet].iter_rows(values_only=True)
+        else:
+            calamine_sheet = self._reader.get_sheet_by_name(sheet)
+            if limit is not None:
+                row_iterator = iter(calamine_sheet.to_python(nrows=limit + 1))
+            elif hasattr(calamine_sheet, "iter_rows"):
+                row_iterator = calamine_sheet.iter_rows()
+            else:
+                # Older python-calamine releases can only hand back the whole sheet at once
+                row_iterator = iter(calamine_sheet.to_python())
+        if self.engine == "calamine":
+            row_iterator = (tuple(map(calamine_value, row)) for row in row_iterator)
+        header = list(next(row_iterator, None) or [])
+        if start or stop is not None:
+            # Row ranges count the blank rows as well, so the ranges of a sheet never overlap
+            row_iterator = islice(row_iterator, start, stop)
+        # Blank rows would only turn into empty documents, so they are skipped, each row keeps its spreadsheet row number
+        numbered_rows = enumerate(row_iterator, start + FIRST_DATA_ROW)
+        return header, ((number, row) for number, row in numbered_rows if any(value not in (None, "") for value in row))
+
+    def _rows_to_chunk(self, header: list, numbered_rows: list) -> pd.DataFrame:
+        chunk = rows_to_frame(header, [row for _, row in numbered_rows])
+        chunk.index = pd.Index([number for number, _ in numbered_rows])
+        return chunk
+
+    def close(self) -> None:
+        """
+        Releases the reader and removes the spooled upload from disk
+        :return: None
+        """
+        if self.engine == "openpyxl":
+            self._reader.close()
+        elif self.engine == "calamine" and hasattr(self._reader, "close"):
+            self._reader.close()
+        self._reader = None
+        self.path.unlink(missing_ok=True)
+        return
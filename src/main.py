@@ -1,12 +1,42 @@
-from io import BytesIO
+import asyncio
+import multiprocessing
+import shutil
+import tempfile
+import time
+from functools import lru_cache, partial
 from pathlib import Path
 
-import pandas as pd
-from bson import ObjectId
-from nicegui import app, events, ui
+from bson.errors import BSONError
+from fastapi.responses import PlainTextResponse
+from nicegui import Client, app, events, ui
+from pymongo.errors import PyMongoError
 
-from mongo import MongoConnection
+from catalog import format_bytes
+from export import EXPORT_FORMATS, export_value, write_xlsx
+from mongo import (
+    BULK_CHANGE_OPERATIONS,
+    FACET_FILTER_MODES,
+    SEARCH_MODES,
+    AsyncMongoConnection,
+    MongoConnection,
+)
 from security import check_credentials
+from serialize import cell_value, documents_to_table, table_columns
+from session import UserSession
+from src.monitoring import (  # the same module instance mongo.py records its spans into
+    METRICS,
+    PROFILER,
+    PROFILER_ENGINES,
+    pyinstrument_available,
+    span,
+    timed,
+)
+
+# ingest and schema (and with them pandas and openpyxl) are imported by the tabs and handlers that read files or
+# coerce items, so they don't hold up the first paint
+
+# Lets a frozen (PyInstaller) build start the worker processes of a parallel bulk upload, before the app is set up
+multiprocessing.freeze_support()
 
 
 def clean_list_string(input_list: list) -> str:
@@ -14,31 +44,350 @@ def clean_list_string(input_list: list) -> str:
 
 
 src_dir = Path(__file__).parent.resolve()
+startup_started = time.perf_counter()  # used to report the startup to first paint time
+
+
+@lru_cache(maxsize=None)
+def read_markdown(file_name: str) -> str:
+    """
+    Reads one of the markdown files shipped next to this module, only once per process
+    :param file_name: name of the file in the src directory
+    :return: string content of the file
+    """
+    with open(Path(src_dir / file_name), "r") as markdown_file:
+        return markdown_file.read()
+
+
+# Application state, set up by create_app
+settings = None  # Pydantic Settings object that stores application settings
+mongo_conn = None  # MongoDB connection instance
+mongo_async = None  # awaitable view of mongo_conn, handlers await its calls to keep the event loop free
+available_collections = []  # latest list of the collections, pushed into the selects as it changes
+fields_cache = {}  # collection name to its fields, kept up to date in the background by refresh_fields_cache
+
+# Global variables, shared by every session
+sessions = {}  # client id to the UserSession of every open browser tab
+first_paint_reported = False  # only report the startup to first paint time once
+collection_stats_rows = []  # store the last collection statistics shown on the Welcome tab
+export_dirs = []  # store the temporary directories of the exports, removed on shutdown
+
+
+async def refresh_fields_cache():
+    """
+    Refreshes the fields cache one collection at a time in a worker thread, pushing each result into the UI
+    :return: None
+    """
+    refresh_started = time.perf_counter()
+    try:
+        collections = await mongo_async.get_collections()
+        # Until now the selects offered the collections of the stored fields cache
+        refresh_collection_list(collections)
+        for collection in collections:
+            fields_cache.update(await mongo_async.update_fields_cache("incremental", [collection]))
+            refresh_collection_selects(collection, collections)
+    except PyMongoError as refresh_error:
+        # The selects keep offering the collections and fields of the stored fields cache
+        print(f"Fields cache refresh failed: {refresh_error}")
+    else:
+        print(f"Fields cache refreshed in {time.perf_counter() - refresh_started:.2f}s")
+    # The field coverage of the collection statistics comes from the refreshed schema cache
+    await refresh_collection_stats()
+    return
+
+
+async def refresh_collection_stats(refresh: bool = False):
+    """
+    Reloads the collection statistics of the Welcome tab, served from the catalog cache unless refresh is set
+    :param refresh: ask the server even if the cached statistics are still valid
+    :return: None
+    """
+    global collection_stats_rows
+    try:
+        collection_stats_rows = await mongo_async.collection_stats(refresh)
+    except PyMongoError as stats_error:
+        print(f"Collection statistics failed: {stats_error}")
+        return
+    for session in list(sessions.values()):
+        show_collection_stats(session)
+    return
+
+
+def show_collection_stats(session: UserSession):
+    """
+    Shows the last collection statistics on the Welcome tab of a session
+    :param session: the UserSession to update
+    :return: None
+    """
+    session.collection_stats_table.rows = [
+        {
+            "name": stats["name"],
+            "documents": stats["documents"] if stats["documents"] is not None else "n/a",
+            "size": format_bytes(stats["size_bytes"]),
+            "storage": format_bytes(stats["storage_bytes"]),
+            "indexes": f"{stats['indexes'] or 0} ({format_bytes(stats['index_bytes'])})",
+            "avg_document": format_bytes(stats["avg_document_bytes"]),
+            "fields": stats["fields"],
+        }
+        for stats in collection_stats_rows
+    ]
+    session.collection_coverage_select.set_options([stats["name"] for stats in collection_stats_rows])
+    show_field_coverage(session, session.collection_coverage_select.value)
+    return
+
+
+def show_field_coverage(session: UserSession, collection: str | None):
+    """
+    Shows the share of documents holding each field of a collection, most common fields first
+    :param session: the UserSession to update
+    :param collection: string value for the Collection name
+    :return: None
+    """
+    stats = next((stats for stats in collection_stats_rows if stats["name"] == collection), None)
+    coverage = stats["coverage"] if stats is not None else {}
+    session.collection_coverage_table.rows = [
+        {"field": field, "coverage": f"{share:.0%}"}
+        for field, share in sorted(coverage.items(), key=lambda item: (-item[1], item[0]))
+    ]
+    return
+
+
+def refresh_collection_list(collections: list[str]):
+    """
+    Pushes the latest list of collections into the Welcome tab and the collection selects of every session
+    :param collections: list of the collection names currently in the database
+    :return: None
+    """
+    global available_collections
+    available_collections = list(collections)
+    for session in list(sessions.values()):
+        show_collection_list(session)
+    return
+
+
+def show_collection_list(session: UserSession):
+    """
+    Shows the latest list of collections in the Welcome tab and the collection selects a session has built so far
+    :param session: the UserSession to update
+    :return: None
+    """
+    if session.available_collections_label is not None:
+        session.available_collections_label.set_text(clean_list_string(available_collections))
+    for collection_select in (
+        session.collection_selection,
+        session.search_collection_select,
+        session.summary_collection_select,
+        session.delete_from_collection_select,
+        session.export_collections_select,
+    ):
+        if collection_select is not None and collection_select.options != available_collections:
+            collection_select.set_options(available_collections)
+    return
+
+
+def refresh_collection_selects(collection: str, collections: list[str]):
+    """
+    Pushes the latest collections and fields of a refreshed collection into the select widgets
+    :param collection: string value for the Collection name that was just refreshed
+    :param collections: list of the collection names currently in the database
+    :return: None
+    """
+    refresh_collection_list(collections)
+    for session in list(sessions.values()):
+        if session.search_collection_select is not None and session.search_collection_select.value == collection:
+            session.search_fields.set_options([item for item in fields_cache[collection] if item != "_id"])
+        if session.summary_collection_select is not None and session.summary_collection_select.value == collection:
+            show_summary_fields(session, collection)
+        if (
+            session.collection_selection is not None
+            and session.collection_selection.value == collection
+            and not any(field.value for field in session.current_add_one_fields.values())
+        ):
+            session.update_add_one_card(collection)
+    return
+
+
+def report_first_paint():
+    global first_paint_reported
+    if not first_paint_reported:
+        first_paint_reported = True
+        print(f"Startup to first paint: {time.perf_counter() - startup_started:.2f}s")
+    return
 
-# Get MongoDB details and any other application configurations established
-settings = check_credentials()
 
-# Global variables
-bulk_upload_file = None  # store a bulk upload file
-bulk_upload_data = None  # store the data from the bulk upload file
-available_collections_label = None  # refreshable available collections list
-confirm_upload_button = None  # enable/disable bulk upload confirm button
-search_collection_picked = ""  # store the collection picked for search
-search_field_picked = ""  # store the field picked for search
-search_results_data = []  # store the results of the search
-delete_from_collection = ""  # store the collection picked for deletion method
-delete_id = ""  # store the ID of the item to delete
+async def start_search_cache_watch():
+    await mongo_async.watch_search_cache()
+    return
+
+
+async def start_catalog_watch():
+    if await mongo_async.watch_catalog():
+        print("Following new collections and fields through a change stream")
+    return
+
+
+async def sync_catalog():
+    """
+    Pushes the collections and fields added (or dropped) since the last sync into the widgets, which every connected
+    browser shows, only rescanning the collections that changed
+    :return: None
+    """
+    try:
+        changes = await mongo_async.sync_catalog()
+    except PyMongoError as sync_error:
+        print(f"Collection catalog sync failed: {sync_error}")
+        return
+    if changes["fields"] is None:
+        # Nothing was written, but a collection created empty by another client shows up once the catalog expires
+        if changes["collections"] != available_collections:
+            refresh_collection_list(changes["collections"])
+        return
+    for collection in changes["dropped"]:
+        fields_cache.pop(collection, None)
+    fields_cache.update(changes["fields"])
+    refresh_collection_list(changes["collections"])
+    for collection in changes["changed"]:
+        refresh_collection_selects(collection, changes["collections"])
+    return
+
+
+async def start_replica_watch():
+    if await mongo_async.watch_replica():
+        print("Following the changes of every client into the local replica through a change stream")
+    return
+
+
+async def sync_replica():
+    """
+    Copies the documents added since the last sync into the local replica, searches of a collection are answered
+    locally once its first copy has finished
+    :return: None
+    """
+    try:
+        documents_read = await mongo_async.sync_replica()
+    except PyMongoError as sync_error:
+        # Searches of the collections copied so far carry on from the replica while the cluster can't be reached
+        print(f"Local replica sync failed: {sync_error}")
+        return
+    if any(documents_read.values()):
+        print(f"Local replica synced {sum(documents_read.values())} documents")
+    return
 
-# Get a MongoDB connection instance
-mongo_conn = MongoConnection(settings)
 
-# Set up the list of available collections
-available_collections = mongo_conn.get_collections()  # List[str]
-available_collections_str = ", ".join(mongo_conn.get_collections())  # Single string of comma-sep values
+async def warm_up_connection_pool():
+    try:
+        warm_up_seconds = await mongo_async.warm_up()
+    except PyMongoError as warm_up_error:
+        print(f"Connection pool warm-up failed: {warm_up_error}")
+        return
+    print(f"Connection pool warmed up in {warm_up_seconds:.2f}s")
+    return
+
+
+def refresh_welcome_stats(session: UserSession):
+    cache_stats = mongo_conn.search_cache.stats()
+    session.search_cache_label.set_text(
+        f"{cache_stats['hits']} hits, {cache_stats['misses']} misses ({cache_stats['hit_ratio']:.0%}), "
+        f"{cache_stats['entries']} entries, "
+        f"{'invalidated by change stream' if mongo_conn.search_cache_watched else 'invalidated by TTL and app writes'}"
+    )
+    pool_stats = mongo_conn.pool_stats.stats()
+    session.connection_pool_label.set_text(
+        f"{pool_stats['open']} open, {pool_stats['in_use']} in use, {pool_stats['checkouts']} checkouts "
+        f"(avg wait {pool_stats['avg_checkout_wait_ms']:.1f} ms, max {pool_stats['max_checkout_wait_ms']:.1f} ms), "
+        f"{pool_stats['checkout_failures']} failed checkouts, {pool_stats['pool_clears']} pool clears"
+    )
+    if session.replica_label is not None:
+        replicated = mongo_conn.replica.collections()
+        session.replica_label.set_text(
+            f"{sum(entry['documents'] for entry in replicated.values())} documents in {len(replicated)} collections, "
+            f"{'following changes by change stream' if mongo_conn.replica.watched else 'copying new documents'} "
+            f"every {settings.replica_sync_seconds:.0f}s"
+        )
+    return
+
+
+def metrics_gauges() -> dict:
+    cache_stats = mongo_conn.search_cache.stats()
+    pool_stats = mongo_conn.pool_stats.stats()
+    return {
+        "search_cache_hits_total": cache_stats["hits"],
+        "search_cache_misses_total": cache_stats["misses"],
+        "search_cache_entries": cache_stats["entries"],
+        "pool_open_connections": pool_stats["open"],
+        "pool_in_use_connections": pool_stats["in_use"],
+        "pool_checkout_failures_total": pool_stats["checkout_failures"],
+        "pool_clears_total": pool_stats["pool_clears"],
+        "sessions_active": len(sessions),
+        **(
+            {"replica_documents": sum(entry["documents"] for entry in mongo_conn.replica.collections().values())}
+            if mongo_conn.replica is not None
+            else {}
+        ),
+    }
+
 
-# Set up or update the cache of available fields for each collection
-mongo_conn.update_fields_cache()
-fields_cache = mongo_conn.read_fields_cache()
+def metrics_endpoint():
+    return PlainTextResponse(METRICS.prometheus_text(metrics_gauges()), media_type="text/plain; version=0.0.4")
+
+
+def refresh_stats_tab(session: UserSession):
+    """
+    Updates the Stats tab with the latest latency summaries, the selected histogram and the last captured profile
+    :param session: the UserSession to update
+    :return: None
+    """
+    snapshot = METRICS.snapshot()
+    session.stats_table.rows = [
+        {
+            "name": series_name(series),
+            "count": series["count"],
+            "avg_ms": round(1000 * series["sum"] / series["count"], 2) if series["count"] else 0,
+            "p50_ms": round(1000 * series["p50"], 2),
+            "p99_ms": round(1000 * series["p99"], 2),
+            "max_ms": round(1000 * series["max"], 2),
+        }
+        for series in snapshot
+    ]
+    session.stats_histogram_select.set_options([row["name"] for row in session.stats_table.rows])
+    picked = next((series for series in snapshot if series_name(series) == session.stats_histogram_select.value), None)
+    if picked is not None:
+        # Bucket counts are cumulative, the chart shows how many calls fell in each bucket
+        counts = [count for _, count in picked["buckets"]]
+        session.stats_chart.options["xAxis"]["data"] = [
+            f"≤{bound * 1000:g} ms" for bound, _ in picked["buckets"][:-1]
+        ] + [f">{picked['buckets'][-2][0] * 1000:g} ms"]
+        session.stats_chart.options["series"][0]["data"] = [counts[0]] + [b - a for a, b in zip(counts, counts[1:])]
+        session.stats_chart.update()
+    profile_text = PROFILER.report or "No profile captured yet"
+    if session.profile_report.content != profile_text:
+        session.profile_report.set_content(profile_text)
+    return
+
+
+def series_name(series: dict) -> str:
+    return f"{series['metric']}: {', '.join(str(value) for value in series['labels'].values())}"
+
+
+def arm_profiler(session: UserSession):
+    try:
+        PROFILER.arm(session.profiler_engine_select.value)
+    except ValueError as profiler_error:
+        ui.notify(str(profiler_error), type="negative")
+        return
+    ui.notify("The next request will be profiled")
+    return
+
+
+def remove_export_dirs():
+    for export_dir in export_dirs:
+        shutil.rmtree(export_dir, ignore_errors=True)
+    return
+
+
+def on_shutdown():
+    print("Web window closed. Shutting down...")
+    remove_export_dirs()
+    mongo_async.shutdown()
 
 
 def close_session():
@@ -47,383 +396,1311 @@ def close_session():
     return
 
 
-# Set up the UI elements
-ui.page_title("Collections App")
-with ui.tabs().classes("w-full") as main_tabs:
-    welcome_tab = ui.tab("Welcome")
-    new_collection = ui.tab("New Collection")
-    add_one_tab = ui.tab("Add One")
-    add_bulk_tab = ui.tab("Add Bulk")
-    export_tab = ui.tab("Download")
-    search_tab = ui.tab("Search")
-    delete_tab = ui.tab("Delete")
-with ui.tab_panels(main_tabs, value=welcome_tab).classes("w-full"):
-    # Set up the "Welcome" tab environment
-    with ui.tab_panel(welcome_tab) as welcome_panel:
-        welcome_panel.clear()
-        ui.markdown("# Welcome to the Collections Manager application")
-        ui.separator()
-        ui.label("This application will help you manage what items are stored in your MongoDB collections.")
-        ui.label("Tabs:")
-        ui.markdown("\t- __Welcome__: You are here!")
-        ui.markdown("\t- __New Collection__: add a new collection to your database")
-        ui.markdown("\t- __Add One__: add a single item to a collection of your choice")
-        ui.markdown("\t- __Add Bulk__: add multiple items based on an Excel file input")
-        ui.markdown("\t- __Search__: search your collections for a given item")
-        ui.markdown("\t- __Delete__: delete an item from a collection")
-        ui.separator().style("padding-top: 50px;")
-        with ui.grid(columns=2):
-            ui.label("Current database: ")
-            ui.label(f"{settings.mongo_database}")
-
-            ui.label("Mongo URI: ")
-            ui.label(f"{settings.mongo_uri}")
-
-            ui.label("Source code: ")
-            ui.link("Go to GitHub!", "https://github.com/EricS0110/what-a-nice-collection-gui")
-
-            ui.label("Source docs: ")
-            ui.link("Go to GitHub Pages!", "https://erics0110.github.io/what-a-nice-collection-gui/")
-
-            ui.label("Available collections at startup: ")
-            ui.label(f"{clean_list_string(mongo_conn.get_collections())}")
-
-            ui.button(text="Close Session", on_click=close_session, color="red")
-
-    # Set up the "New Collection" tab environment
-    def add_new_collection():
+def end_session(session: UserSession):
+    """
+    Forgets the session of a browser tab that has gone (and didn't reconnect), removing its spooled uploads
+    :param session: the UserSession to end
+    :return: None
+    """
+    sessions.pop(session.client_id, None)
+    session.close()
+    return
+
+
+async def prune_sessions():
+    # Pages that never connected are deleted by NiceGUI without a disconnect, their sessions are ended here
+    for client_id, session in list(sessions.items()):
+        if client_id not in Client.instances:
+            end_session(session)
+    return
+
+
+async def repeat(interval: float, callback):
+    """
+    Runs a coroutine function every interval seconds for as long as the app runs, once for all the sessions instead
+    of once per session like a ui.timer on the page would
+    :param interval: number of seconds between the calls
+    :param callback: coroutine function to run
+    :return: None
+    """
+    while True:
+        await asyncio.sleep(interval)
+        await callback()
+
+
+def build_welcome_tab(session: UserSession):
+    ui.markdown("# Welcome to the Collections Manager application")
+    ui.separator()
+    ui.label("This application will help you manage what items are stored in your MongoDB collections.")
+    ui.label("Tabs:")
+    ui.markdown("\t- __Welcome__: You are here!")
+    ui.markdown("\t- __New Collection__: add a new collection to your database")
+    ui.markdown("\t- __Add One__: add a single item to a collection of your choice")
+    ui.markdown("\t- __Add Bulk__: add multiple items based on an Excel file input")
+    ui.markdown("\t- __Download__: export collections, or the results of a search, to Excel, CSV or Parquet")
+    ui.markdown("\t- __Search__: search your collections for a given item")
+    ui.markdown("\t- __Summarize__: count the most common values of fields, or totals per group, of a collection")
+    ui.markdown("\t- __Delete__: delete an item from a collection")
+    ui.markdown("\t- __Stats__: see where the time goes and profile a single request")
+    ui.separator().style("padding-top: 50px;")
+    with ui.grid(columns=2):
+        ui.label("Current database: ")
+        ui.label(f"{settings.mongo_database}")
+
+        ui.label("Mongo URI: ")
+        ui.label(f"{settings.mongo_uri}")
+
+        ui.label("Source code: ")
+        ui.link("Go to GitHub!", "https://github.com/EricS0110/what-a-nice-collection-gui")
+
+        ui.label("Source docs: ")
+        ui.link("Go to GitHub Pages!", "https://erics0110.github.io/what-a-nice-collection-gui/")
+
+        ui.label("Available collections: ")
+        session.available_collections_label = ui.label(f"{clean_list_string(available_collections)}")
+
+        ui.label("Search cache: ")
+        session.search_cache_label = ui.label("")
+
+        ui.label("Connection pool: ")
+        session.connection_pool_label = ui.label("")
+
+        if mongo_conn.replica is not None:
+            ui.label("Local replica: ")
+            session.replica_label = ui.label("")
+        ui.timer(5.0, partial(refresh_welcome_stats, session))
+
+        ui.button(text="Close Session", on_click=close_session, color="red")
+
+    ui.separator()
+    ui.markdown("## Collections")
+    ui.label(
+        "Sizes and counts are estimated from the collection metadata, so no documents are scanned. "
+        "Field coverage (the share of documents holding a field) comes from the fields cache."
+    )
+    session.collection_stats_table = ui.table(
+        columns=[
+            {"name": "name", "label": "Collection", "field": "name", "align": "left", "sortable": True},
+            {"name": "documents", "label": "Documents (est.)", "field": "documents", "sortable": True},
+            {"name": "size", "label": "Data size", "field": "size"},
+            {"name": "storage", "label": "Storage size", "field": "storage"},
+            {"name": "indexes", "label": "Indexes (size)", "field": "indexes"},
+            {"name": "avg_document", "label": "Avg document", "field": "avg_document"},
+            {"name": "fields", "label": "Fields", "field": "fields", "sortable": True},
+        ],
+        rows=[],
+        row_key="name",
+    ).classes("w-full")
+    with ui.row():
+        session.collection_coverage_select = ui.select(
+            options=available_collections,
+            label="Field coverage of",
+            on_change=lambda item: show_field_coverage(session, item.value),
+        ).classes("w-64")
+        ui.button(text="REFRESH", color="orange", on_click=lambda: refresh_collection_stats(refresh=True))
+    session.collection_coverage_table = ui.table(
+        columns=[
+            {"name": "field", "label": "Field", "field": "field", "align": "left"},
+            {"name": "coverage", "label": "Documents holding it", "field": "coverage"},
+        ],
+        rows=[],
+        row_key="field",
+    )
+
+
+def build_new_collection_tab(session: UserSession):
+    @timed("handler.add_new_collection", profile=True)
+    async def add_new_collection():
         new_collection_value = new_collection_input_field.value.lower().strip()
-        existing_collections = mongo_conn.get_collections()
+        existing_collections = await mongo_async.get_collections()
         if new_collection_value == "":
             ui.notify("Please enter a collection name")
             return
         if new_collection_value not in existing_collections:
             # add the new collection
             ui.notify("Adding new collection...")
-            mongo_conn.add_collection(new_collection_value)
-            ui.notify(f"Available collections: {mongo_conn.get_collections()}")
+            await mongo_async.add_collection(new_collection_value)
+            ui.notify(f"Available collections: {await mongo_async.get_collections()}")
         else:
             ui.notify("Collection already exists!")
 
-    with ui.tab_panel(new_collection):
-        ui.markdown("# New Collection")
-        ui.markdown("### Name the new collection (lower-case only): ")
-        with ui.card():
-            new_collection_input_field = ui.input(label="new collection")
-            ui.button(text="ADD", color="green", on_click=add_new_collection)
+    ui.markdown("# New Collection")
+    ui.markdown("### Name the new collection (lower-case only): ")
+    with ui.card():
+        new_collection_input_field = ui.input(label="new collection")
+        ui.button(text="ADD", color="green", on_click=add_new_collection)
 
-    # Set up the "Add One" tab environment
-    current_add_one_fields = {}
-    current_add_one_fields_enums = {}
+
+def build_add_one_tab(session: UserSession):
+    def add_one_item_data() -> tuple[dict, list[str]]:
+        """
+        Coerces the filled in Add One fields to the types of the collection, the same way a bulk upload is coerced
+        :return: Tuple of the item document and the list of the fields whose values don't fit their type
+        """
+        input_values = {}
+        for k, v in session.current_add_one_fields_enums.items():
+            input_value = session.current_add_one_fields[k].value
+            if input_value not in ("", None):
+                input_values[v] = input_value
+        if not input_values:
+            return {}, []
+        import pandas as pd
+
+        from schema import coerce_chunk, frame_documents
+
+        coerced, rejected = coerce_chunk(pd.DataFrame([input_values]), session.current_add_one_schema)
+        if not rejected.empty:
+            return {}, rejected["Rejected fields"].iloc[0].split(", ")
+        return frame_documents(coerced)[0], []
 
     def check_new_item():
-        global add_item_button
-        these_fields = current_add_one_fields
-        these_fields_enums = current_add_one_fields_enums
-        item_data = {}
+        item_data, rejected_fields = add_one_item_data()
+        if rejected_fields:
+            ui.notify(f"Please check the value of {clean_list_string(rejected_fields)}", type="warning")
+            session.add_item_button.disable()
+            return
         check_label_string = "Please verify item...\n\n"
-        for k, v in these_fields_enums.items():
-            input_value = these_fields[k].value
-            if input_value != "":
-                item_data[v] = these_fields[k].value
-                check_label_string += f"{v}: {these_fields[k].value} \n\n"
-                # ui.notify(f"{v}: {these_fields[k].value}")
+        for field, value in item_data.items():
+            check_label_string += f"{field}: {value} \n\n"
         add_one_check_label.set_content(check_label_string)
-        add_item_button.enable()
+        session.add_item_button.enable()
 
-    def add_one_item():
-        global add_item_button
+    @timed("handler.add_one_item", profile=True)
+    async def add_one_item():
+        this_collection = session.collection_selection.value
+        item_data, rejected_fields = add_one_item_data()
+        if rejected_fields:
+            ui.notify(f"Please check the value of {clean_list_string(rejected_fields)}", type="warning")
+            return
         ui.notify("Adding item...")
-        this_collection = collection_selection.value
-        these_fields = current_add_one_fields
-        these_fields_enums = current_add_one_fields_enums
-        item_data = {}
-        for k, v in these_fields_enums.items():
-            input_value = these_fields[k].value
-            if input_value != "":
-                item_data[v] = these_fields[k].value
-        mongo_conn.add_item(this_collection, item_data)
+        await mongo_async.add_item(this_collection, item_data)
         ui.notify(f"Item added to {this_collection}")
         add_one_check_label.set_content("Enter next item details if desired...")
-        add_item_button.disable()
+        session.add_item_button.disable()
         return
 
-    with ui.tab_panel(add_one_tab):
-        ui.markdown("# Add One Item")
-        ui.separator()
-        with ui.row():
-            with ui.column():
-                with ui.row():
-                    with ui.card():
-                        ui.markdown("### Select a collection:")
-                        collection_selection = ui.select(
-                            options=mongo_conn.get_collections(), on_change=lambda item: update_add_one_card(item.value)
-                        ).classes("w-full bg-gray-200 shadow-lg text-lg")
-                    with ui.column():
-                        ui.button(text="Check", on_click=check_new_item, color="orange")
-                        add_item_button = ui.button(text="ADD", on_click=add_one_item, color="green")
-                        add_item_button.disable()
-
-                add_one_fields_card = ui.card()
-
-                def update_add_one_card(value):
-                    current_add_one_fields.clear()
-                    current_add_one_fields_enums.clear()
-                    add_one_fields_card.clear()
-                    with add_one_fields_card:
-                        for field in fields_cache[value]:
-                            with ui.row():
-                                if field != "_id":
-                                    this_add_one_field = ui.input(label=field)
-                                    current_add_one_fields[this_add_one_field.id] = this_add_one_field
-                                    current_add_one_fields_enums[this_add_one_field.id] = field
-                    add_one_fields_card.update()
-                    add_item_button.disable()
-                    return
+    def add_one_input(field: str, field_type: str | None):
+        # The input of a field follows the type its values have in the collection
+        if field_type == "int":
+            return ui.number(label=field, precision=0)
+        if field_type == "double":
+            return ui.number(label=field)
+        if field_type == "bool":
+            return ui.select({True: "Yes", False: "No"}, label=field, clearable=True).classes("w-48")
+        if field_type == "date":
+            return ui.input(label=field).props("type=date stack-label")
+        return ui.input(label=field)
+
+    ui.markdown("# Add One Item")
+    ui.separator()
+    with ui.row():
+        with ui.column():
+            with ui.row():
+                with ui.card():
+                    ui.markdown("### Select a collection:")
+                    session.collection_selection = ui.select(
+                        options=available_collections, on_change=lambda item: session.update_add_one_card(item.value)
+                    ).classes("w-full bg-gray-200 shadow-lg text-lg")
+                with ui.column():
+                    ui.button(text="Check", on_click=check_new_item, color="orange")
+                    session.add_item_button = ui.button(text="ADD", on_click=add_one_item, color="green")
+                    session.add_item_button.disable()
 
-            with ui.column():
-                add_one_check_label = ui.markdown("Please select a collection to begin...")
+            add_one_fields_card = ui.card()
 
-    # Set up the "Add Bulk" tab environment
-    with ui.tab_panel(add_bulk_tab) as bulk_tab_panel:
-        with open(Path(src_dir / "bulk_import.md"), "r") as bulk_import_readme_file:
-            bulk_import_markdown_content = bulk_import_readme_file.read()
+            def update_add_one_card(value):
+                session.current_add_one_fields.clear()
+                session.current_add_one_fields_enums.clear()
+                session.current_add_one_schema.clear()
+                session.current_add_one_schema.update(mongo_conn.collection_schema(value))
+                add_one_fields_card.clear()
+                with add_one_fields_card:
+                    for field in fields_cache.get(value, []):
+                        with ui.row():
+                            if field != "_id":
+                                this_add_one_field = add_one_input(field, session.current_add_one_schema.get(field))
+                                session.current_add_one_fields[this_add_one_field.id] = this_add_one_field
+                                session.current_add_one_fields_enums[this_add_one_field.id] = field
+                add_one_fields_card.update()
+                session.add_item_button.disable()
+                return
 
-        def upload_bulk_items():
-            global bulk_upload_data
-            global bulk_upload_file
-            if bulk_upload_file is not None:
-                ui.notify("File loaded, now sending to MongoDB")
-                mongo_conn.upload_bulk(bulk_upload_data)
-                ui.notify("Data uploaded to MongoDB")
-                global confirm_upload_button
-                confirm_upload_button.disable()
-            else:
-                ui.notify("No file uploaded, please select a file")
+            session.update_add_one_card = update_add_one_card
+
+        with ui.column():
+            add_one_check_label = ui.markdown("Please select a collection to begin...")
+
+
+def build_add_bulk_tab(session: UserSession, bulk_tab_panel: ui.tab_panel):
+    import pandas as pd
+
+    from ingest import UPLOAD_ACCEPT, UploadedWorkbook, spool_upload
+    from schema import UPLOAD_ERROR_COLUMN, field_name_error, join_failed_rows
+
+    bulk_import_markdown_content = read_markdown("bulk_import.md")
+
+    def keep_failed_rows(collection: str, failed: pd.DataFrame):
+        # Only the first rows are kept for download, so a file failing as a whole can't use up the app's memory
+        kept_rows = sum(len(frame) for frames in session.bulk_upload_failed.values() for frame in frames)
+        room = settings.bulk_upload_failed_rows_max - kept_rows
+        if not failed.empty and room > 0:
+            session.bulk_upload_failed.setdefault(collection, []).append(failed.head(room))
+        return
+
+    @timed("handler.download_failed_rows", profile=True)
+    async def download_failed_rows():
+        if not session.bulk_upload_failed:
+            ui.notify("No failed rows to download")
             return
 
-        def reset_bulk_tab_panel():
-            global bulk_upload_file
-            bulk_upload_file = None
-            bulk_tab_panel.clear()
-            with bulk_tab_panel:
-                ui.markdown(bulk_import_markdown_content)
-                with ui.row():
-                    ui.upload(label="SELECT YOUR FILE", on_upload=add_bulk_items)
-                    ui.button(
-                        text="RESET",
-                        on_click=reset_bulk_tab_panel,
-                        color="orange",
+        def failed_sheets():
+            for collection, frames in session.bulk_upload_failed.items():
+                failed = join_failed_rows(frames)
+                # Empty cells stay empty, and every value is written the way an export would write it
+                rows = failed.astype(object).where(failed.notna(), None).values.tolist()
+                yield (
+                    collection,
+                    [str(column) for column in failed.columns],
+                    [[export_value(value, xlsx=True) for value in row] for row in rows],
+                )
+
+        export_dir = Path(tempfile.mkdtemp(prefix="collections_failed_"))
+        export_dirs.append(export_dir)
+        # One sheet per collection, named like the sheet it came from, so the corrected file can be uploaded again
+        failed_path = export_dir / "failed_rows.xlsx"
+        await asyncio.to_thread(write_xlsx, failed_path, failed_sheets())
+        ui.download(failed_path)
+        return
+
+    @timed("handler.upload_bulk_items", profile=True)
+    async def upload_bulk_items():
+        if session.bulk_upload_file is not None:
+            session.confirm_upload_button.disable()
+            batch_size = settings.bulk_upload_batch_size
+            # Row counts come from the file's metadata and may be missing (CSV) or approximate
+            total_rows = sum(sheet.rows or 0 for sheet in session.bulk_upload_data.values())
+            uploaded_rows = sum(
+                min(batches * batch_size, session.bulk_upload_data[collection].rows or batches * batch_size)
+                for collection, batches in session.bulk_upload_resume.items()
+            )
+            failed_rows = 0
+            counts = {"inserted": 0, "updated": 0, "skipped": 0, "rejected": 0}
+            if not session.bulk_upload_resume:
+                session.bulk_upload_failed.clear()
+                session.download_failed_button.disable()
+            key_fields = {
+                collection: key_select.value
+                for collection, key_select in session.bulk_upload_key_selects.items()
+                if key_select.value
+            }
+            ui.notify("File loaded, now sending to MongoDB")
+            if settings.bulk_upload_workers > 1:
+                # Large files are parsed, encoded and written by a pool of worker processes
+                uploader = mongo_conn.iter_parallel_upload(
+                    session.bulk_upload_data, batch_size, session.bulk_upload_resume, key_fields=key_fields
+                )
+            else:
+                uploader = mongo_conn.iter_upload_bulk(
+                    session.bulk_upload_data, batch_size, session.bulk_upload_resume, key_fields=key_fields
+                )
+            session.uploading = True
+            try:
+                async for batch in mongo_async.iterate(uploader):
+                    if session.closed:
+                        # The browser tab is gone, the batches written so far stay written
+                        break
+                    session.bulk_upload_resume[batch["collection"]] = batch["batch"] + 1
+                    uploaded_rows += batch["rows"]
+                    failed_rows += len(batch["failed_rows"])
+                    keep_failed_rows(batch["collection"], batch["failed_rows"])
+                    for count in counts:
+                        counts[count] += batch[count]
+                    session.bulk_upload_progress.set_value(min(uploaded_rows / total_rows, 1) if total_rows else 0)
+                    session.bulk_upload_status.set_text(
+                        f"{batch['collection']}: batch {batch['batch'] + 1} of {batch['batches'] or '?'}, "
+                        f"{uploaded_rows} rows sent, {batch['rows_per_second']:.0f} rows/s, "
+                        f"{counts['inserted']} inserted, {counts['updated']} updated, "
+                        f"{counts['skipped']} duplicates skipped, {counts['rejected']} rows rejected, "
+                        f"{failed_rows} failed rows so far"
+                    )
+                    for error in batch["errors"]:
+                        print(f"Bulk upload error in {batch['collection']}: {error}")
+            except (PyMongoError, BSONError, ValueError) as upload_error:
+                ui.notify(f"Upload stopped ({upload_error}), click CONFIRM UPLOAD to resume", type="negative")
+                session.confirm_upload_button.enable()
+                return
+            finally:
+                session.uploading = False
+                if session.bulk_upload_failed and not session.closed:
+                    session.download_failed_button.enable()
+            if session.closed:
+                # Stops the worker processes of a parallel upload, then removes the spooled file end_session left.
+                # Closing waits for the tasks the workers are running, so it happens on the database thread pool.
+                await asyncio.get_running_loop().run_in_executor(mongo_async.executor, uploader.close)
+                session.close_upload()
+                return
+            session.bulk_upload_resume = {}
+            session.bulk_upload_progress.set_value(1)
+            if failed_rows:
+                ui.notify(
+                    f"Data uploaded to MongoDB, {failed_rows} rows failed ({counts['rejected']} rejected before "
+                    "sending), click DOWNLOAD FAILED ROWS to correct and upload them again",
+                    type="warning",
+                )
+            else:
+                ui.notify("Data uploaded to MongoDB")
+        else:
+            ui.notify("No file uploaded, please select a file")
+        return
+
+    def reset_bulk_tab_panel():
+        if session.bulk_upload_file is not None:
+            session.bulk_upload_file.close()
+        session.bulk_upload_file = None
+        session.bulk_upload_resume = {}
+        session.bulk_upload_key_selects.clear()
+        session.bulk_upload_failed.clear()
+        bulk_tab_panel.clear()
+        with bulk_tab_panel:
+            ui.markdown(bulk_import_markdown_content)
+            with ui.row():
+                ui.upload(label="SELECT YOUR FILE", on_upload=add_bulk_items).props(f"accept={UPLOAD_ACCEPT}")
+                ui.button(
+                    text="RESET",
+                    on_click=reset_bulk_tab_panel,
+                    color="orange",
+                )
+                if session.confirm_upload_button is not None:
+                    session.confirm_upload_button = ui.button(
+                        text="CONFIRM UPLOAD", on_click=upload_bulk_items, color="green"
                     )
-                    global confirm_upload_button
-                    if confirm_upload_button is not None:
-                        confirm_upload_button = ui.button(
-                            text="CONFIRM UPLOAD", on_click=upload_bulk_items, color="green"
+                session.confirm_upload_button.disable()
+                session.download_failed_button = ui.button(
+                    text="DOWNLOAD FAILED ROWS", on_click=download_failed_rows, color="red"
+                )
+                session.download_failed_button.disable()
+            session.bulk_upload_progress = ui.linear_progress(value=0, show_value=False)
+            session.bulk_upload_status = ui.label("")
+
+    def df_to_table(input_df: pd.DataFrame):
+        return_columns = []
+        return_rows = []
+
+        df_head = input_df.head(n=10)
+
+        for col in input_df.columns:
+            return_columns.append(
+                {
+                    "name": col,
+                    "label": col,
+                    "field": col,
+                }
+            )
+        if not input_df.empty:
+            return_rows = df_head.to_dict(orient="records")
+
+        return return_columns, return_rows
+
+    @timed("handler.add_bulk_items", profile=True)
+    def add_bulk_items(e: events.UploadEventArguments):
+        if e.content is not None:
+            session.bulk_upload_resume = {}
+            session.bulk_upload_key_selects.clear()
+            if session.confirm_upload_button is not None:
+                session.confirm_upload_button.enable()
+            if session.bulk_upload_file is not None:
+                session.bulk_upload_file.close()
+            # Spool the upload to disk and only parse the rows that are needed for the previews
+            spooled_path = spool_upload(e.content, e.name)
+            try:
+                session.bulk_upload_file = UploadedWorkbook(spooled_path, file_name=e.name)
+            except ValueError as upload_error:
+                spooled_path.unlink(missing_ok=True)
+                session.bulk_upload_file = None
+                session.confirm_upload_button.disable()
+                ui.notify(str(upload_error), type="negative")
+                return
+            bulk_excel = session.bulk_upload_file.sheets()
+            with bulk_tab_panel:
+                ui.label(f"File Uploaded: {e.name}")
+                for sheet_name, sheet in bulk_excel.items():
+                    ui.label(f"Sheet: {sheet_name}")
+                    sheet_head = sheet.head(n=10).drop(columns=[UPLOAD_ERROR_COLUMN], errors="ignore")
+                    bad_columns = [
+                        f"{column} {field_name_error(column)}"
+                        for column in sheet_head.columns
+                        if field_name_error(column) is not None
+                    ]
+                    if bad_columns:
+                        # Rows with a value in these columns are rejected by the upload, the rest still go through
+                        ui.label(f"Column {'; '.join(bad_columns)}: rows using it won't be stored").classes(
+                            "text-orange-700"
                         )
-                    confirm_upload_button.disable()
+                    with span("table.dataframe"):
+                        columns, rows = df_to_table(sheet_head)
+                    session.bulk_upload_key_selects[sheet_name] = ui.select(
+                        options=[str(column) for column in sheet_head.columns],
+                        multiple=True,
+                        value=[],
+                        label="Upsert on (leave empty to insert every row)",
+                    ).classes("w-96")
+                    ui.table(columns=columns, rows=rows)
+            session.bulk_upload_data = bulk_excel
 
-        def df_to_table(input_df: pd.DataFrame):
-            return_columns = []
-            return_rows = []
+    ui.markdown(bulk_import_markdown_content)
+    with ui.row():
+        ui.upload(label="SELECT A FILE!", on_upload=add_bulk_items).props(f"accept={UPLOAD_ACCEPT}")
+        ui.button(text="RESET", on_click=reset_bulk_tab_panel, color="orange")
+        # noinspection PyRedeclaration
+        session.confirm_upload_button = ui.button(text="CONFIRM UPLOAD", on_click=upload_bulk_items, color="green")
+        session.confirm_upload_button.disable()
+        session.download_failed_button = ui.button(
+            text="DOWNLOAD FAILED ROWS", on_click=download_failed_rows, color="red"
+        )
+        session.download_failed_button.disable()
+    session.bulk_upload_progress = ui.linear_progress(value=0, show_value=False)
+    session.bulk_upload_status = ui.label("")
 
-            df_head = input_df.head(n=10)
 
-            for col in input_df.columns:
-                return_columns.append(
-                    {
-                        "name": col,
-                        "label": col,
-                        "field": col,
-                    }
+def build_export_tab(session: UserSession):
+    @timed("handler.export_collection_items", profile=True)
+    async def export_collection_items():
+        export_search = {}
+        if export_search_checkbox.value:
+            if session.search_query_picked is None:
+                ui.notify("Run a search first, or untick the search results option")
+                return
+            search_collection_value, search_field_value, search_value, search_mode = session.search_query_picked
+            export_collections = [search_collection_value]
+            export_search = {
+                "search_field": search_field_value,
+                "search_value": search_value,
+                "search_mode": search_mode,
+            }
+        else:
+            export_collections = session.export_collections_select.value
+            if not export_collections:
+                ui.notify("Please select at least one collection")
+                return
+        # Each export gets its own directory, the file is streamed to the browser from disk
+        export_dir = Path(tempfile.mkdtemp(prefix="collections_export_"))
+        export_dirs.append(export_dir)
+        export_button.disable()
+        ui.notify("Preparing the export, this can take a while for large collections...")
+        try:
+            export_path = await mongo_async.export_collections(
+                export_dir / "collections_export",
+                export_collections,
+                export_format_select.value,
+                **export_search,
+            )
+        except (PyMongoError, ValueError) as export_error:
+            ui.notify(f"Export failed: {export_error}", type="negative")
+            return
+        finally:
+            export_button.enable()
+        ui.download(export_path)
+        return
+
+    ui.markdown("# Download")
+    ui.markdown(
+        "Download whole collections, or the results of the last search, as an Excel workbook (one sheet per "
+        "collection, the same layout as the bulk upload), a CSV file or a Parquet file."
+    )
+    with ui.card():
+        session.export_collections_select = ui.select(
+            options=available_collections, multiple=True, value=[], label="Collections"
+        ).classes("w-full bg-gray-200 shadow-lg text-lg")
+        export_format_select = ui.select(options=list(EXPORT_FORMATS), value="xlsx", label="Format").classes("w-full")
+        export_search_checkbox = ui.checkbox("Only export the results of the last search")
+        export_button = ui.button(text="EXPORT", color="green", on_click=export_collection_items)
+
+
+def build_search_tab(session: UserSession):
+    with ui.row():
+        with ui.column():
+            with ui.card():
+                ui.markdown("### Select a collection:")
+                session.search_collection_select = ui.select(
+                    options=available_collections, on_change=lambda item: update_search_card(item.value)
+                ).classes("w-full bg-gray-200 shadow-lg text-lg")
+                ui.markdown("#### Select a field to search:")
+                session.search_fields = ui.select(
+                    options=["Select a collection first"], on_change=lambda item: prepare_search(item.value)
+                ).classes("w-full bg-gray-200 shadow-lg text-lg")
+                session.search_fields.disable()
+                ui.markdown("##### Enter the search value:")
+                search_value_input = ui.input(label="Search Value")
+                search_mode_select = ui.select(options=SEARCH_MODES, value="contains", label="Search Mode").classes(
+                    "w-full"
                 )
-            if not input_df.empty:
-                return_rows = df_head.to_dict(orient="records")
-
-            return return_columns, return_rows
-
-        def add_bulk_items(e: events.UploadEventArguments):
-            global bulk_upload_data
-            global bulk_upload_file
-            if e.content is not None:
-                if confirm_upload_button is not None:
-                    confirm_upload_button.enable()
-                bulk_upload_file = e.content.read()
-                mocked_excel_file = BytesIO(bulk_upload_file)
-                bulk_excel = pd.read_excel(mocked_excel_file, sheet_name=None)
-                with bulk_tab_panel:
-                    ui.label(f"File Uploaded: {e.name}")
-                    for sheet_name, df in bulk_excel.items():
-                        ui.label(f"Sheet: {sheet_name}")
-                        columns, rows = df_to_table(df)
-                        ui.table(columns=columns, rows=rows)
-                bulk_upload_data = bulk_excel
-
-        ui.markdown(bulk_import_markdown_content)
-        with ui.row():
-            ui.upload(label="SELECT A FILE!", on_upload=add_bulk_items)
-            ui.button(text="RESET", on_click=reset_bulk_tab_panel, color="orange")
-            # noinspection PyRedeclaration
-            confirm_upload_button = ui.button(text="CONFIRM UPLOAD", on_click=upload_bulk_items, color="green")
-            confirm_upload_button.disable()
 
-    # Set up the "Export" tab environment
-    with ui.tab_panel(export_tab):
-        ui.label("This is where I need to code up for Excel exports")  # TODO: Add export functionality
+                def update_search_card(value):
+                    session.current_search_fields.clear()
+                    session.current_search_fields_enums.clear()
+                    session.search_collection_picked = value
+                    search_options = [item for item in fields_cache.get(value, []) if item != "_id"]
+                    session.search_fields.set_options(search_options)
+                    session.search_fields.enable()
+                    return
 
-    # Set up the "Search" tab environment
-    current_search_fields = {}
-    current_search_fields_enums = {}
+                def prepare_search(value):
+                    session.search_button.enable()
+                    session.search_field_picked = value
 
-    with ui.tab_panel(search_tab):
-        with ui.row():
-            with ui.column():
-                with ui.card():
-                    ui.markdown("### Select a collection:")
-                    search_collection_select = ui.select(
-                        options=mongo_conn.get_collections(), on_change=lambda item: update_search_card(item.value)
-                    ).classes("w-full bg-gray-200 shadow-lg text-lg")
-                    ui.markdown("#### Select a field to search:")
-                    search_fields = ui.select(
-                        options=["Select a collection first"], on_change=lambda item: prepare_search(item.value)
-                    ).classes("w-full bg-gray-200 shadow-lg text-lg")
-                    search_fields.disable()
-                    ui.markdown("##### Enter the search value:")
-                    search_value_input = ui.input(label="Search Value")
+                @timed("handler.search_collection_items", profile=True)
+                async def search_collection_items():
+                    search_collection_value = session.search_collection_picked
+                    search_field_value = session.search_field_picked
+                    search_value = search_value_input.value
+                    if (search_value is not None) and (search_collection_value != "") and (search_field_value != ""):
+                        session.search_query_picked = (
+                            search_collection_value,
+                            search_field_value,
+                            search_value,
+                            search_mode_select.value,
+                        )
+                        session.search_page_last_ids = {}
+                        # Only the displayed fields are fetched, the same ones offered by the fields cache
+                        session.search_results_table.columns = table_columns(
+                            fields_cache.get(search_collection_value, []), sortable=True
+                        )
+                        await load_search_page({**session.search_results_table.pagination, "page": 1})
+                    else:
+                        ui.notify("Please enter a search value")
+                    return
+
+                @timed("handler.load_search_page", profile=True)
+                async def load_search_page(pagination: dict):
+                    if session.search_query_picked is None:
+                        return
+                    search_collection_value, search_field_value, search_value, search_mode = session.search_query_picked
+                    page = pagination["page"]
+                    descending = bool(pagination.get("descending"))
+                    # Paging forward through _id order can start from the last _id of the previous page
+                    page_key = (pagination["rowsPerPage"], pagination.get("sortBy"), descending)
+                    after_id = None
+                    if pagination.get("sortBy") in (None, "_id"):
+                        after_id = session.search_page_last_ids.get((page - 1, *page_key))
+                    page_documents, total = await mongo_async.search_collection_page(
+                        search_collection_value,
+                        search_field_value,
+                        search_value,
+                        page=page,
+                        rows_per_page=pagination["rowsPerPage"],
+                        fields=fields_cache.get(search_collection_value),
+                        sort_by=pagination.get("sortBy"),
+                        descending=descending,
+                        after_id=after_id,
+                        search_mode=search_mode,
+                        raw=True,
+                    )
+                    with span("table.serialize"):
+                        page_columns, session.search_results_data = documents_to_table(page_documents, sortable=True)
+                    if session.search_results_data:
+                        session.search_page_last_ids[(page, *page_key)] = session.search_results_data[-1]["_id"]
+                    if not session.search_results_table.columns:
+                        # Collections missing from the fields cache show whichever fields the page holds
+                        session.search_results_table.columns = page_columns
+                    session.search_results_table.rows = session.search_results_data
+                    session.search_results_table.pagination = {**pagination, "rowsNumber": total}
+                    return
 
-                    def search_df_to_table(input_df: pd.DataFrame):
-                        return_columns = []
-                        return_rows = []
+                @timed("handler.explain_search_items", profile=True)
+                async def explain_search_items():
+                    if session.search_query_picked is None:
+                        ui.notify("Run a search first")
+                        return
+                    try:
+                        explanation = await mongo_async.explain_search(*session.search_query_picked)
+                    except PyMongoError as explain_error:
+                        ui.notify(f"Could not explain the search: {explain_error}", type="negative")
+                        return
+                    scan_warning = " (full collection scan!)" if "COLLSCAN" in explanation["stages"] else ""
+                    search_explain_label.set_content(
+                        f"__Plan:__ {' > '.join(reversed(explanation['stages']))}{scan_warning}\n\n"
+                        f"__Index used:__ {explanation['index'] or 'none'}\n\n"
+                        f"__Keys examined:__ {explanation['keys_examined']}, "
+                        f"__documents examined:__ {explanation['docs_examined']}, "
+                        f"__returned:__ {explanation['returned']} in {explanation['millis']} ms"
+                    )
+                    return
 
-                        for col in input_df.columns:
-                            return_columns.append(
-                                {
-                                    "name": col,
-                                    "label": col,
-                                    "field": col,
-                                }
-                            )
-                        if not input_df.empty:
-                            return_rows = input_df.to_dict(orient="records")
-
-                        for row in return_rows:
-                            for key, value in row.items():
-                                if isinstance(value, ObjectId):
-                                    row[key] = str(value)
-
-                        return return_columns, return_rows
-
-                    def update_search_card(value):
-                        global search_collection_picked
-                        global search_fields
-                        current_search_fields.clear()
-                        current_search_fields_enums.clear()
-                        search_collection_picked = value
-                        search_options = [item for item in fields_cache[value] if item != "_id"]
-                        search_fields.set_options(search_options)
-                        search_fields.enable()
+                async def refresh_search_indexes():
+                    if session.search_collection_picked == "":
                         return
+                    search_indexes_table.rows = [
+                        {**index, "fields": clean_list_string(index["fields"])}
+                        for index in await mongo_async.list_indexes(session.search_collection_picked)
+                    ]
+                    suggestions = await mongo_async.suggest_indexes(session.search_collection_picked)
+                    search_index_suggestions.set_text(
+                        f"Suggested fields to index: {clean_list_string(suggestions) or 'none'}"
+                    )
+                    return
 
-                    def prepare_search(value):
-                        global search_button
-                        global search_field_picked
-                        search_button.enable()
-                        search_field_picked = value
-
-                    def search_collection_items():
-                        global search_collection_picked
-                        global search_field_picked
-                        global search_results_data
-                        global search_results_table
-                        search_collection_value = search_collection_picked
-                        search_field_value = search_field_picked
-                        search_value = search_value_input.value
-                        search_results_data = []
-                        if (
-                            (search_value is not None)
-                            and (search_collection_value != "")
-                            and (search_field_value != "")
-                        ):
-                            search_results_data = mongo_conn.search_collection(
-                                search_collection_value, search_field_value, search_value
-                            )
-                            search_results_df = pd.DataFrame(search_results_data)
-                            res_cols, res_rows = search_df_to_table(search_results_df)
-                            search_results_table.columns = res_cols
-                            search_results_table.rows = res_rows
-                        else:
-                            ui.notify("Please enter a search value")
+                async def create_search_index_click():
+                    if session.search_collection_picked == "" or session.search_field_picked == "":
+                        ui.notify("Please select a collection and a field first")
+                        return
+                    try:
+                        index_name = await mongo_async.create_search_index(
+                            session.search_collection_picked, session.search_field_picked, search_mode_select.value
+                        )
+                    except PyMongoError as index_error:
+                        ui.notify(f"Could not create the index: {index_error}", type="negative")
                         return
+                    ui.notify(f"Index {index_name} created on {session.search_collection_picked}")
+                    await refresh_search_indexes()
+                    return
+
+            with ui.row():
+                session.search_button = ui.button(text="SEARCH", color="green", on_click=search_collection_items)
+                session.search_button.disable()
+                ui.button(text="EXPLAIN", color="orange", on_click=explain_search_items)
+            search_explain_label = ui.markdown("")
+            with ui.expansion("Indexes", on_value_change=lambda e: refresh_search_indexes() if e.value else None):
+                search_indexes_table = ui.table(
+                    columns=[
+                        {"name": "name", "label": "Index", "field": "name"},
+                        {"name": "fields", "label": "Fields", "field": "fields"},
+                        {"name": "kind", "label": "Kind", "field": "kind"},
+                        {"name": "collation", "label": "Collation", "field": "collation"},
+                    ],
+                    rows=[],
+                    row_key="name",
+                )
+                search_index_suggestions = ui.label("")
+                ui.button(text="INDEX SELECTED FIELD FOR THIS MODE", color="green", on_click=create_search_index_click)
+        with ui.column().classes("w-full"):
+            ui.markdown("#### Search Results:")
+            session.search_results_table = ui.table(
+                columns=[],
+                rows=[],
+                row_key="_id",
+                pagination={"page": 1, "rowsPerPage": 25, "rowsNumber": 0, "sortBy": None, "descending": False},
+            ).props(":rows-per-page-options=[10,25,50,100]")  # no "All" option, a page is always bounded
+            # Quasar asks for each page with a "request" event, so only the visible page is fetched
+            session.search_results_table.on("request", lambda e: load_search_page(e.args["pagination"]))
+
+
+def show_summary_fields(session: UserSession, collection: str | None):
+    """
+    Offers the fields of the collection picked on the Summarize tab, from the fields cache, in its field selects
+    :param session: the UserSession to update
+    :param collection: string value for the Collection name, None before one is picked
+    :return: None
+    """
+    summary_fields = [item for item in fields_cache.get(collection, []) if item != "_id"]
+    for field_select in (
+        session.summary_filter_field_select,
+        session.summary_facet_fields_select,
+        session.summary_group_fields_select,
+        session.summary_value_field_select,
+    ):
+        field_select.set_options(summary_fields)
+    return
 
-                search_button = ui.button(text="SEARCH", color="green", on_click=search_collection_items)
-                search_button.disable()
-            with ui.column().classes("w-full"):
-                ui.markdown("#### Search Results:")
-                search_results_table = ui.table(columns=[], rows=[])
 
-    # Set up the "Delete" tab environment
-    with ui.tab_panel(delete_tab):
+def build_summary_tab(session: UserSession):
+    def pick_summary_collection(value):
+        session.summary_collection_picked = value
+        session.summary_filters.clear()
+        summary_filters_table.rows = []
+        show_summary_fields(session, value)
+        # The fields picked for the previous collection don't carry over
+        session.summary_filter_field_select.set_value(None)
+        session.summary_facet_fields_select.set_value([])
+        session.summary_group_fields_select.set_value([])
+        session.summary_value_field_select.set_value(None)
+        return
 
-        def update_delete_collection(value):
-            global delete_from_collection
-            delete_from_collection = value
-            delete_id_input.enable()
+    def add_summary_filter():
+        if not session.summary_filter_field_select.value or summary_filter_value_input.value in (None, ""):
+            ui.notify("Please pick a field and enter a value to filter on")
             return
+        session.summary_filters.append(
+            (
+                session.summary_filter_field_select.value,
+                summary_filter_value_input.value,
+                summary_filter_mode_select.value,
+            )
+        )
+        summary_filters_table.rows = [
+            {"id": number, "field": field, "mode": FACET_FILTER_MODES[mode], "value": value}
+            for number, (field, value, mode) in enumerate(session.summary_filters)
+        ]
+        summary_filter_value_input.set_value("")
+        return
 
-        def verify_delete():
-            global delete_button
-            global delete_check_table
-            global delete_id
+    def clear_summary_filters():
+        session.summary_filters.clear()
+        summary_filters_table.rows = []
+        return
 
-            delete_id = delete_id_input.value
-            delete_check_results = mongo_conn.search_collection(delete_from_collection, "_id", delete_id)
-            if not delete_check_results:
-                ui.notify(f"No item found with ID: {delete_id}")
-            else:
-                delete_check_df = pd.DataFrame(delete_check_results)
-                delete_check_cols, delete_check_rows = search_df_to_table(delete_check_df)
-                delete_check_table.columns = delete_check_cols
-                delete_check_table.rows = delete_check_rows
-                delete_button.enable()
+    @timed("handler.summarize_facets", profile=True)
+    async def summarize_facets():
+        facet_fields = session.summary_facet_fields_select.value or []
+        if not session.summary_collection_picked or not facet_fields:
+            ui.notify("Please select a collection and the fields to summarize")
             return
+        try:
+            summary = await mongo_async.facet_summary(
+                session.summary_collection_picked,
+                list(session.summary_filters),
+                facet_fields,
+                top_n=int(summary_top_n_input.value or settings.facet_top_n),
+                allow_disk_use=summary_disk_checkbox.value,
+            )
+        except PyMongoError as summary_error:
+            ui.notify(f"Could not summarize the collection: {summary_error}", type="negative")
+            return
+        summary_facets_container.clear()
+        with summary_facets_container:
+            ui.markdown(f"__{summary['total']}__ matching documents")
+            with ui.row():
+                for field, facet in summary["facets"].items():
+                    with ui.card():
+                        ui.markdown(f"#### {field}\n\n{facet['distinct']} distinct values")
+                        ui.table(
+                            columns=[
+                                {"name": "value", "label": "Value", "field": "value", "align": "left"},
+                                {"name": "count", "label": "Count", "field": "count", "sortable": True},
+                                {"name": "share", "label": "Share", "field": "share"},
+                            ],
+                            rows=[
+                                {
+                                    "id": number,
+                                    "value": "(missing)" if top["value"] is None else cell_value(top["value"]),
+                                    "count": top["count"],
+                                    "share": f"{top['count'] / summary['total']:.0%}" if summary["total"] else "",
+                                }
+                                for number, top in enumerate(facet["top"])
+                            ],
+                            row_key="id",
+                        )
+        return
 
-        def delete_item_click():
-            global delete_button
-            global delete_check_table
-            global delete_from_collection
-            global delete_id
-            mongo_conn.delete_item(delete_from_collection, delete_id)
-            ui.notify(f"{delete_id} has been deleted from {delete_from_collection}")
-            delete_button.disable()
-            delete_check_table.columns = []
-            delete_check_table.rows = []
+    @timed("handler.summarize_groups", profile=True)
+    async def summarize_groups():
+        group_fields = session.summary_group_fields_select.value or []
+        value_field = session.summary_value_field_select.value
+        if not session.summary_collection_picked or not group_fields:
+            ui.notify("Please select a collection and the fields to group by")
             return
+        try:
+            summary = await mongo_async.group_summary(
+                session.summary_collection_picked,
+                list(session.summary_filters),
+                group_fields,
+                value_field=value_field,
+                limit=settings.group_summary_limit,
+                allow_disk_use=summary_disk_checkbox.value,
+            )
+        except PyMongoError as summary_error:
+            ui.notify(f"Could not group the collection: {summary_error}", type="negative")
+            return
+        summary_columns = group_fields + ["count"] + (["sum", "avg", "min", "max"] if value_field else [])
+        summary_groups_table.columns = table_columns(summary_columns, sortable=True)
+        summary_groups_table.rows = [
+            {"id": number, **{field: cell_value(value) for field, value in row.items()}}
+            for number, row in enumerate(summary["rows"])
+        ]
+        shown = f", showing the largest {len(summary['rows'])}" if summary["groups"] > len(summary["rows"]) else ""
+        summary_groups_label.set_text(f"{summary['groups']} groups{shown}")
+        return
 
-        with open(Path(src_dir / "delete_readme.md"), "r") as delete_readme_file:
-            delete_readme_md = delete_readme_file.read()
-        ui.markdown(delete_readme_md)
+    with ui.row():
+        with ui.column():
+            with ui.card():
+                ui.markdown("### Select a collection:")
+                session.summary_collection_select = ui.select(
+                    options=available_collections, on_change=lambda item: pick_summary_collection(item.value)
+                ).classes("w-full bg-gray-200 shadow-lg text-lg")
+                ui.markdown("#### Only count the documents matching:")
+                session.summary_filter_field_select = ui.select(options=[], label="Field").classes("w-full")
+                summary_filter_mode_select = ui.select(
+                    options=FACET_FILTER_MODES, value="exact", label="Match"
+                ).classes("w-full")
+                summary_filter_value_input = ui.input(label="Value")
+                with ui.row():
+                    ui.button(text="ADD FILTER", color="green", on_click=add_summary_filter)
+                    ui.button(text="CLEAR FILTERS", color="orange", on_click=clear_summary_filters)
+                summary_filters_table = ui.table(
+                    columns=[
+                        {"name": "field", "label": "Field", "field": "field"},
+                        {"name": "mode", "label": "Match", "field": "mode"},
+                        {"name": "value", "label": "Value", "field": "value"},
+                    ],
+                    rows=[],
+                    row_key="id",
+                )
+                summary_top_n_input = ui.number(label="Most common values per field", value=settings.facet_top_n, min=1)
+                summary_disk_checkbox = ui.checkbox("Allow the server to use disk for large groups")
+        with ui.column().classes("w-full"):
+            with ui.card().classes("w-full"):
+                ui.markdown("### Count the values of each field")
+                with ui.row():
+                    session.summary_facet_fields_select = ui.select(
+                        options=[], multiple=True, value=[], label="Fields"
+                    ).classes("w-96")
+                    ui.button(text="SUMMARIZE", color="green", on_click=summarize_facets)
+                summary_facets_container = ui.column().classes("w-full")
+            with ui.card().classes("w-full"):
+                ui.markdown("### Count the documents per group")
+                with ui.row():
+                    session.summary_group_fields_select = ui.select(
+                        options=[], multiple=True, value=[], label="Group by"
+                    ).classes("w-96")
+                    session.summary_value_field_select = ui.select(
+                        options=[], label="Total of (optional)", clearable=True
+                    ).classes("w-64")
+                    ui.button(text="GROUP", color="green", on_click=summarize_groups)
+                summary_groups_label = ui.label("")
+                summary_groups_table = ui.table(columns=[], rows=[], row_key="id").classes("w-full")
+
+
+def build_delete_tab(session: UserSession):
+    from ingest import UPLOAD_ACCEPT, UploadedWorkbook, spool_upload
+
+    def update_delete_collection(value):
+        session.delete_from_collection = value
+        delete_id_input.enable()
+        bulk_delete_field_select.set_options(fields_cache.get(value, []))
+        bulk_delete_button.disable()
+        return
+
+    @timed("handler.verify_delete", profile=True)
+    async def verify_delete():
+        session.delete_id = delete_id_input.value
+        delete_check_results = await mongo_async.search_collection(
+            session.delete_from_collection, "_id", session.delete_id, raw=True
+        )
+        if not delete_check_results:
+            ui.notify(f"No item found with ID: {session.delete_id}")
+        else:
+            with span("table.serialize"):
+                delete_check_cols, delete_check_rows = documents_to_table(delete_check_results)
+            session.delete_check_table.columns = delete_check_cols
+            session.delete_check_table.rows = delete_check_rows
+            session.delete_button.enable()
+        return
+
+    @timed("handler.delete_item_click", profile=True)
+    async def delete_item_click():
+        await mongo_async.delete_item(session.delete_from_collection, session.delete_id)
+        ui.notify(f"{session.delete_id} has been deleted from {session.delete_from_collection}")
+        session.delete_button.disable()
+        session.delete_check_table.columns = []
+        session.delete_check_table.rows = []
+        return
+
+    def bulk_delete_search() -> dict | None:
+        if (
+            session.delete_from_collection == ""
+            or not bulk_delete_field_select.value
+            or not bulk_delete_value_input.value
+        ):
+            ui.notify("Please select a collection and a field, and enter a search value")
+            return None
+        return {
+            "search_field": bulk_delete_field_select.value,
+            "search_value": bulk_delete_value_input.value,
+            "search_mode": bulk_delete_mode_select.value,
+        }
+
+    async def run_bulk_changes(batches, total_rows: int | None):
+        """
+        Steps through a bulk delete/update generator, reporting the progress and a summary row per batch
+        :param batches: generator returned by iter_bulk_delete or iter_bulk_update
+        :param total_rows: number of rows (or documents) the batches cover, if known
+        :return: None
+        """
+        done_rows = 0
+        failed_rows = 0
+        bulk_change_progress.set_value(0)
+        try:
+            async for batch in mongo_async.iterate(batches):
+                if session.closed:
+                    # The browser tab is gone, the batches written so far stay written
+                    return
+                done_rows += batch["requested"]
+                failed_rows += len(batch["errors"])
+                bulk_change_progress.set_value(min(done_rows / total_rows, 1) if total_rows else 0)
+                bulk_change_status.set_text(
+                    f"{batch['collection']}: batch {batch['batch'] + 1} of {batch['batches'] or '?'}, "
+                    f"{done_rows} rows done, {failed_rows} failed or skipped so far"
+                )
+                bulk_change_table.add_rows(
+                    {
+                        **{key: value for key, value in batch.items() if key != "errors"},
+                        "id": f"{batch['collection']}-{batch['batch']}-{done_rows}",
+                        "batch": batch["batch"] + 1,
+                        "errors": len(batch["errors"]),
+                        "seconds": round(batch["seconds"], 3),
+                    }
+                )
+                if len(bulk_change_table.rows) > session.max_summary_rows:
+                    # Only the latest batches stay listed, so a long change doesn't grow the page without bound
+                    bulk_change_table.rows = bulk_change_table.rows[-session.max_summary_rows :]
+                for error in batch["errors"]:
+                    print(f"Bulk change error in {batch['collection']}: {error}")
+        except PyMongoError as change_error:
+            ui.notify(f"Stopped ({change_error}), the batches above were written", type="negative")
+            return
+        bulk_change_progress.set_value(1)
+        ui.notify(f"Done, {failed_rows} rows failed or skipped" if failed_rows else "Done")
+        return
+
+    @timed("handler.dry_run_search_delete", profile=True)
+    async def dry_run_search_delete():
+        search = bulk_delete_search()
+        if search is None:
+            return
+        summary = await mongo_async.dry_run_bulk_delete(session.delete_from_collection, **search)
+        bulk_change_status.set_text(
+            f"Dry run: {summary['matched']} documents in {session.delete_from_collection} match and would be deleted"
+        )
+        if summary["matched"]:
+            bulk_delete_button.enable()
+        return
+
+    @timed("handler.bulk_delete_search", profile=True)
+    async def bulk_delete_search_click():
+        search = bulk_delete_search()
+        if search is None:
+            return
+        bulk_delete_button.disable()
+        summary = await mongo_async.dry_run_bulk_delete(session.delete_from_collection, **search)
+        bulk_change_table.rows = []
+        await run_bulk_changes(
+            mongo_conn.iter_bulk_delete(session.delete_from_collection, **search), summary["matched"]
+        )
+        return
+
+    def load_bulk_change_file(e: events.UploadEventArguments):
+        if session.bulk_change_file is not None:
+            session.bulk_change_file.close()
+            session.bulk_change_file = None
+        bulk_change_apply_button.disable()
+        spooled_path = spool_upload(e.content, e.name)
+        try:
+            session.bulk_change_file = UploadedWorkbook(spooled_path, file_name=e.name)
+        except ValueError as upload_error:
+            spooled_path.unlink(missing_ok=True)
+            ui.notify(str(upload_error), type="negative")
+            return
+        # Offer every column of every sheet to match the rows on
+        key_fields = {"_id": None}
+        for sheet in session.bulk_change_file.sheets().values():
+            key_fields.update(dict.fromkeys(str(column) for column in sheet.head(n=1).columns))
+        bulk_change_key_select.set_options(list(key_fields), value="_id")
+        bulk_change_status.set_text(
+            f"{e.name}: sheets {clean_list_string(session.bulk_change_file.sheet_names)}, click DRY RUN to check it"
+        )
+        return
+
+    def bulk_change_deletes() -> dict:
+        # One list of _ids per sheet, the sheet names are the collections like in the bulk upload
+        return {
+            name: sheet.iter_column("_id", settings.bulk_upload_batch_size)
+            for name, sheet in session.bulk_change_file.sheets().items()
+        }
+
+    @timed("handler.dry_run_bulk_change_file", profile=True)
+    async def dry_run_bulk_change_file():
+        if session.bulk_change_file is None:
+            ui.notify("Please select a file first")
+            return
+        if bulk_change_operation_select.value == "delete":
+            summaries = [
+                await mongo_async.dry_run_bulk_delete(collection, item_ids=item_ids)
+                for collection, item_ids in bulk_change_deletes().items()
+            ]
+            summary_text = "; ".join(
+                f"{summary['collection']}: {summary['matched']} of {summary['requested']} _ids found, "
+                f"{summary['invalid']} invalid"
+                for summary in summaries
+            )
+        else:
+            summaries = await mongo_async.dry_run_bulk_update(
+                session.bulk_change_file.sheets(), bulk_change_key_select.value
+            )
+            unmatched = "inserted" if bulk_change_operation_select.value == "upsert" else "ignored"
+            summary_text = "; ".join(
+                f"{summary['collection']}: {summary['matched']} of {summary['rows']} rows match "
+                f"{summary['documents']} documents, {summary['unmatched']} would be {unmatched}, "
+                f"{summary['skipped']} skipped"
+                for summary in summaries
+            )
+        bulk_change_status.set_text(f"Dry run: {summary_text}")
+        bulk_change_apply_button.enable()
+        return
+
+    @timed("handler.apply_bulk_change_file", profile=True)
+    async def apply_bulk_change_file():
+        if session.bulk_change_file is None:
+            ui.notify("Please select a file first")
+            return
+        bulk_change_apply_button.disable()
+        bulk_change_table.rows = []
+        total_rows = sum(sheet.rows or 0 for sheet in session.bulk_change_file.sheets().values())
+        if bulk_change_operation_select.value == "delete":
+            # One pass over every sheet, so the progress and the summary cover the whole file and a failed
+            # collection stops the deletes of the ones after it
+            await run_bulk_changes(
+                (
+                    batch
+                    for collection, item_ids in bulk_change_deletes().items()
+                    for batch in mongo_conn.iter_bulk_delete(collection, item_ids=item_ids)
+                ),
+                total_rows,
+            )
+        else:
+            await run_bulk_changes(
+                mongo_conn.iter_bulk_update(
+                    session.bulk_change_file.sheets(),
+                    bulk_change_key_select.value,
+                    upsert=bulk_change_operation_select.value == "upsert",
+                ),
+                total_rows,
+            )
+        return
+
+    ui.markdown(read_markdown("delete_readme.md"))
+    with ui.row():
+        # Left Space
+        with ui.column():
+            with ui.card():
+                ui.markdown("### Select a collection:")
+                session.delete_from_collection_select = ui.select(
+                    options=available_collections,
+                    on_change=lambda item: update_delete_collection(item.value),
+                ).classes("w-full bg-gray-200 shadow-lg text-lg")
+                delete_id_input = ui.input(label="Item ID:").classes("w-full")
+                delete_id_input.disable()
+        # Middle Space
+        with ui.column():
+            ui.button(text="VERIFY", color="orange", on_click=verify_delete)
+            session.delete_button = ui.button(text="DELETE", color="red", on_click=delete_item_click)
+            session.delete_button.disable()
+        # Right Space
+        with ui.column():
+            session.delete_check_table = ui.table(columns=[], rows=[])
+
+    ui.separator()
+    ui.markdown("## Bulk delete and update")
+    ui.markdown(
+        "Changes are sent in batches, always run a __DRY RUN__ first to see how many documents they touch. "
+        "Files follow the bulk upload layout: one sheet per collection, named after it. To delete, list the "
+        "`_id`s in an `_id` column; to update, add a column per field to change (empty cells are left as they "
+        "are) and pick the column to match the documents on."
+    )
+    with ui.row():
+        with ui.card():
+            ui.markdown("### Delete everything a search matches in the selected collection")
+            bulk_delete_field_select = ui.select(options=[], label="Field").classes("w-full")
+            bulk_delete_value_input = ui.input(label="Search Value").classes("w-full")
+            bulk_delete_mode_select = ui.select(options=SEARCH_MODES, value="exact", label="Search Mode").classes(
+                "w-full"
+            )
+            with ui.row():
+                ui.button(text="DRY RUN", color="orange", on_click=dry_run_search_delete)
+                bulk_delete_button = ui.button(text="DELETE MATCHES", color="red", on_click=bulk_delete_search_click)
+                bulk_delete_button.disable()
+        with ui.card():
+            ui.markdown("### Apply a file of changes")
+            ui.upload(label="SELECT A FILE", on_upload=load_bulk_change_file).props(f"accept={UPLOAD_ACCEPT}")
+            bulk_change_operation_select = ui.select(
+                options=BULK_CHANGE_OPERATIONS,
+                value="update",
+                label="Operation",
+                on_change=lambda _: bulk_change_apply_button.disable(),
+            ).classes("w-full")
+            bulk_change_key_select = ui.select(
+                options=["_id"],
+                value="_id",
+                label="Match rows on",
+                on_change=lambda _: bulk_change_apply_button.disable(),
+            ).classes("w-full")
+            with ui.row():
+                ui.button(text="DRY RUN", color="orange", on_click=dry_run_bulk_change_file)
+                bulk_change_apply_button = ui.button(text="APPLY", color="red", on_click=apply_bulk_change_file)
+                bulk_change_apply_button.disable()
+    bulk_change_progress = ui.linear_progress(value=0, show_value=False)
+    bulk_change_status = ui.label("")
+    bulk_change_table = ui.table(
+        columns=[
+            {"name": "collection", "label": "Collection", "field": "collection"},
+            {"name": "batch", "label": "Batch", "field": "batch"},
+            {"name": "requested", "label": "Rows", "field": "requested"},
+            {"name": "matched", "label": "Matched", "field": "matched"},
+            {"name": "modified", "label": "Modified", "field": "modified"},
+            {"name": "upserted", "label": "Inserted", "field": "upserted"},
+            {"name": "deleted", "label": "Deleted", "field": "deleted"},
+            {"name": "errors", "label": "Failed/skipped", "field": "errors"},
+            {"name": "seconds", "label": "Seconds", "field": "seconds"},
+        ],
+        rows=[],
+        row_key="id",
+    ).classes("w-full")
+
+
+def build_stats_tab(session: UserSession):
+    ui.markdown("# Stats")
+    ui.markdown(
+        "Latency of the database round trips and the instrumented code paths since startup, estimated from "
+        "histogram buckets. The same figures are served in Prometheus format at [/metrics](/metrics)."
+    )
+    session.stats_table = ui.table(
+        columns=[
+            {"name": "name", "label": "Span", "field": "name", "align": "left", "sortable": True},
+            {"name": "count", "label": "Calls", "field": "count", "sortable": True},
+            {"name": "avg_ms", "label": "Avg (ms)", "field": "avg_ms", "sortable": True},
+            {"name": "p50_ms", "label": "p50 (ms)", "field": "p50_ms", "sortable": True},
+            {"name": "p99_ms", "label": "p99 (ms)", "field": "p99_ms", "sortable": True},
+            {"name": "max_ms", "label": "Max (ms)", "field": "max_ms", "sortable": True},
+        ],
+        rows=[],
+        row_key="name",
+    ).classes("w-full")
+    session.stats_histogram_select = ui.select(
+        options=[], label="Histogram", on_change=lambda _: refresh_stats_tab(session)
+    ).classes("w-96")
+    session.stats_chart = ui.echart(
+        {
+            "xAxis": {"type": "category", "data": []},
+            "yAxis": {"type": "value", "name": "calls"},
+            "series": [{"type": "bar", "data": []}],
+        }
+    ).classes("w-full h-64")
+    with ui.card():
+        ui.markdown("### Profile a single request")
         with ui.row():
-            # Left Space
-            with ui.column():
-                with ui.card():
-                    ui.markdown("### Select a collection:")
-                    delete_from_collection_select = ui.select(
-                        options=mongo_conn.get_collections(),
-                        on_change=lambda item: update_delete_collection(item.value),
-                    ).classes("w-full bg-gray-200 shadow-lg text-lg")
-                    delete_id_input = ui.input(label="Item ID:").classes("w-full")
-                    delete_id_input.disable()
-            # Middle Space
-            with ui.column():
-                verify_delete_button = ui.button(text="VERIFY", color="orange", on_click=verify_delete)
-                delete_button = ui.button(text="DELETE", color="red", on_click=delete_item_click)
-                delete_button.disable()
-            # Right Space
-            with ui.column():
-                delete_check_table = ui.table(columns=[], rows=[])
+            session.profiler_engine_select = ui.select(
+                options=[engine for engine in PROFILER_ENGINES if engine == "cProfile" or pyinstrument_available()],
+                value="cProfile",
+                label="Profiler",
+            )
+            ui.button(text="PROFILE NEXT REQUEST", color="orange", on_click=partial(arm_profiler, session))
+        session.profile_report = ui.code("No profile captured yet", language="text").classes("w-full")
+    ui.timer(5.0, partial(refresh_stats_tab, session))
 
 
-def on_shutdown():
-    print("Web window closed. Shutting down...")
+def build_lazy_tab_panel(session: UserSession, e: events.ValueChangeEventArguments):
+    """
+    Builds a tab panel the first time its tab is opened, so the first paint only has to wait for the Welcome tab
+    :param session: the UserSession of the page
+    :param e: change event of the tab panels, its value is the opened tab (or the name of it)
+    :return: None
+    """
+    tab_name = e.value.props["name"] if isinstance(e.value, ui.tab) else e.value
+    if tab_name not in session.lazy_tab_panels:
+        return
+    panel, builder = session.lazy_tab_panels.pop(tab_name)
+    with span(f"ui.build_tab.{tab_name}"), panel:
+        builder(session)
+    return
+
+
+def build_ui(session: UserSession):
+    """
+    Sets up the tabs of a page, building the Welcome tab panel straight away and the others on first use
+    :param session: the UserSession of the page
+    :return: None
+    """
+    ui.page_title("Collections App")
+    with ui.tabs().classes("w-full") as main_tabs:
+        welcome_tab = ui.tab("Welcome")
+        new_collection = ui.tab("New Collection")
+        add_one_tab = ui.tab("Add One")
+        add_bulk_tab = ui.tab("Add Bulk")
+        export_tab = ui.tab("Download")
+        search_tab = ui.tab("Search")
+        summary_tab = ui.tab("Summarize")
+        delete_tab = ui.tab("Delete")
+        stats_tab = ui.tab("Stats")
+    with ui.tab_panels(main_tabs, value=welcome_tab, on_change=partial(build_lazy_tab_panel, session)).classes(
+        "w-full"
+    ):
+        with ui.tab_panel(welcome_tab):
+            build_welcome_tab(session)
+        for tab, builder in (
+            (new_collection, build_new_collection_tab),
+            (add_one_tab, build_add_one_tab),
+            (add_bulk_tab, build_add_bulk_tab),
+            (export_tab, build_export_tab),
+            (search_tab, build_search_tab),
+            (summary_tab, build_summary_tab),
+            (delete_tab, build_delete_tab),
+            (stats_tab, build_stats_tab),
+        ):
+            panel = ui.tab_panel(tab)
+            if builder is build_add_bulk_tab:
+                # The bulk tab panel is cleared and rebuilt by its RESET button
+                builder = partial(builder, bulk_tab_panel=panel)
+            session.lazy_tab_panels[tab.props["name"]] = (panel, builder)
+    return
+
+
+def index_page(client: Client):
+    """
+    Builds the page of one browser tab, with its own UserSession, every page shares the MongoDB connection and the
+    caches behind it
+    :param client: the NiceGUI client of the browser tab
+    :return: None
+    """
+    session = UserSession(client.id)
+    sessions[client.id] = session
+    # Called once the browser tab has gone for longer than the reconnect timeout
+    client.on_disconnect(partial(end_session, session))
+    build_ui(session)
+    # The statistics are refreshed for every session at once (see create_app), a new page shows the last ones
+    show_collection_stats(session)
+    return
+
+
+def create_app(app_settings=None, mongo_client=None):
+    """
+    Sets up the MongoDB connection, the app's lifecycle handlers and the UI, without starting the server.
+    Nothing runs at import time, so the spawned worker processes of a parallel bulk upload (which import this module
+    again) and the startup benchmark (benchmarks/bench_startup.py) don't build the app.
+    :param app_settings: optional Pydantic Settings object, read from mongo.env (see check_credentials) otherwise
+    :param mongo_client: optional ready-made client (e.g. a local mongod for benchmarks) instead of the Atlas one
+    :return: None
+    """
+    global settings, mongo_conn, mongo_async, available_collections, fields_cache
+    # Get MongoDB details and any other application configurations established
+    settings = app_settings or check_credentials()
+
+    # Get a MongoDB connection instance, handlers await its calls through mongo_async to keep the event loop free
+    mongo_conn = MongoConnection(settings, mongo_client=mongo_client)
+    mongo_async = AsyncMongoConnection(mongo_conn)
+
+    # Serve the last stored fields cache straight away, refresh_fields_cache keeps it (and the list of available
+    # collections) up to date in the background instead of holding up the first paint
+    fields_cache = mongo_conn.read_fields_cache()
+    available_collections = list(fields_cache)
+
+    app.get("/metrics")(metrics_endpoint)
+    app.on_startup(warm_up_connection_pool)
+    app.on_startup(refresh_fields_cache)
+    app.on_startup(start_search_cache_watch)
+    app.on_startup(start_catalog_watch)
+    app.on_shutdown(on_shutdown)
+    app.on_connect(report_first_paint)
+    # Shared refreshes run once for all the sessions and push their results into every page
+    app.on_startup(partial(repeat, settings.catalog_ttl_seconds, refresh_collection_stats))
+    app.on_startup(partial(repeat, settings.catalog_sync_seconds, sync_catalog))
+    app.on_startup(partial(repeat, 60.0, prune_sessions))
+    if mongo_conn.replica is not None:
+        app.on_startup(start_replica_watch)
+        app.on_startup(sync_replica)
+        app.on_startup(partial(repeat, settings.replica_sync_seconds, sync_replica))
+    ui.page("/")(index_page)
+    return
 
 
-ui.run(reload=False)
+if __name__ == "__main__":
+    create_app()
+    ui.run(reload=False)
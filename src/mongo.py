@@ -1,34 +1,129 @@
+import asyncio
+import functools
+import itertools
 import json
+import math
+import re
+import tempfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 from bson import ObjectId
-from pymongo import MongoClient
+from pymongo import ASCENDING, TEXT, DeleteOne, MongoClient, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, CollectionInvalid, PyMongoError
 
+from src.cache import ResultCache
+from src.catalog import CollectionCatalog
+from src.export import (
+    EXPORT_FORMATS,
+    export_value,
+    write_csv,
+    write_parquet,
+    write_xlsx,
+)
+from src.monitoring import CommandStatsListener, PoolStatsListener, timed
+from src.replica import LocalReplica
 from src.security import Settings, check_credentials
+from src.serialize import RAW_CODEC_OPTIONS, search_candidates
+
+# pandas and the modules built on it (src.ingest, src.schema, src.parallel) are only imported by the upload and bulk
+# change paths that need them, so they don't slow down the startup of the app
+
+SCHEMA_MODES = ("sample", "incremental", "full")
+SEARCH_MODES = {
+    "contains": "Contains (any case, full scan)",
+    "exact": "Exact match",
+    "prefix": "Starts with (case-sensitive)",
+    "prefix_ci": "Starts with (any case)",
+    "text": "Text search (all text-indexed fields)",
+}
+CASE_INSENSITIVE_COLLATION = {"locale": "en", "strength": 2}
+# Filters of a summary share its aggregation, so the modes needing their own collation (prefix_ci) are left out
+FACET_FILTER_MODES = {mode: label for mode, label in SEARCH_MODES.items() if mode != "prefix_ci"}
+BULK_CHANGE_OPERATIONS = {
+    "update": "Update the matching documents",
+    "upsert": "Update the matching documents, insert the rest",
+    "delete": "Delete the listed _ids",
+}
+
+
+def sheet_chunks(sheet, batch_size: int):
+    """
+    Splits a sheet of upload data into chunks of at most batch_size rows
+    :param sheet: a lazily parsed UploadedSheet (see src/ingest.py) or an already parsed DataFrame
+    :param batch_size: number of rows per chunk
+    :return: Tuple of the chunk generator and the number of rows, None when it isn't known up front
+    """
+    if hasattr(sheet, "iter_chunks"):
+        # Lazily parsed sheets are read one chunk at a time
+        return sheet.iter_chunks(batch_size), sheet.rows
+    from src.ingest import iter_frame_chunks
+
+    return iter_frame_chunks(sheet, batch_size), len(sheet)
+
+
+def clean_fields(fields: list[str]) -> str:
+    return "/".join(map(str, fields))
+
+
+def is_missing(value) -> bool:
+    # Empty cells come out of pandas as None, NaN or NaT, the last two are the only values not equal to themselves
+    return value is None or value != value
 
 
 class MongoConnection:
-    def __init__(self, settings: Settings):
+    def __init__(self, settings: Settings, mongo_client: MongoClient | None = None):
         """
         Create MongoDB connection instance to use throughout the application
         :param settings: Pydantic Settings object that stores application settings
+        :param mongo_client: optional ready-made client (e.g. a local mongod for benchmarks) instead of the Atlas one
         """
         self.settings = settings
-        self.mongo_client = MongoClient(settings.mongo_connection_string)
+        self.pool_stats = PoolStatsListener()
+        if mongo_client is None:
+            mongo_client = MongoClient(
+                settings.mongo_connection_string,
+                event_listeners=[self.pool_stats, CommandStatsListener()],
+                **settings.mongo_client_options,
+            )
+        self.mongo_client = mongo_client
+        # The parallel upload workers open their own clients from this connection string
+        self.client_uri = settings.mongo_connection_string
         self.db = self.mongo_client[settings.mongo_database]
         self.CACHE_PATH = Path(__file__).parent.parent.resolve() / "fields_cache.json"
+        # Search results shared by every session, invalidated whenever this app writes to a collection
+        self.search_cache = ResultCache(settings.search_cache_size, settings.search_cache_ttl_seconds)
+        self.search_cache_watched = False
+        self.catalog = CollectionCatalog(self.db, settings.catalog_ttl_seconds)
+        # The fields cache file is read, updated and written back by the startup refresh and the catalog sync alike
+        self.schema_cache_lock = threading.Lock()
+        # Optional local copy of the collections that answers searches without a round trip (see sync_replica)
+        self.replica = LocalReplica(settings.replica_path) if settings.replica_path else None
+
+    def warm_up(self, connections: int | None = None) -> float:
+        """
+        Opens pool connections up front by pinging the deployment from several threads at once, so the first
+        queries of the first sessions don't pay for server selection, TLS handshakes and authentication
+        :param connections: number of connections to open, defaults to the configured minimum pool size
+        :return: number of seconds the warm-up took
+        """
+        connections = connections or max(self.settings.mongo_min_pool_size, 1)
+        warm_up_started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=connections, thread_name_prefix="mongo-warm-up") as executor:
+            list(executor.map(lambda _: self.db.command("ping"), range(connections)))
+        return time.perf_counter() - warm_up_started
 
+    @timed("mongo.get_collections")
     def get_collections(self) -> [str | None]:
         """
         Retrieves collections present in the established MongoDB instance
         :return: either an empty list [] or a list of the collection names
         """
-        no_collections = []
-        found_collections = [col["name"] for col in self.db.list_collections()]
-        if len(found_collections) == 0:
-            return no_collections
-        else:
-            return found_collections
+        # Served from the catalog, which only asks the server again once its refresh interval has passed
+        return self.catalog.names()
 
     def add_collection(self, collection_value: str):
         """
@@ -37,47 +132,288 @@ class MongoConnection:
         :return: None
         """
         self.db.create_collection(collection_value)
+        self.catalog.add(collection_value)
         return
 
-    def update_fields_cache(self):
+    @timed("mongo.collection_stats")
+    def collection_stats(self, refresh: bool = False) -> list[dict]:
+        """
+        Statistics of every collection from cheap metadata queries, with the field coverage from the schema cache
+        :param refresh: ask the server even if the cached statistics are still valid
+        :return: list of dictionaries of the catalog statistics, the number of fields and the share of documents
+        holding each field
         """
-        Updates the list of available fields in all collections and stores to a JSON file
+        schema_cache = self.read_schema_cache()
+        collection_stats = []
+        for collection, stats in self.catalog.stats(refresh=refresh).items():
+            entry = schema_cache.get(collection, {})
+            documents = entry.get("documents") or 0
+            coverage = (
+                {field: count / documents for field, count in entry.get("counts", {}).items()} if documents else {}
+            )
+            collection_stats.append({**stats, "fields": len(entry.get("fields", [])), "coverage": coverage})
+        return collection_stats
+
+    @timed("mongo.update_fields_cache")
+    def update_fields_cache(
+        self, mode: str = "incremental", collections: list[str] | None = None, sample_size: int = 1000
+    ) -> dict:
+        """
+        Updates the schema details of the collections and stores them to a JSON file
+        :param mode: one of "sample", "incremental" or "full" (see discover_collection_schema)
+        :param collections: optional list of collection names to limit the refresh to, defaults to all collections
+        :param sample_size: number of documents to $sample per collection when using the "sample" mode
+        :return: Dictionary of collection name to the sorted list of its field names
+        """
+        if mode not in SCHEMA_MODES:
+            raise ValueError(f"Unknown schema discovery mode '{mode}', expected one of {SCHEMA_MODES}")
+        found_collections = self.get_collections()
+        with self.schema_cache_lock:
+            schema_cache = self.read_schema_cache()
+            if collections is None:
+                # Refreshing every collection also forgets the collections that have been dropped since the last run
+                schema_cache = {name: entry for name, entry in schema_cache.items() if name in found_collections}
+                collections = found_collections
+            for collection in collections:
+                if collection not in found_collections:
+                    schema_cache.pop(collection, None)
+                    continue
+                schema_cache[collection] = self.discover_collection_schema(
+                    collection, mode=mode, previous=schema_cache.get(collection), sample_size=sample_size
+                )
+            self.write_schema_cache(schema_cache)
+        return {collection: entry["fields"] for collection, entry in schema_cache.items()}
+
+    def watch_catalog(self) -> bool:
+        """
+        Starts following the collections and fields of the database through a change stream (see
+        CollectionCatalog.watch), sync_catalog polls the database instead when it returns False
+        :return: True if the change stream is running
+        """
+        return self.catalog.watch()
+
+    @timed("mongo.sync_replica")
+    def sync_replica(self) -> dict:
+        """
+        Copies the documents added to every collection since the last sync into the local replica, and forgets the
+        collections that have been dropped
+        :return: Dictionary of collection name to the number of documents read from it
+        """
+        if self.replica is None:
+            return {}
+        collections = self.get_collections()
+        for collection in self.replica.collections().keys() - set(collections):
+            self.replica.forget(collection)
+        return {
+            collection: self.replica.sync(self.db[collection], self.settings.export_batch_size)
+            for collection in collections
+        }
+
+    def watch_replica(self) -> bool:
+        """
+        Starts applying the changes of every client to the local replica through a change stream (see
+        LocalReplica.watch), without it only new documents and the writes of this app reach the replica
+        :return: True if the change stream is running
+        """
+        return self.replica is not None and self.replica.watch(self.db)
+
+    def forget_replica_collection(self, collection: str) -> None:
+        """
+        Drops a collection from the local replica after a bulk change this app can't mirror document by document,
+        its searches go to the server until the next sync has copied it again. Not needed while the change stream
+        applies the changes.
+        :param collection: string value for the Collection name
         :return: None
         """
-        found_collections = [col["name"] for col in self.db.list_collections()]
-        fields_cache = {}
-        if len(found_collections) == 0:
-            with open(self.CACHE_PATH, "w") as fields_cache_file:
-                json.dump(fields_cache, fields_cache_file, indent=4)
+        if self.replica is not None and not self.replica.watched:
+            self.replica.forget(collection)
+        return
+
+    @timed("mongo.sync_catalog")
+    def sync_catalog(self) -> dict:
+        """
+        Applies the changes recorded by the catalog since the last call to the fields cache, scanning only the
+        documents added to the changed collections since their last scan and merging in the fields updates have set
+        :return: Dictionary of the "collections" in the database, the "changed" and "dropped" collection names and the
+        "fields" of each collection
+        """
+        if not self.catalog.watched:
+            self.catalog.poll_changes()
+        changes, dropped = self.catalog.pop_changes()
+        collections = self.get_collections()
+        if not changes and not dropped:
+            return {"collections": collections, "changed": [], "dropped": [], "fields": None}
+        # Dropped collections are missing from the catalog, so update_fields_cache forgets them
+        self.update_fields_cache("incremental", sorted(changes.keys() | dropped))
+        with self.schema_cache_lock:
+            schema_cache = self.read_schema_cache()
+            updated_fields = {
+                collection: set(fields) - set(schema_cache[collection]["counts"])
+                for collection, fields in changes.items()
+                if fields and collection in schema_cache
+            }
+            for collection, fields in updated_fields.items():
+                # The number of documents holding a field only an update has set is unknown until a full refresh
+                entry = schema_cache[collection]
+                entry["counts"].update(dict.fromkeys(fields, 0))
+                entry["fields"] = sorted(entry["counts"])
+            if any(updated_fields.values()):
+                self.write_schema_cache(schema_cache)
+        return {
+            "collections": collections,
+            "changed": sorted(changes),
+            "dropped": sorted(dropped),
+            "fields": {collection: entry["fields"] for collection, entry in schema_cache.items()},
+        }
+
+    @timed("mongo.discover_collection_schema")
+    def discover_collection_schema(
+        self, collection: str, mode: str = "incremental", previous: dict | None = None, sample_size: int = 1000
+    ) -> dict:
+        """
+        Discovers the fields of a single collection, along with per-field counts and observed BSON types
+        - "sample": $sample a bounded number of documents, merging any new fields into the previous entry
+        - "incremental": only scan documents with an _id above the high-water mark of the previous entry
+        - "full": scan every document in the collection
+        :param collection: string value for the Collection name
+        :param mode: one of "sample", "incremental" or "full"
+        :param previous: the previously cached entry for this collection, if any
+        :param sample_size: number of documents to $sample when using the "sample" mode
+        :return: Dictionary with the "fields", "counts", "types", "documents" and "last_id" of the collection
+        """
+        if mode not in SCHEMA_MODES:
+            raise ValueError(f"Unknown schema discovery mode '{mode}', expected one of {SCHEMA_MODES}")
+        active_collection = self.db[collection]
+        last_id = previous.get("last_id") if previous else None
+        if mode == "incremental" and last_id is None:
+            # Nothing to resume from, so the first incremental run has to look at everything
+            mode = "full"
+
+        if mode == "sample":
+            first_stage = [{"$sample": {"size": sample_size}}]
+            high_water_mark = last_id
         else:
-            for collection in found_collections:
-                active_collection = self.db[collection]
-                # Pipeline to get all unique field names in the collection
-                pipeline = [
-                    {"$project": {"arrayofkeyvalue": {"$objectToArray": "$$ROOT"}}},
-                    {"$unwind": "$arrayofkeyvalue"},
-                    {"$group": {"_id": None, "allkeys": {"$addToSet": "$arrayofkeyvalue.k"}}},
-                ]
+            # Take the high-water mark before scanning so documents added mid-scan are picked up next time
+            newest = active_collection.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+            newest_id = newest["_id"] if newest else None
+            high_water_mark = str(newest_id) if isinstance(newest_id, ObjectId) else None
+            id_range = {"$gt": ObjectId(last_id)} if mode == "incremental" else {}
+            if high_water_mark is not None:
+                id_range["$lte"] = newest_id
+            first_stage = [{"$match": {"_id": id_range}}] if id_range else []
+
+        # Pipeline to count every field name and the BSON types it holds in the matched documents
+        pipeline = first_stage + [
+            {"$project": {"arrayofkeyvalue": {"$objectToArray": "$$ROOT"}}},
+            {"$unwind": "$arrayofkeyvalue"},
+            {
+                "$group": {
+                    "_id": {"field": "$arrayofkeyvalue.k", "type": {"$type": "$arrayofkeyvalue.v"}},
+                    "count": {"$sum": 1},
+                }
+            },
+        ]
+        scanned_counts = {}
+        scanned_types = {}
+        for result in active_collection.aggregate(pipeline):
+            field = result["_id"]["field"]
+            scanned_counts[field] = scanned_counts.get(field, 0) + result["count"]
+            scanned_types.setdefault(field, set()).add(result["_id"]["type"])
+        scanned_documents = scanned_counts.get("_id", 0)
+
+        if mode == "full" or not previous:
+            counts = scanned_counts
+            types = scanned_types
+            documents = scanned_documents
+        else:
+            types = {field: set(field_types) for field, field_types in previous.get("types", {}).items()}
+            for field, field_types in scanned_types.items():
+                types.setdefault(field, set()).update(field_types)
+            if mode == "incremental":
+                counts = dict(previous.get("counts", {}))
+                for field, count in scanned_counts.items():
+                    counts[field] = counts.get(field, 0) + count
+                documents = previous.get("documents", 0) + scanned_documents
+            else:
+                # A sample can only add new fields, the exact counts stay with the last full/incremental scan
+                counts = dict(previous.get("counts", {}))
+                for field in scanned_counts:
+                    counts.setdefault(field, 0)
+                documents = previous.get("documents", 0)
+
+        return {
+            "fields": sorted(counts),
+            "counts": counts,
+            "types": {field: sorted(field_types) for field, field_types in types.items()},
+            "documents": documents,
+            "last_id": high_water_mark,
+        }
 
-                # Run the aggregation pipeline
-                result = list(active_collection.aggregate(pipeline))
+    def read_schema_cache(self) -> dict:
+        """
+        Loads in the stored JSON schema details for each collection
+        :return: Dictionary of collection name to its schema entry, empty if no cache has been written yet
+        """
+        if not self.CACHE_PATH.exists():
+            return {}
+        with open(self.CACHE_PATH, "r") as fields_cache_file:
+            schema_cache = json.load(fields_cache_file)
+        for collection, entry in schema_cache.items():
+            if isinstance(entry, list):
+                # Older caches only stored the list of field names
+                schema_cache[collection] = {
+                    "fields": entry,
+                    "counts": {field: 0 for field in entry},
+                    "types": {},
+                    "documents": 0,
+                    "last_id": None,
+                }
+        return schema_cache
 
-                # Extract the list of unique field names
-                field_names = result[0]["allkeys"] if result else []
-                fields_cache[collection] = sorted(field_names)
-            with open(self.CACHE_PATH, "w") as fields_cache_file:
-                json.dump(fields_cache, fields_cache_file, indent=4)
+    def write_schema_cache(self, schema_cache: dict) -> None:
+        """
+        Stores the schema details for each collection to the JSON cache file
+        :param schema_cache: Dictionary of collection name to its schema entry
+        :return: None
+        """
+        with open(self.CACHE_PATH, "w") as fields_cache_file:
+            json.dump(schema_cache, fields_cache_file, indent=4)
         return
 
     def read_fields_cache(self) -> dict:
         """
         Loads in the stored JSON data representing available fields in each collection
-        :return: Dictionary object containing the JSON data
+        :return: Dictionary object of collection name to the list of its field names
         """
-        with open(self.CACHE_PATH, "r") as fields_cache_file:
-            my_fields_cache = json.load(fields_cache_file)
-        return my_fields_cache
+        return {collection: entry["fields"] for collection, entry in self.read_schema_cache().items()}
+
+    def collection_schema(self, collection: str, schema_cache: dict | None = None) -> dict:
+        """
+        Types of the fields of a collection, from the BSON types the fields cache has observed
+        :param collection: string value for the Collection name
+        :param schema_cache: optional already loaded schema cache, read from the JSON file otherwise
+        :return: Dictionary of field name to one of the schema FIELD_TYPES, or None for fields holding mixed types
+        """
+        from src.schema import field_type
+
+        schema_cache = self.read_schema_cache() if schema_cache is None else schema_cache
+        field_types = schema_cache.get(collection, {}).get("types", {})
+        return {field: field_type(field_types[field]) for field in field_types if field != "_id"}
+
+    def upload_schema(self, collection: str, sample) -> dict:
+        """
+        Schema to coerce the rows of an upload sheet with, the collection's own types win over the file's dtypes
+        :param collection: string value for the Collection name
+        :param sample: DataFrame of the first rows of the sheet
+        :return: Dictionary of column name to one of the schema FIELD_TYPES or None
+        """
+        from src.schema import UPLOAD_ERROR_COLUMN, infer_schema
 
+        # The reasons of a downloaded file of failed rows are never uploaded
+        sample = sample.drop(columns=[UPLOAD_ERROR_COLUMN], errors="ignore")
+        return infer_schema(sample, self.collection_schema(collection))
+
+    @timed("mongo.add_item")
     def add_item(self, collection: str, item: dict) -> None:
         """
         Add a single item to a collection in MongoDB
@@ -86,46 +422,1171 @@ class MongoConnection:
         :return: None
         """
         self.db[collection].insert_one(item)
+        self.search_cache.invalidate(collection)
+        if self.replica is not None:
+            # insert_one has added the _id to the item
+            self.replica.upsert(collection, item)
         return
 
-    def upload_bulk(self, input_df_dict) -> None:
+    def upload_bulk(self, input_df_dict, batch_size: int | None = None, key_fields: dict | None = None) -> None:
         """
         Callable to trigger the upload of the Excel data to MongoDB
         :param input_df_dict: the parsed dictionary object of the dataframes of upload data
+        :param batch_size: number of rows to send per insert_many call, defaults to the configured batch size
+        :param key_fields: optional dictionary of collection name to the fields to upsert its rows on
         :return: None
         """
-        for collection, df in input_df_dict.items():
-            if not df.empty:
-                # Check if the collection exists
-                if collection not in self.db.list_collection_names():
-                    # Create the collection if it does not exist
-                    self.db.create_collection(collection)
+        for _ in self.iter_upload_bulk(input_df_dict, batch_size=batch_size, key_fields=key_fields):
+            pass
+        return
+
+    @timed("mongo.iter_upload_bulk")
+    def iter_upload_bulk(
+        self,
+        input_df_dict,
+        batch_size: int | None = None,
+        resume_from: dict | None = None,
+        key_fields: dict | None = None,
+    ):
+        """
+        Uploads the Excel data to MongoDB in fixed-size chunks of unordered insert_many calls, reporting each batch.
+        Every chunk is first checked and coerced to the schema of its collection (see src/schema.py), rows that don't
+        fit are rejected and counted instead of being stored, and handed back with the rows the server refused as
+        "failed_rows", indexed by their spreadsheet row number.
+        Sheets with key fields are upserted instead: rows with the same key values as an earlier row of the file are
+        skipped, and the rest update the document with those key values (backed by a unique index) or insert it.
+        If the upload stops part way through, pass the batch numbers reached so far as resume_from to carry on.
+        :param input_df_dict: the parsed dictionary object of the dataframes of upload data
+        :param batch_size: number of rows to send per insert_many call, defaults to the configured batch size
+        :param resume_from: optional dictionary of collection name to the number of batches already committed
+        :param key_fields: optional dictionary of collection name to the fields to upsert its rows on
+        :return: Generator of dictionaries describing each committed batch
+        """
+        batch_size = batch_size or self.settings.bulk_upload_batch_size
+        resume_from = resume_from or {}
+        key_fields = key_fields or {}
+        for collection, sheet in input_df_dict.items():
+            chunks, total_rows = sheet_chunks(sheet, batch_size)
+            total_batches = math.ceil(total_rows / batch_size) if total_rows is not None else None
+            sheet_key_fields = key_fields.get(collection)
+            seen_keys = set()  # hashes of the key values sent so far
+            seen_unique = {}  # hashes of the values of unique fields checked so far
+            schema = None
+            for batch_number, chunk in enumerate(chunks):
+                if batch_number < resume_from.get(collection, 0) or chunk.empty:
+                    continue
+                if schema is None:
+                    self.prepare_upload_collection(collection, sheet_key_fields)
+                    schema = self.upload_schema(collection, chunk)
+                    unique_keys = self.upload_unique_keys(collection, sheet_key_fields)
+
+                batch_started = time.perf_counter()
+                try:
+                    if sheet_key_fields:
+                        result = self.upsert_chunk(
+                            collection, chunk, sheet_key_fields, seen_keys, schema, unique_keys, seen_unique
+                        )
+                    else:
+                        result = self.insert_chunk(collection, chunk, schema, False, unique_keys, seen_unique)
+                finally:
+                    self.search_cache.invalidate(collection)
+                batch_seconds = time.perf_counter() - batch_started
+                yield {
+                    "collection": collection,
+                    "batch": batch_number,
+                    "batches": total_batches,
+                    "rows": len(chunk),
+                    **result,
+                    "seconds": batch_seconds,
+                    "rows_per_second": len(chunk) / batch_seconds if batch_seconds else 0.0,
+                }
+
+    @timed("mongo.iter_parallel_upload")
+    def iter_parallel_upload(
+        self,
+        input_df_dict,
+        batch_size: int | None = None,
+        resume_from: dict | None = None,
+        key_fields: dict | None = None,
+        workers: int | None = None,
+        task_rows: int | None = None,
+    ):
+        """
+        Uploads the Excel data like iter_upload_bulk, but parses, converts and BSON encodes the rows in a pool of
+        worker processes that each write with their own MongoClient (see src/parallel.py).
+        Every yielded dictionary describes one task of up to task_rows rows instead of one batch, in file order, so
+        the batch numbers can be passed back as resume_from just the same.
+        :param input_df_dict: the parsed dictionary object of the dataframes of upload data
+        :param batch_size: number of rows to send per write, defaults to the configured batch size
+        :param resume_from: optional dictionary of collection name to the number of batches already committed
+        :param key_fields: optional dictionary of collection name to the fields to upsert its rows on
+        :param workers: number of worker processes, defaults to the configured number of upload workers
+        :param task_rows: number of rows per task, defaults to the configured task size
+        :return: Generator of dictionaries describing each committed task
+        """
+        from src.parallel import plan_upload_tasks, run_upload_tasks
+
+        batch_size = batch_size or self.settings.bulk_upload_batch_size
+        workers = workers or self.settings.bulk_upload_workers
+        task_rows = task_rows or self.settings.bulk_upload_task_rows
+        upload_started = time.perf_counter()
+        uploaded_rows = 0
+
+        upserted_collections = set()
 
-                # Convert DataFrame to list of dictionaries
-                data = df.to_dict(orient="records")
+        def prepared_tasks():
+            # Collections and unique indexes are set up by this process, before the first task of a sheet goes out
+            schemas = {}
+            unique_keys = {}
+            for task in plan_upload_tasks(input_df_dict, batch_size, task_rows, resume_from, key_fields):
+                collection = task["collection"]
+                if collection not in schemas:
+                    self.prepare_upload_collection(collection, task["key_fields"])
+                    schemas[collection] = self.upload_schema(collection, input_df_dict[collection].head(batch_size))
+                    unique_keys[collection] = self.upload_unique_keys(collection, task["key_fields"])
+                    if task["key_fields"]:
+                        # The workers have no replica, its copy of the collection is dropped here instead
+                        upserted_collections.add(collection)
+                        self.forget_replica_collection(collection)
+                yield {**task, "schema": schemas[collection], "unique_keys": unique_keys[collection]}
 
-                # Insert data into the collection
-                self.db[collection].insert_many(data)
+        try:
+            for task, result in run_upload_tasks(prepared_tasks(), self.settings, self.client_uri, workers):
+                self.search_cache.invalidate(task["collection"])
+                uploaded_rows += result["rows"]
+                elapsed = time.perf_counter() - upload_started
+                yield {
+                    "collection": task["collection"],
+                    "batch": task["last_batch"],
+                    "batches": task["batches"],
+                    **result,
+                    # Tasks overlap, so the rate of the whole upload says more than the rate of a single task
+                    "rows_per_second": uploaded_rows / elapsed if elapsed else 0.0,
+                }
+        finally:
+            # A sync during the upload may have copied documents that later tasks updated
+            for collection in upserted_collections:
+                self.forget_replica_collection(collection)
         return
 
-    def search_collection(self, collection: str, search_field: str, search_value: str) -> list | list[str]:
+    def prepare_upload_collection(self, collection: str, key_fields: list[str] | None = None) -> None:
         """
-        Search for a specific value in a collection
+        Creates the collection of an upload if it does not exist yet, along with the unique index of its key fields
         :param collection: string value for the Collection name
+        :param key_fields: optional list of the fields to upsert the rows on
+        :return: None
+        """
+        # Check if the collection exists
+        if collection not in self.catalog.names():
+            # Create the collection if it does not exist
+            try:
+                self.db.create_collection(collection)
+            except CollectionInvalid:
+                pass  # created since the catalog was last refreshed
+            self.catalog.add(collection)
+        if key_fields:
+            self.ensure_upsert_index(collection, key_fields)
+        return
+
+    def upload_unique_keys(self, collection: str, key_fields: list[str] | None = None) -> list[list[str]]:
+        """
+        Lists the fields whose values have to be unique in the rows of an upload, for validate_chunk to find repeats
+        before they are sent: _id and the fields of every unique index, apart from the key fields of an upsert, whose
+        repeats are skipped instead (see upsert_chunk)
+        :param collection: string value for the Collection name
+        :param key_fields: optional list of the fields to upsert the rows on
+        :return: list of the lists of fields
+        """
+        # Upserts leave _id out of the update, so only inserts can repeat it
+        unique_keys = [["_id"]] if not key_fields else []
+        for index in self.db[collection].list_indexes():
+            # A partial index only covers some documents, the server has the last word on those
+            if not index.get("unique") or "partialFilterExpression" in index:
+                continue
+            index_fields = list(index["key"])
+            if index_fields not in unique_keys and index_fields != list(key_fields or []):
+                unique_keys.append(index_fields)
+        return unique_keys
+
+    def insert_chunk(
+        self,
+        collection: str,
+        chunk,
+        schema: dict | None = None,
+        encode: bool = False,
+        unique_keys: list[list[str]] | None = None,
+        seen_unique: dict | None = None,
+    ) -> dict:
+        """
+        Inserts a chunk of upload rows with one unordered insert_many call. Rows that fail the pre-flight checks or
+        the schema, or that the server refuses, don't stop the others and come back as "failed_rows".
+        :param collection: string value for the Collection name
+        :param chunk: DataFrame chunk of the sheet, indexed by spreadsheet row number
+        :param schema: optional dictionary of column name to the type to coerce it to (see upload_schema)
+        :param encode: BSON encode the documents here rather than inside insert_many (see src/parallel.py)
+        :param unique_keys: optional list of the lists of fields whose values have to be unique (see upload_unique_keys)
+        :param seen_unique: optional dictionary of the key hashes of the rows checked so far, updated in place
+        :return: Dictionary of the inserted, updated, skipped and rejected counts, the errors and the failed rows
+        """
+        import pandas as pd
+
+        from src.parallel import encode_documents
+        from src.schema import (
+            coerce_chunk,
+            failed_rows,
+            frame_documents,
+            join_failed_rows,
+            rejection_errors,
+            rejection_reasons,
+            validate_chunk,
+            validation_errors,
+        )
+
+        valid, invalid, reasons = validate_chunk(chunk, unique_keys, seen_unique)
+        coerced, rejected = coerce_chunk(valid, schema)
+        # Only convert the rows of this chunk to a list of dictionaries
+        documents = frame_documents(coerced)
+        result = self.insert_documents(collection, encode_documents(documents) if encode else documents)
+        # Write errors point into the documents sent, which are the coerced rows in order
+        write_errors = result.pop("write_errors")
+        refused = pd.Series(
+            [errmsg for _, errmsg in write_errors], index=coerced.index[[index for index, _ in write_errors]]
+        )
+        result["rejected"] = len(invalid) + len(rejected)
+        result["errors"] = (
+            validation_errors(reasons)
+            + rejection_errors(rejected, schema)
+            + [f"Row {row}: {errmsg}" for row, errmsg in refused.items()]
+        )
+        result["failed_rows"] = join_failed_rows(
+            [
+                failed_rows(invalid, reasons),
+                failed_rows(rejected, rejection_reasons(rejected, schema)),
+                failed_rows(valid.loc[refused.index], refused),
+            ]
+        )
+        return result
+
+    def insert_documents(self, collection: str, documents: list) -> dict:
+        """
+        Inserts upload documents with one unordered insert_many call
+        :param collection: string value for the Collection name
+        :param documents: list of dictionaries, or of RawBSONDocuments that already carry an _id
+        :return: Dictionary of the inserted, updated and skipped counts, the errors, and the write errors as
+            (position in documents, message) tuples
+        """
+        if not documents:
+            return {"inserted": 0, "updated": 0, "skipped": 0, "errors": [], "write_errors": []}
+        try:
+            inserted = len(self.db[collection].insert_many(documents, ordered=False).inserted_ids)
+            write_errors = []
+        except BulkWriteError as bulk_error:
+            # Unordered writes carry on past bad documents, so only the failed ones are lost
+            inserted = bulk_error.details["nInserted"]
+            write_errors = [
+                (write_error["index"], write_error["errmsg"]) for write_error in bulk_error.details["writeErrors"]
+            ]
+        errors = [errmsg for _, errmsg in write_errors]
+        return {"inserted": inserted, "updated": 0, "skipped": 0, "errors": errors, "write_errors": write_errors}
+
+    def upsert_chunk(
+        self,
+        collection: str,
+        chunk,
+        key_fields: list[str],
+        seen_keys: set,
+        schema: dict | None = None,
+        unique_keys: list[list[str]] | None = None,
+        seen_unique: dict | None = None,
+    ) -> dict:
+        """
+        Upserts a chunk of upload rows on their key fields with one unordered bulk_write of UpdateOne operations.
+        Rows are hashed on their (coerced) key values first, so a key that is repeated in the file is only sent once.
+        Rows that fail the pre-flight checks or the schema, have no key value, or that the server refuses, don't stop
+        the others and come back as "failed_rows".
+        :param collection: string value for the Collection name
+        :param chunk: DataFrame chunk of the sheet, indexed by spreadsheet row number
+        :param key_fields: list of the fields identifying a document
+        :param seen_keys: set of the key hashes of the rows sent so far, updated in place
+        :param schema: optional dictionary of column name to the type to coerce it to (see upload_schema)
+        :param unique_keys: optional list of the lists of fields whose values have to be unique (see upload_unique_keys)
+        :param seen_unique: optional dictionary of the key hashes of the rows checked so far, updated in place
+        :return: Dictionary of the inserted, updated, skipped and rejected counts, the errors and the failed rows
+        """
+        from src.schema import join_failed_rows
+
+        missing_columns = [field for field in key_fields if field not in chunk.columns]
+        if missing_columns:
+            return {
+                "inserted": 0,
+                "updated": 0,
+                "skipped": len(chunk),
+                "rejected": 0,
+                "errors": [f"Key column {clean_fields(missing_columns)} missing, rows skipped"],
+                "failed_rows": join_failed_rows([]),
+            }
+        import pandas as pd
+        from pandas.util import hash_pandas_object
+
+        from src.schema import (
+            coerce_chunk,
+            failed_rows,
+            frame_documents,
+            rejection_errors,
+            rejection_reasons,
+            validate_chunk,
+            validation_errors,
+        )
+
+        valid, invalid, reasons = validate_chunk(chunk, unique_keys, seen_unique)
+        coerced, rejected = coerce_chunk(valid, schema)
+        errors = validation_errors(reasons) + rejection_errors(rejected, schema)
+        # Rows without a value in every key field can't be matched to a document
+        keyed_chunk = coerced.dropna(subset=key_fields)
+        unkeyed = valid.loc[coerced.index.difference(keyed_chunk.index, sort=False)]
+        if len(unkeyed):
+            errors.append(f"{len(unkeyed)} rows without a {clean_fields(key_fields)} value skipped")
+        keep = []
+        for key_hash in hash_pandas_object(keyed_chunk[key_fields], index=False).tolist():
+            keep.append(key_hash not in seen_keys)
+            seen_keys.add(key_hash)
+        unique_chunk = keyed_chunk[keep]
+        # _id can't be changed on an existing document, so it is left out of the update
+        requests = [
+            UpdateOne(
+                {field: record[field] for field in key_fields},
+                {"$set": {field: value for field, value in record.items() if field != "_id"}},
+                upsert=True,
+            )
+            for record in frame_documents(unique_chunk)
+        ]
+        result = {"nUpserted": 0, "nMatched": 0, "writeErrors": []}
+        if requests:
+            try:
+                result.update(self.db[collection].bulk_write(requests, ordered=False).bulk_api_result)
+            except BulkWriteError as bulk_error:
+                result.update(bulk_error.details)
+            finally:
+                self.forget_replica_collection(collection)
+        # Write errors point into the requests sent, which are the rows of unique_chunk in order
+        refused = pd.Series(
+            [write_error["errmsg"] for write_error in result["writeErrors"]],
+            index=unique_chunk.index[[write_error["index"] for write_error in result["writeErrors"]]],
+        )
+        errors += [f"Row {row}: {errmsg}" for row, errmsg in refused.items()]
+        return {
+            "inserted": result["nUpserted"],
+            # Matched rather than modified, a row equal to its document still counts, so the counts add up to the rows
+            "updated": result["nMatched"],
+            "skipped": len(coerced) - len(unique_chunk),
+            "rejected": len(invalid) + len(rejected),
+            "errors": errors,
+            "failed_rows": join_failed_rows(
+                [
+                    failed_rows(invalid, reasons),
+                    failed_rows(rejected, rejection_reasons(rejected, schema)),
+                    failed_rows(unkeyed, pd.Series(f"no {clean_fields(key_fields)} value", index=unkeyed.index)),
+                    failed_rows(valid.loc[refused.index], refused),
+                ]
+            ),
+        }
+
+    def ensure_upsert_index(self, collection: str, key_fields: list[str]) -> str:
+        """
+        Makes sure a unique index covers the key fields of an upsert upload, so re-uploads can't add duplicates and
+        each row is matched with an index lookup
+        :param collection: string value for the Collection name
+        :param key_fields: list of the fields identifying a document
+        :return: name of the unique index
+        """
+        index_keys = [(field, ASCENDING) for field in key_fields]
+        for index in self.db[collection].list_indexes():
+            if index.get("unique") and list(index["key"].items()) == index_keys:
+                return index["name"]
+        # Fails if the collection already holds documents sharing key values, those have to be cleaned up first
+        return self.db[collection].create_index(index_keys, unique=True, name=f"upsert_{'_'.join(key_fields)}")
+
+    def build_search_query(self, search_field: str, search_value: str, search_mode: str = "contains") -> dict | None:
+        """
+        Builds the query used to search a field of a collection. Apart from "contains", every mode can be answered
+        from an index (see create_search_index): "exact" and "prefix" use a plain index on the field, "prefix_ci"
+        an index with CASE_INSENSITIVE_COLLATION and "text" the collection's text index.
         :param search_field: string value for the field to search
         :param search_value: string value to search for in the field
-        :return: List of dictionaries representing the search results
+        :param search_mode: one of the SEARCH_MODES keys
+        :return: Dictionary of the MongoDB query, or None if the value can never match (invalid ObjectId)
         """
+        if search_mode not in SEARCH_MODES:
+            raise ValueError(f"Unknown search mode '{search_mode}', expected one of {list(SEARCH_MODES)}")
         if search_field == "_id":
             try:
-                search_results = self.db[collection].find({"_id": ObjectId(search_value)})
+                return {"_id": ObjectId(search_value)}
             except Exception:
-                return []  # Return an empty list if the ObjectId conversion fails
-        else:
-            item_query = {f"{search_field}": {"$regex": search_value, "$options": "i"}}
-            search_results = [document for document in self.db[collection].find(item_query)]
+                return None  # The search can't match anything if the ObjectId conversion fails
+        if search_mode == "exact":
+            # Spreadsheet uploads store numbers as numbers, so also look for the numeric form of the value
+            return {f"{search_field}": {"$in": search_candidates(search_value)}}
+        if search_mode == "prefix":
+            # An anchored, case-sensitive regex is turned into a range scan on the index
+            return {f"{search_field}": {"$regex": f"^{re.escape(search_value)}"}}
+        if search_mode == "prefix_ci":
+            # Paired with CASE_INSENSITIVE_COLLATION this range matches any casing of the prefix
+            return {f"{search_field}": {"$gte": search_value, "$lt": search_value + "\uffff"}}
+        if search_mode == "text":
+            return {"$text": {"$search": search_value}}
+        return {f"{search_field}": {"$regex": search_value, "$options": "i"}}
+
+    def search_collation(self, search_mode: str) -> dict | None:
+        """
+        Collation the query of a search mode has to run with to use its index
+        :param search_mode: one of the SEARCH_MODES keys
+        :return: Dictionary of the collation, or None for the default binary comparison
+        """
+        return CASE_INSENSITIVE_COLLATION if search_mode == "prefix_ci" else None
+
+    @timed("mongo.search_collection")
+    def search_collection(
+        self, collection: str, search_field: str, search_value: str, search_mode: str = "contains", raw: bool = False
+    ) -> list | list[str]:
+        """
+        Search for a specific value in a collection, in the local replica once the collection has been copied there
+        :param collection: string value for the Collection name
+        :param search_field: string value for the field to search
+        :param search_value: string value to search for in the field
+        :param search_mode: one of the SEARCH_MODES keys
+        :param raw: return RawBSONDocuments that are only decoded when read, e.g. by documents_to_table
+        :return: List of dictionaries representing the search results
+        """
+        if self.replica is not None and self.replica.can_search(collection, search_mode):
+            return self.replica.search_page(
+                collection, search_field, search_value, rows_per_page=None, search_mode=search_mode, raw=raw
+            )[0]
+        cache_key = self.search_cache_key(collection, search_field, search_value, search_mode) + (raw,)
+        cache_hit, search_results = self.search_cache.lookup(cache_key)
+        if cache_hit:
+            return list(search_results)
+        item_query = self.build_search_query(search_field, search_value, search_mode)
+        if item_query is None:
+            return []  # Return an empty list if the ObjectId conversion fails
+        active_collection = self.db.get_collection(collection, codec_options=RAW_CODEC_OPTIONS if raw else None)
+        search_results = list(active_collection.find(item_query, collation=self.search_collation(search_mode)))
+        self.search_cache.store(cache_key, search_results)
         return list(search_results)
 
+    @timed("mongo.search_collection_page")
+    def search_collection_page(
+        self,
+        collection: str,
+        search_field: str,
+        search_value: str,
+        page: int = 1,
+        rows_per_page: int = 25,
+        fields: list[str] | None = None,
+        sort_by: str | None = None,
+        descending: bool = False,
+        after_id: str | None = None,
+        search_mode: str = "contains",
+        raw: bool = False,
+    ) -> tuple[list, int]:
+        """
+        Search a collection one page at a time, so only the documents on the requested page leave the server.
+        When paging forward through results sorted by _id, pass the last _id of the previous page as after_id to
+        jump straight to the next page with an _id range instead of skipping over all the earlier matches.
+        Collections copied into the local replica are searched there, without a round trip.
+        :param collection: string value for the Collection name
+        :param search_field: string value for the field to search
+        :param search_value: string value to search for in the field
+        :param page: 1-based page number to fetch
+        :param rows_per_page: number of documents per page
+        :param fields: optional list of the fields to return (projection), _id is always returned
+        :param sort_by: optional field to sort by, defaults to _id
+        :param descending: sort in descending order
+        :param after_id: optional string value of the last _id of the previous page
+        :param search_mode: one of the SEARCH_MODES keys
+        :param raw: return RawBSONDocuments that are only decoded when read, e.g. by documents_to_table
+        :return: Tuple of the list of documents on the page and the total number of matching documents
+        """
+        if self.replica is not None and self.replica.can_search(collection, search_mode):
+            return self.replica.search_page(
+                collection,
+                search_field,
+                search_value,
+                page=page,
+                rows_per_page=rows_per_page,
+                fields=fields,
+                sort_by=sort_by,
+                descending=descending,
+                after_id=after_id,
+                search_mode=search_mode,
+                raw=raw,
+            )
+        cache_key = self.search_cache_key(collection, search_field, search_value, search_mode) + (
+            page,
+            rows_per_page,
+            tuple(fields or ()),
+            sort_by,
+            descending,
+            raw,
+        )
+        cache_hit, cached_page = self.search_cache.lookup(cache_key)
+        if cache_hit:
+            return list(cached_page[0]), cached_page[1]
+        item_query = self.build_search_query(search_field, search_value, search_mode)
+        if item_query is None:
+            return [], 0
+        active_collection = self.db[collection]
+        collation = self.search_collation(search_mode)
+        total = active_collection.count_documents(item_query, collation=collation)
+
+        sort_by = sort_by or "_id"
+        page_query = item_query
+        skip = (page - 1) * rows_per_page
+        if after_id is not None and sort_by == "_id" and ObjectId.is_valid(after_id):
+            page_query = {"$and": [item_query, {"_id": {"$lt" if descending else "$gt": ObjectId(after_id)}}]}
+            skip = 0
+        projection = {field: 1 for field in fields} if fields else None
+        sort_direction = -1 if descending else 1
+        # Tie-break on _id so documents with equal sort values keep a stable order across pages
+        sort_keys = [(sort_by, sort_direction)] if sort_by == "_id" else [(sort_by, sort_direction), ("_id", 1)]
+        if raw:
+            active_collection = active_collection.with_options(codec_options=RAW_CODEC_OPTIONS)
+        cursor = (
+            active_collection.find(page_query, projection, collation=collation)
+            .sort(sort_keys)
+            .skip(skip)
+            .limit(rows_per_page)
+        )
+        page_documents = list(cursor)
+        self.search_cache.store(cache_key, (page_documents, total))
+        return list(page_documents), total
+
+    def search_cache_key(self, collection: str, search_field: str, search_value: str, search_mode: str) -> tuple:
+        """
+        Key of a search in the result cache, _id lookups ignore the mode so every tab shares their entries
+        :param collection: string value for the Collection name
+        :param search_field: string value for the field to search
+        :param search_value: string value to search for in the field
+        :param search_mode: one of the SEARCH_MODES keys
+        :return: Tuple starting with the collection name
+        """
+        return collection, search_field, search_value, "exact" if search_field == "_id" else search_mode
+
+    def build_filter_query(self, filters: list[tuple[str, str, str]]) -> dict | None:
+        """
+        Combines several field filters into one query that only matches the documents passing all of them
+        :param filters: list of (field, value, search mode) tuples, the modes being FACET_FILTER_MODES keys
+        :return: Dictionary of the MongoDB query (empty without filters), or None if a filter can never match
+        """
+        filter_queries = []
+        for search_field, search_value, search_mode in filters:
+            if search_mode not in FACET_FILTER_MODES:
+                raise ValueError(f"Unknown filter mode '{search_mode}', expected one of {list(FACET_FILTER_MODES)}")
+            filter_query = self.build_search_query(search_field, search_value, search_mode)
+            if filter_query is None:
+                return None
+            filter_queries.append(filter_query)
+        if len(filter_queries) > 1:
+            return {"$and": filter_queries}
+        return filter_queries[0] if filter_queries else {}
+
+    @timed("mongo.facet_summary")
+    def facet_summary(
+        self,
+        collection: str,
+        filters: list[tuple[str, str, str]],
+        facet_fields: list[str],
+        top_n: int = 10,
+        allow_disk_use: bool = False,
+    ) -> dict:
+        """
+        Counts the documents matching the filters and, for every facet field, how many distinct values it holds and
+        which top_n values are the most common. It all runs as one $facet aggregation on the server, so only the
+        counts leave it, never the documents.
+        :param collection: string value for the Collection name
+        :param filters: list of (field, value, search mode) tuples the documents have to match
+        :param facet_fields: list of the fields to summarize
+        :param top_n: number of the most common values to return per field
+        :param allow_disk_use: let the server spill large groups to disk instead of failing at its memory limit
+        :return: Dictionary of the "total" matching documents and the "facets" of each field, a dictionary of its
+            "distinct" count and its "top" list of {"value", "count"} dictionaries (missing values have value None)
+        """
+        cache_key = (collection, "facets", tuple(filters), tuple(facet_fields), top_n)
+        cache_hit, summary = self.search_cache.lookup(cache_key)
+        if cache_hit:
+            return summary
+        summary = {"total": 0, "facets": {field: {"distinct": 0, "top": []} for field in facet_fields}}
+        match_query = self.build_filter_query(filters)
+        if match_query is None:
+            return summary
+        facets = {"total": [{"$count": "count"}]}
+        for number, field in enumerate(facet_fields):
+            # Facet names can't hold dots (nested fields) or start with $, so the facets are numbered
+            values = [{"$group": {"_id": f"${field}", "count": {"$sum": 1}}}]
+            facets[f"top_{number}"] = values + [{"$sort": {"count": -1, "_id": 1}}, {"$limit": top_n}]
+            facets[f"distinct_{number}"] = values + [{"$count": "count"}]
+        pipeline = [{"$match": match_query}] if match_query else []
+        pipeline.append({"$facet": facets})
+        result = next(self.db[collection].aggregate(pipeline, allowDiskUse=allow_disk_use), {})
+        # $count returns no document at all when nothing matches
+        summary["total"] = result["total"][0]["count"] if result.get("total") else 0
+        for number, field in enumerate(facet_fields):
+            distinct = result.get(f"distinct_{number}")
+            summary["facets"][field] = {
+                "distinct": distinct[0]["count"] if distinct else 0,
+                "top": [{"value": group["_id"], "count": group["count"]} for group in result.get(f"top_{number}", [])],
+            }
+        self.search_cache.store(cache_key, summary)
+        return summary
+
+    @timed("mongo.group_summary")
+    def group_summary(
+        self,
+        collection: str,
+        filters: list[tuple[str, str, str]],
+        group_fields: list[str],
+        value_field: str | None = None,
+        limit: int = 100,
+        allow_disk_use: bool = False,
+    ) -> dict:
+        """
+        Counts the documents matching the filters per combination of values of the group fields (e.g. per category
+        and year), largest groups first, optionally with the sum, average, minimum and maximum of a numeric field.
+        The grouping runs on the server, only the limit largest groups are returned.
+        :param collection: string value for the Collection name
+        :param filters: list of (field, value, search mode) tuples the documents have to match
+        :param group_fields: list of the fields to group by
+        :param value_field: optional numeric field to total per group, non-numeric values are ignored by the server
+        :param limit: number of the largest groups to return
+        :param allow_disk_use: let the server spill large groups to disk instead of failing at its memory limit
+        :return: Dictionary of the total number of "groups" and the "rows" of the largest ones, each one a dictionary
+            of the group field values, "count" and, with a value field, "sum", "avg", "min" and "max"
+        """
+        cache_key = (collection, "groups", tuple(filters), tuple(group_fields), value_field, limit)
+        cache_hit, summary = self.search_cache.lookup(cache_key)
+        if cache_hit:
+            return summary
+        summary = {"groups": 0, "rows": []}
+        match_query = self.build_filter_query(filters)
+        if match_query is None or not group_fields:
+            return summary
+        # Keys of the group _id can't hold dots either, so the group fields are numbered
+        group = {
+            "_id": {f"key_{number}": f"${field}" for number, field in enumerate(group_fields)},
+            "count": {"$sum": 1},
+        }
+        if value_field:
+            for accumulator in ("sum", "avg", "min", "max"):
+                group[accumulator] = {f"${accumulator}": f"${value_field}"}
+        pipeline = [{"$match": match_query}] if match_query else []
+        pipeline += [
+            {"$group": group},
+            {
+                "$facet": {
+                    "rows": [{"$sort": {"count": -1, "_id": 1}}, {"$limit": limit}],
+                    "groups": [{"$count": "count"}],
+                }
+            },
+        ]
+        result = next(self.db[collection].aggregate(pipeline, allowDiskUse=allow_disk_use), {})
+        summary["groups"] = result["groups"][0]["count"] if result.get("groups") else 0
+        for row in result.get("rows", []):
+            keys = row.pop("_id")
+            summary["rows"].append(
+                {**{field: keys.get(f"key_{number}") for number, field in enumerate(group_fields)}, **row}
+            )
+        self.search_cache.store(cache_key, summary)
+        return summary
+
+    def watch_search_cache(self) -> bool:
+        """
+        Starts a background change stream that invalidates cached searches when any client writes to the database
+        :return: True if the change stream is running, False if the deployment does not support change streams
+        """
+        try:
+            change_stream = self.db.watch([{"$project": {"ns": 1, "operationType": 1}}])
+        except PyMongoError as watch_error:
+            print(f"Change streams unavailable, the search cache relies on its TTL: {watch_error}")
+            return False
+
+        def invalidate_changes():
+            try:
+                with change_stream:
+                    for change in change_stream:
+                        # Database-wide events such as dropDatabase carry no collection and clear everything
+                        self.search_cache.invalidate(change.get("ns", {}).get("coll"))
+            except PyMongoError as stream_error:
+                print(f"Search cache change stream stopped: {stream_error}")
+            self.search_cache.invalidate()
+            self.search_cache_watched = False
+
+        self.search_cache_watched = True
+        threading.Thread(target=invalidate_changes, name="search-cache-watch", daemon=True).start()
+        return True
+
+    @timed("mongo.explain_search")
+    def explain_search(
+        self, collection: str, search_field: str, search_value: str, search_mode: str = "contains"
+    ) -> dict:
+        """
+        Runs explain() on a search to show whether it used an index or scanned the whole collection
+        :param collection: string value for the Collection name
+        :param search_field: string value for the field to search
+        :param search_value: string value to search for in the field
+        :param search_mode: one of the SEARCH_MODES keys
+        :return: Dictionary with the plan "stages", the "index" used (if any), and the keys/documents examined
+        """
+        item_query = self.build_search_query(search_field, search_value, search_mode)
+        if item_query is None:
+            return {"stages": [], "index": None, "keys_examined": 0, "docs_examined": 0, "returned": 0, "millis": 0}
+        find_command = {"find": collection, "filter": item_query}
+        collation = self.search_collation(search_mode)
+        if collation is not None:
+            find_command["collation"] = collation
+        explanation = self.db.command("explain", find_command, verbosity="executionStats")
+
+        stages = []
+        index_names = []
+        # Walk the winning plan tree, newer servers nest the classic plan under "queryPlan"
+        plan_nodes = [explanation["queryPlanner"]["winningPlan"]]
+        while plan_nodes:
+            plan_node = plan_nodes.pop()
+            plan_node = plan_node.get("queryPlan", plan_node)
+            if "stage" in plan_node:
+                stages.append(plan_node["stage"])
+            if "indexName" in plan_node:
+                index_names.append(plan_node["indexName"])
+            plan_nodes += [plan_node["inputStage"]] if "inputStage" in plan_node else []
+            plan_nodes += plan_node.get("inputStages", [])
+        execution_stats = explanation.get("executionStats", {})
+        return {
+            "stages": stages,
+            "index": ", ".join(index_names) or None,
+            "keys_examined": execution_stats.get("totalKeysExamined", 0),
+            "docs_examined": execution_stats.get("totalDocsExamined", 0),
+            "returned": execution_stats.get("nReturned", 0),
+            "millis": execution_stats.get("executionTimeMillis", 0),
+        }
+
+    @timed("mongo.list_indexes")
+    def list_indexes(self, collection: str) -> list[dict]:
+        """
+        Lists the indexes of a collection
+        :param collection: string value for the Collection name
+        :return: List of dictionaries with the "name", indexed "fields", "kind" and "collation" of each index
+        """
+        indexes = []
+        for index in self.db[collection].list_indexes():
+            if "textIndexVersion" in index:
+                fields, kind = sorted(index.get("weights", {})), "text"
+            else:
+                fields, kind = list(index["key"].keys()), "unique" if index.get("unique") else "ascending"
+            indexes.append(
+                {
+                    "name": index["name"],
+                    "fields": fields,
+                    "kind": kind,
+                    "collation": index.get("collation", {}).get("locale"),
+                }
+            )
+        return indexes
+
+    @timed("mongo.create_search_index")
+    def create_search_index(self, collection: str, search_field: str, search_mode: str = "exact") -> str:
+        """
+        Creates the index that lets a search mode avoid a full collection scan on a field
+        :param collection: string value for the Collection name
+        :param search_field: string value for the field to index
+        :param search_mode: one of the SEARCH_MODES keys ("contains" can't use an index, so gets a plain one)
+        :return: string value of the created index's name
+        """
+        active_collection = self.db[collection]
+        if search_mode == "text":
+            # A collection can only have one text index, so it is replaced to cover the new field as well
+            text_fields = [search_field]
+            for index in self.list_indexes(collection):
+                if index["kind"] == "text":
+                    text_fields = sorted(set(index["fields"]) | {search_field})
+                    active_collection.drop_index(index["name"])
+            return active_collection.create_index([(field, TEXT) for field in text_fields], name="text_search")
+        if search_mode == "prefix_ci":
+            return active_collection.create_index(
+                [(search_field, ASCENDING)], name=f"{search_field}_ci", collation=CASE_INSENSITIVE_COLLATION
+            )
+        return active_collection.create_index([(search_field, ASCENDING)])
+
+    @timed("mongo.suggest_indexes")
+    def suggest_indexes(self, collection: str, min_coverage: float = 0.5) -> list[str]:
+        """
+        Suggests fields from the fields cache that are worth indexing: string or number fields present in most
+        documents that are not already the leading field of an index
+        :param collection: string value for the Collection name
+        :param min_coverage: fraction of the collection's documents a field has to appear in
+        :return: List of field names, most common first
+        """
+        schema_entry = self.read_schema_cache().get(collection)
+        if not schema_entry or not schema_entry.get("documents"):
+            return []
+        indexed_fields = {index["fields"][0] for index in self.list_indexes(collection) if index["fields"]}
+        searchable_types = {"string", "int", "long", "double", "decimal"}
+        suggestions = [
+            field
+            for field, count in schema_entry["counts"].items()
+            if field not in indexed_fields
+            and count / schema_entry["documents"] >= min_coverage
+            and searchable_types & set(schema_entry["types"].get(field, []))
+        ]
+        return sorted(suggestions, key=lambda field: -schema_entry["counts"][field])
+
+    def export_columns(self, collection: str) -> list[str]:
+        """
+        Columns to export for a collection, taken from the fields cache with _id first
+        :param collection: string value for the Collection name
+        :return: list of field names
+        """
+        fields = self.read_fields_cache().get(collection)
+        if fields is None:
+            # Exports need the header up front, a quick sample is enough for collections the cache hasn't seen yet
+            fields = self.discover_collection_schema(collection, mode="sample")["fields"]
+        return ["_id"] + [field for field in fields if field != "_id"]
+
+    def iter_export_batches(
+        self,
+        collection: str,
+        columns: list[str],
+        query: dict | None = None,
+        collation: dict | None = None,
+        batch_size: int | None = None,
+        xlsx: bool = False,
+    ):
+        """
+        Streams a collection (or the matches of a query) through a batched cursor as lists of export rows
+        :param collection: string value for the Collection name
+        :param columns: list of field names to export, in column order
+        :param query: optional MongoDB query to limit the export to, defaults to every document
+        :param collation: optional collation the query has to run with
+        :param batch_size: number of documents per batch, defaults to the configured export batch size
+        :param xlsx: the rows go into an Excel file
+        :return: Generator of lists of rows, each row a list of values in column order
+        """
+        batch_size = batch_size or self.settings.export_batch_size
+        cursor = self.db[collection].find(query or {}, collation=collation, batch_size=batch_size)
+        batch = []
+        for document in cursor:
+            batch.append([export_value(document.get(column), xlsx) for column in columns])
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    @timed("mongo.export_collections")
+    def export_collections(
+        self,
+        output_path: Path,
+        collections: list[str],
+        export_format: str = "xlsx",
+        search_field: str | None = None,
+        search_value: str | None = None,
+        search_mode: str = "contains",
+        batch_size: int | None = None,
+    ) -> Path:
+        """
+        Exports collections (or the results of a search) to an Excel, CSV or Parquet file without holding more
+        than one batch of documents in memory. Excel files get one sheet per collection, mirroring the bulk upload
+        format. CSV and Parquet files hold a single table, so several collections are zipped together.
+        :param output_path: Path of the file to write, its suffix is replaced to match the format
+        :param collections: list of the Collection names to export
+        :param export_format: one of the EXPORT_FORMATS
+        :param search_field: optional field of a search to limit the export to
+        :param search_value: optional value of a search to limit the export to
+        :param search_mode: one of the SEARCH_MODES keys
+        :param batch_size: number of documents per batch, defaults to the configured export batch size
+        :return: Path of the written file
+        """
+        if export_format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format '{export_format}', expected one of {EXPORT_FORMATS}")
+        query, collation = None, None
+        if search_field is not None:
+            query = self.build_search_query(search_field, search_value, search_mode)
+            collation = self.search_collation(search_mode)
+            if query is None:
+                query = {"_id": {"$exists": False}}  # An invalid ObjectId search matches nothing
+
+        def collection_batches(collection: str, columns: list[str]):
+            return self.iter_export_batches(
+                collection, columns, query, collation, batch_size, xlsx=export_format == "xlsx"
+            )
+
+        if export_format == "xlsx":
+            output_path = output_path.with_suffix(".xlsx")
+            sheets = (
+                (collection, columns, collection_batches(collection, columns))
+                for collection in collections
+                for columns in [self.export_columns(collection)]
+            )
+            write_xlsx(output_path, sheets)
+            return output_path
+
+        writer = write_csv if export_format == "csv" else write_parquet
+        if len(collections) == 1:
+            output_path = output_path.with_suffix(f".{export_format}")
+            columns = self.export_columns(collections[0])
+            writer(output_path, columns, collection_batches(collections[0], columns))
+            return output_path
+
+        output_path = output_path.with_suffix(".zip")
+        with tempfile.TemporaryDirectory() as staging_dir:
+            with zipfile.ZipFile(output_path, "w", zipfile.ZIP_DEFLATED) as zip_file:
+                for collection in collections:
+                    collection_path = Path(staging_dir) / f"{collection}.{export_format}"
+                    columns = self.export_columns(collection)
+                    writer(collection_path, columns, collection_batches(collection, columns))
+                    zip_file.write(collection_path, arcname=collection_path.name)
+                    collection_path.unlink()
+        return output_path
+
+    def bulk_update_rows(self, chunk, key_field: str) -> tuple[list[tuple], list[str]]:
+        """
+        Turns a chunk of a bulk change sheet into (key value, fields to set) pairs, empty cells leave a field as it is
+        :param chunk: DataFrame chunk of the sheet
+        :param key_field: field the rows are matched on, "_id" values have to be valid ObjectIds
+        :return: Tuple of the list of (key value, fields) pairs and the list of messages for the skipped rows
+        """
+        rows = []
+        errors = []
+        for record in chunk.to_dict(orient="records"):
+            key_value = record.get(key_field)
+            if is_missing(key_value):
+                errors.append(f"Row without a {key_field} value skipped")
+                continue
+            if key_field == "_id":
+                if not ObjectId.is_valid(str(key_value)):
+                    errors.append(f"Row with an invalid _id ({key_value}) skipped")
+                    continue
+                key_value = ObjectId(str(key_value))
+            # _id can't be changed, so it is never part of the update
+            fields = {
+                field: value
+                for field, value in record.items()
+                if field not in (key_field, "_id") and not is_missing(value)
+            }
+            if not fields:
+                errors.append(f"Row {key_field}={key_value} has nothing to update, skipped")
+                continue
+            rows.append((key_value, fields))
+        return rows, errors
+
+    @timed("mongo.dry_run_bulk_update")
+    def dry_run_bulk_update(self, input_df_dict, key_field: str = "_id", batch_size: int | None = None) -> list[dict]:
+        """
+        Counts what a bulk update would do without writing anything
+        :param input_df_dict: dictionary of collection name to its sheet (UploadedSheet or DataFrame)
+        :param key_field: field the rows are matched on
+        :param batch_size: number of rows to look up at a time, defaults to the configured batch size
+        :return: list of dictionaries of the collection, rows, matched, unmatched and skipped counts per sheet, and
+            the number of documents the matched rows update
+        """
+        batch_size = batch_size or self.settings.bulk_upload_batch_size
+        summaries = []
+        for collection, sheet in input_df_dict.items():
+            summary = {"collection": collection, "rows": 0, "matched": 0, "unmatched": 0, "skipped": 0, "documents": 0}
+            for chunk in sheet_chunks(sheet, batch_size)[0]:
+                rows, errors = self.bulk_update_rows(chunk, key_field)
+                keys = [key_value for key_value, _ in rows]
+                found = set(self.db[collection].distinct(key_field, {key_field: {"$in": keys}})) if keys else set()
+                matched = sum(key_value in found for key_value in keys)
+                summary["rows"] += len(chunk)
+                summary["matched"] += matched
+                summary["unmatched"] += len(keys) - matched
+                summary["skipped"] += len(errors)
+                if key_field == "_id":
+                    summary["documents"] += matched
+                elif keys:
+                    # A key other than _id may be shared by several documents, every one of them is updated
+                    summary["documents"] += self.db[collection].count_documents({key_field: {"$in": keys}})
+            summaries.append(summary)
+        return summaries
+
+    @timed("mongo.iter_bulk_update")
+    def iter_bulk_update(
+        self, input_df_dict, key_field: str = "_id", upsert: bool = False, batch_size: int | None = None
+    ):
+        """
+        Updates documents from sheets of changes (one sheet per collection, like the bulk upload) in unordered
+        bulk_write batches, each row setting its non-empty cells on the matching documents: UpdateOne on _id, and
+        UpdateMany on any other key field, as that one doesn't have to be unique
+        :param input_df_dict: dictionary of collection name to its sheet (UploadedSheet or DataFrame)
+        :param key_field: field the rows are matched on
+        :param upsert: insert the rows that don't match any document
+        :param batch_size: number of rows per bulk_write call, defaults to the configured batch size
+        :return: Generator of dictionaries describing each committed batch
+        """
+        batch_size = batch_size or self.settings.bulk_upload_batch_size
+        for collection, sheet in input_df_dict.items():
+            chunks, total_rows = sheet_chunks(sheet, batch_size)
+            total_batches = math.ceil(total_rows / batch_size) if total_rows is not None else None
+            for batch_number, chunk in enumerate(chunks):
+                rows, errors = self.bulk_update_rows(chunk, key_field)
+                update = UpdateOne if key_field == "_id" else UpdateMany
+                requests = [
+                    update({key_field: key_value}, {"$set": fields}, upsert=upsert) for key_value, fields in rows
+                ]
+                yield self.write_bulk_batch(collection, requests, errors, batch_number, total_batches, len(chunk))
+
+    @timed("mongo.dry_run_bulk_delete")
+    def dry_run_bulk_delete(
+        self,
+        collection: str,
+        item_ids=None,
+        search_field: str | None = None,
+        search_value: str | None = None,
+        search_mode: str = "contains",
+        batch_size: int | None = None,
+    ) -> dict:
+        """
+        Counts what a bulk delete would remove without deleting anything
+        :param collection: string value for the Collection name
+        :param item_ids: iterable of _id values to delete, or None to delete what a search matches
+        :param search_field: string value for the field to search
+        :param search_value: string value to search for in the field
+        :param search_mode: one of the SEARCH_MODES keys
+        :param batch_size: number of _ids to look up at a time, defaults to the configured batch size
+        :return: Dictionary of the collection, requested, matched and invalid counts
+        """
+        batch_size = batch_size or self.settings.bulk_upload_batch_size
+        summary = {"collection": collection, "requested": 0, "matched": 0, "invalid": 0}
+        if item_ids is None:
+            item_query = self.build_search_query(search_field, search_value, search_mode)
+            if item_query is not None:
+                summary["matched"] = summary["requested"] = self.db[collection].count_documents(
+                    item_query, collation=self.search_collation(search_mode)
+                )
+            return summary
+        for id_batch, invalid_ids in self.iter_id_batches(item_ids, batch_size):
+            summary["requested"] += len(id_batch) + len(invalid_ids)
+            summary["invalid"] += len(invalid_ids)
+            if id_batch:
+                summary["matched"] += self.db[collection].count_documents({"_id": {"$in": id_batch}})
+        return summary
+
+    @timed("mongo.iter_bulk_delete")
+    def iter_bulk_delete(
+        self,
+        collection: str,
+        item_ids=None,
+        search_field: str | None = None,
+        search_value: str | None = None,
+        search_mode: str = "contains",
+        batch_size: int | None = None,
+    ):
+        """
+        Deletes a list of _ids, or everything a search matches, in unordered bulk_write batches of DeleteOne operations
+        :param collection: string value for the Collection name
+        :param item_ids: iterable of _id values to delete, or None to delete what a search matches
+        :param search_field: string value for the field to search
+        :param search_value: string value to search for in the field
+        :param search_mode: one of the SEARCH_MODES keys
+        :param batch_size: number of deletes per bulk_write call, defaults to the configured batch size
+        :return: Generator of dictionaries describing each committed batch
+        """
+        batch_size = batch_size or self.settings.bulk_upload_batch_size
+        if item_ids is not None:
+            total_batches = math.ceil(len(item_ids) / batch_size) if hasattr(item_ids, "__len__") else None
+            for batch_number, (id_batch, invalid_ids) in enumerate(self.iter_id_batches(item_ids, batch_size)):
+                errors = [f"Invalid _id {item_id} skipped" for item_id in invalid_ids]
+                requests = [DeleteOne({"_id": item_id}) for item_id in id_batch]
+                yield self.write_bulk_batch(
+                    collection, requests, errors, batch_number, total_batches, len(id_batch) + len(invalid_ids)
+                )
+            return
+
+        item_query = self.build_search_query(search_field, search_value, search_mode)
+        if item_query is None:
+            return
+        active_collection = self.db[collection]
+        collation = self.search_collation(search_mode)
+        total_batches = math.ceil(active_collection.count_documents(item_query, collation=collation) / batch_size)
+        batch_number = 0
+        # Look the next batch of _ids up again after every delete, rather than holding a cursor over a shrinking result
+        while id_batch := [
+            document["_id"]
+            for document in active_collection.find(item_query, {"_id": 1}, collation=collation).limit(batch_size)
+        ]:
+            batch = self.write_bulk_batch(
+                collection, [DeleteOne({"_id": item_id}) for item_id in id_batch], [], batch_number, total_batches
+            )
+            yield batch
+            if not batch["deleted"]:
+                # Nothing could be deleted, asking again would only return the same documents
+                return
+            batch_number += 1
+
+    def iter_id_batches(self, item_ids, batch_size: int):
+        """
+        Groups _id values into batches of ObjectIds, setting the values that aren't valid ObjectIds aside
+        :param item_ids: iterable of _id values (strings or ObjectIds)
+        :param batch_size: number of _ids per batch
+        :return: Generator of (list of ObjectIds, list of invalid values) tuples
+        """
+        item_ids = iter(item_ids)
+        while raw_batch := list(itertools.islice(item_ids, batch_size)):
+            id_batch = []
+            invalid_ids = []
+            for item_id in raw_batch:
+                if ObjectId.is_valid(str(item_id)):
+                    id_batch.append(ObjectId(str(item_id)))
+                elif not is_missing(item_id):
+                    invalid_ids.append(item_id)
+            yield id_batch, invalid_ids
+
+    def write_bulk_batch(
+        self,
+        collection: str,
+        requests: list,
+        errors: list[str],
+        batch_number: int,
+        total_batches: int | None,
+        rows: int | None = None,
+    ) -> dict:
+        """
+        Sends one batch of write operations as an unordered bulk_write and summarizes the result
+        :param collection: string value for the Collection name
+        :param requests: list of DeleteOne/UpdateOne/UpdateMany operations
+        :param errors: messages of the rows that were skipped before the write
+        :param batch_number: 0-based number of the batch
+        :param total_batches: number of batches, None when it isn't known up front
+        :param rows: number of rows the batch was built from, defaults to the number of operations
+        :return: Dictionary of the requested, matched, modified, upserted and deleted counts, errors and timing
+        """
+        batch_started = time.perf_counter()
+        result = {"nMatched": 0, "nModified": 0, "nUpserted": 0, "nRemoved": 0}
+        errors = list(errors)
+        if requests:
+            try:
+                write_result = self.db[collection].bulk_write(requests, ordered=False)
+                result.update(write_result.bulk_api_result)
+            except BulkWriteError as bulk_error:
+                # Unordered writes carry on past a failed operation, so only the failed ones are lost
+                result.update(bulk_error.details)
+                errors += [write_error["errmsg"] for write_error in bulk_error.details["writeErrors"]]
+            finally:
+                self.search_cache.invalidate(collection)
+                self.forget_replica_collection(collection)
+        batch_seconds = time.perf_counter() - batch_started
+        return {
+            "collection": collection,
+            "batch": batch_number,
+            "batches": total_batches,
+            "requested": rows if rows is not None else len(requests),
+            "matched": result["nMatched"],
+            "modified": result["nModified"],
+            "upserted": result["nUpserted"],
+            "deleted": result["nRemoved"],
+            "errors": errors,
+            "seconds": batch_seconds,
+        }
+
+    @timed("mongo.delete_item")
     def delete_item(self, collection: str, item_id: str) -> None:
         """
         Delete a single item from a collection in MongoDB
@@ -134,10 +1595,61 @@ class MongoConnection:
         :return: None
         """
         self.db[collection].delete_one({"_id": ObjectId(item_id)})
+        self.search_cache.invalidate(collection)
+        if self.replica is not None:
+            self.replica.delete(collection, ObjectId(item_id))
+        return
+
+
+class AsyncMongoConnection:
+    def __init__(self, connection: MongoConnection, max_workers: int | None = None):
+        """
+        Awaitable view of a MongoConnection for the NiceGUI handlers. PyMongo 4.8 has no native async API, so every
+        call runs on a dedicated thread pool and a slow query only holds up the session that asked for it, never
+        the event loop every connected browser depends on.
+        Any MongoConnection method can be awaited through this wrapper, e.g. await async_conn.search_collection(...)
+        :param connection: the MongoConnection to run the calls on
+        :param max_workers: number of concurrent database calls, defaults to the configured executor workers
+        """
+        self.connection = connection
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers or connection.settings.mongo_executor_workers, thread_name_prefix="mongo"
+        )
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self.connection, name)
+        if not callable(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def run_in_executor(*args, **kwargs):
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(attribute, *args, **kwargs)
+            )
+
+        return run_in_executor
+
+    async def iterate(self, generator):
+        """
+        Steps through a blocking generator (such as iter_upload_bulk) on the thread pool, one item at a time
+        :param generator: generator returned by a MongoConnection method
+        :return: Async generator of the same items
+        """
+        finished = object()
+        loop = asyncio.get_running_loop()
+        while (item := await loop.run_in_executor(self.executor, next, generator, finished)) is not finished:
+            yield item
+
+    def shutdown(self) -> None:
+        """
+        Stops the thread pool once the running calls are done
+        :return: None
+        """
+        self.executor.shutdown(wait=False, cancel_futures=True)
         return
 
 
 if __name__ == "__main__":
     testing_settings = check_credentials()
     test_conn = MongoConnection(testing_settings)
-    print(test_conn.update_fields_cache())
+    print(test_conn.update_fields_cache(mode="full"))
@@ -0,0 +1,338 @@
+import contextlib
+import cProfile
+import functools
+import inspect
+import io
+import pstats
+import threading
+import time
+from importlib.util import find_spec
+
+from pymongo import monitoring
+
+# Upper bounds (in seconds) of the latency histogram buckets, the same defaults as the Prometheus client libraries
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 7.5, 10.0)
+PROFILER_ENGINES = ("cProfile", "pyinstrument")
+
+
+class LatencyHistograms:
+    def __init__(self, buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        """
+        Thread-safe latency histograms, one series per metric name and set of labels
+        :param buckets: upper bounds (in seconds) of the histogram buckets
+        """
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series = {}
+
+    def observe(self, metric: str, seconds: float, **labels) -> None:
+        """
+        Records one duration
+        :param metric: name of the histogram, e.g. "span" or "mongo_command"
+        :param seconds: the measured duration
+        :param labels: labels telling the series of the metric apart, e.g. span="mongo.search_collection"
+        :return: None
+        """
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * (len(self.buckets) + 1), "sum": 0.0, "max": 0.0}
+            # The last count is the +Inf bucket
+            series["counts"][next((i for i, bound in enumerate(self.buckets) if seconds <= bound), -1)] += 1
+            series["sum"] += seconds
+            series["max"] = max(series["max"], seconds)
+        return
+
+    def snapshot(self) -> list[dict]:
+        """
+        Copy of every series with its cumulative bucket counts and estimated percentiles
+        :return: list of Dictionaries of the metric, labels, count, sum, max, p50, p99 and (bound, cumulative count) buckets
+        """
+        with self._lock:
+            series_items = [(key, {**series, "counts": list(series["counts"])}) for key, series in self._series.items()]
+        snapshot = []
+        for (metric, labels), series in sorted(series_items):
+            cumulative = []
+            total = 0
+            for bound, count in zip((*self.buckets, float("inf")), series["counts"]):
+                total += count
+                cumulative.append((bound, total))
+            snapshot.append(
+                {
+                    "metric": metric,
+                    "labels": dict(labels),
+                    "count": total,
+                    "sum": series["sum"],
+                    "max": series["max"],
+                    "p50": self._percentile(cumulative, 0.5, series["max"]),
+                    "p99": self._percentile(cumulative, 0.99, series["max"]),
+                    "buckets": cumulative,
+                }
+            )
+        return snapshot
+
+    @staticmethod
+    def _percentile(cumulative: list[tuple[float, int]], fraction: float, maximum: float) -> float:
+        # Like histogram_quantile in Prometheus this reports the upper bound of the bucket the percentile falls in
+        target = fraction * cumulative[-1][1]
+        for bound, count in cumulative:
+            if count >= target:
+                return min(bound, maximum)
+        return maximum
+
+    def prometheus_text(self, gauges: dict[str, float] | None = None, prefix: str = "collections") -> str:
+        """
+        Renders every histogram, and any extra gauges, in the Prometheus text exposition format
+        :param gauges: Dictionary of gauge name to its current value
+        :param prefix: namespace added in front of every metric name
+        :return: string to serve on a /metrics endpoint
+        """
+        lines = []
+        described = set()
+        for series in self.snapshot():
+            name = f"{prefix}_{series['metric']}_seconds"
+            if name not in described:
+                described.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            labels = [f'{key}="{prometheus_label(value)}"' for key, value in series["labels"].items()]
+            for bound, count in series["buckets"]:
+                bucket_labels = ",".join([*labels, f'le="{"+Inf" if bound == float("inf") else bound}"'])
+                lines.append(f"{name}_bucket{{{bucket_labels}}} {count}")
+            lines.append(f"{name}_sum{{{','.join(labels)}}} {series['sum']}")
+            lines.append(f"{name}_count{{{','.join(labels)}}} {series['count']}")
+        for gauge, value in (gauges or {}).items():
+            lines.append(f"# TYPE {prefix}_{gauge} gauge")
+            lines.append(f"{prefix}_{gauge} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def prometheus_label(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RequestProfiler:
+    def __init__(self):
+        """
+        Opt-in profiler that captures a single request: arm it, and the next instrumented handler is profiled
+        """
+        self.armed = False
+        self.engine = "cProfile"
+        self.report = ""
+        self._lock = threading.Lock()
+
+    def arm(self, engine: str = "cProfile") -> None:
+        """
+        Profiles the next handler that runs
+        :param engine: "cProfile", or "pyinstrument" when it is installed (it follows awaits into the database calls)
+        :return: None
+        """
+        if engine not in PROFILER_ENGINES:
+            raise ValueError(f"Unknown profiler {engine}, use one of {', '.join(PROFILER_ENGINES)}")
+        if engine == "pyinstrument" and not pyinstrument_available():
+            raise ValueError("Profiling with pyinstrument needs the pyinstrument package to be installed")
+        with self._lock:
+            self.engine = engine
+            self.armed = True
+        return
+
+    @contextlib.contextmanager
+    def capture(self, name: str):
+        """
+        Profiles the block when armed (only once), otherwise does nothing
+        :param name: name of the request, shown on top of the report
+        """
+        with self._lock:
+            armed, self.armed = self.armed, False
+        if not armed:
+            yield
+            return
+        started = time.perf_counter()
+        if self.engine == "pyinstrument":
+            from pyinstrument import Profiler
+
+            profiler = Profiler(async_mode="enabled")
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                report = profiler.output_text()
+        else:
+            # cProfile only sees the event loop thread, so database calls show up as time spent awaiting them
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                yield
+            finally:
+                profiler.disable()
+                report_stream = io.StringIO()
+                pstats.Stats(profiler, stream=report_stream).sort_stats("cumulative").print_stats(40)
+                report = report_stream.getvalue()
+        self.report = f"{name} ({self.engine}, {time.perf_counter() - started:.3f}s)\n\n{report}"
+
+
+def pyinstrument_available() -> bool:
+    """
+    Checks whether the optional pyinstrument profiler is installed
+    :return: True if it can be imported
+    """
+    return find_spec("pyinstrument") is not None
+
+
+# Shared by every module, so the /metrics endpoint and the Stats tab see all the instrumented code paths
+METRICS = LatencyHistograms()
+PROFILER = RequestProfiler()
+
+
+@contextlib.contextmanager
+def span(name: str):
+    """
+    Times a block of code into the "span" histogram
+    :param name: name of the span, e.g. "table.serialize"
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.observe("span", time.perf_counter() - started, span=name)
+
+
+def timed(name: str, profile: bool = False):
+    """
+    Decorator timing every call of a function, coroutine function or generator function (one span per item) as a span
+    :param name: name of the span
+    :param profile: let the RequestProfiler capture the call when it is armed, meant for the GUI handlers
+    :return: the decorator
+    """
+
+    def decorator(function):
+        capture = PROFILER.capture if profile else lambda _: contextlib.nullcontext()
+        if inspect.iscoroutinefunction(function):
+
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with capture(name), span(name):
+                    return await function(*args, **kwargs)
+
+            return async_wrapper
+
+        if inspect.isgeneratorfunction(function):
+
+            @functools.wraps(function)
+            def generator_wrapper(*args, **kwargs):
+                generator = function(*args, **kwargs)
+                try:
+                    while True:
+                        with span(name):
+                            try:
+                                item = next(generator)
+                            except StopIteration as stop:
+                                return stop.value
+                        yield item
+                finally:
+                    generator.close()
+
+            return generator_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with capture(name), span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class CommandStatsListener(monitoring.CommandListener):
+    """
+    Records the server round trip of every command (find, aggregate, insert, ...) in the "mongo_command" histogram
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        METRICS.observe("mongo_command", event.duration_micros / 1_000_000, command=event.command_name, outcome="ok")
+
+    def failed(self, event):
+        METRICS.observe("mongo_command", event.duration_micros / 1_000_000, command=event.command_name, outcome="error")
+
+
+class PoolStatsListener(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        """
+        Collects connection pool (CMAP) statistics across every server the client talks to
+        """
+        self._lock = threading.Lock()
+        self.connections_created = 0
+        self.connections_closed = 0
+        self.checked_out = 0
+        self.checkouts = 0
+        self.checkout_failures = 0
+        self.checkout_wait_seconds = 0.0
+        self.max_checkout_wait_seconds = 0.0
+        self.pool_clears = 0
+
+    def stats(self) -> dict:
+        """
+        Snapshot of the pool counters
+        :return: Dictionary of the open, in-use and created connections, checkouts and checkout wait times
+        """
+        with self._lock:
+            return {
+                "open": self.connections_created - self.connections_closed,
+                "in_use": self.checked_out,
+                "created": self.connections_created,
+                "closed": self.connections_closed,
+                "checkouts": self.checkouts,
+                "checkout_failures": self.checkout_failures,
+                "avg_checkout_wait_ms": 1000 * self.checkout_wait_seconds / self.checkouts if self.checkouts else 0.0,
+                "max_checkout_wait_ms": 1000 * self.max_checkout_wait_seconds,
+                "pool_clears": self.pool_clears,
+            }
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_created += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_closed += 1
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            # The time spent waiting for (or opening) a connection, reported by PyMongo 4.7+
+            wait_seconds = getattr(event, "duration", None) or 0.0
+            self.checkout_wait_seconds += wait_seconds
+            self.max_checkout_wait_seconds = max(self.max_checkout_wait_seconds, wait_seconds)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
@@ -0,0 +1,205 @@
+import math
+import multiprocessing
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import bson
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from pymongo import MongoClient
+
+from src.ingest import UploadedWorkbook, iter_frame_chunks
+
+# Set up once in every worker process by init_upload_worker
+worker_connection = None
+worker_workbooks = {}
+
+
+def plan_upload_tasks(
+    input_df_dict, batch_size: int, task_rows: int, resume_from: dict | None = None, key_fields: dict | None = None
+):
+    """
+    Splits upload data into tasks for the worker processes, each covering whole batches of one sheet.
+    Sheets whose rows can be read from any point (see UploadedWorkbook.seekable) are split into row ranges the workers
+    parse themselves, the sheets of a multi-sheet openpyxl workbook are parsed by one worker each, and everything else
+    is parsed here and sent over as DataFrame chunks, leaving the conversion, encoding and writes to the workers.
+    :param input_df_dict: the parsed dictionary object of the dataframes of upload data
+    :param batch_size: number of rows per batch
+    :param task_rows: number of rows per task, rounded down to whole batches
+    :param resume_from: optional dictionary of collection name to the number of batches already committed
+    :param key_fields: optional dictionary of collection name to the fields to upsert its rows on
+    :return: Generator of task dictionaries, in file order
+    """
+    resume_from = resume_from or {}
+    key_fields = key_fields or {}
+    batches_per_task = max(task_rows // batch_size, 1)
+    for collection, sheet in input_df_dict.items():
+        first_batch = resume_from.get(collection, 0)
+        workbook = getattr(sheet, "workbook", None)
+        total_rows = sheet.rows if workbook is not None else len(sheet)
+        batches = math.ceil(total_rows / batch_size) if total_rows is not None else None
+        task = {"collection": collection, "key_fields": key_fields.get(collection), "batch_size": batch_size}
+        if workbook is not None and total_rows is not None:
+            range_task = {
+                **task,
+                "kind": "range",
+                "path": str(workbook.path),
+                "engine": workbook.engine,
+                "file_name": workbook.file_name,
+                "sheet": sheet.name,
+                "batches": batches,
+            }
+            if workbook.seekable:
+                for task_batch in range(first_batch, batches, batches_per_task):
+                    last_batch = min(task_batch + batches_per_task, batches) - 1
+                    yield {
+                        **range_task,
+                        "start": task_batch * batch_size,
+                        # The last task reads on to the end, in case the row count of the file was short
+                        "stop": (last_batch + 1) * batch_size if last_batch < batches - 1 else None,
+                        "last_batch": last_batch,
+                    }
+                continue
+            if workbook.engine == "openpyxl" and len(workbook.sheet_names) > 1 and first_batch < batches:
+                # openpyxl has to parse every row before a range anyway, so each sheet goes to a single worker
+                yield {**range_task, "start": first_batch * batch_size, "stop": None, "last_batch": batches - 1}
+                continue
+        chunks = sheet.iter_chunks(batch_size) if workbook is not None else iter_frame_chunks(sheet, batch_size)
+        task_chunks = []
+        for batch_number, chunk in enumerate(chunks):
+            if batch_number < first_batch or chunk.empty:
+                continue
+            task_chunks.append(chunk)
+            if len(task_chunks) == batches_per_task:
+                yield {**task, "kind": "chunks", "chunks": task_chunks, "last_batch": batch_number, "batches": batches}
+                task_chunks = []
+        if task_chunks:
+            yield {**task, "kind": "chunks", "chunks": task_chunks, "last_batch": batch_number, "batches": batches}
+
+
+def run_upload_tasks(tasks, settings, client_uri: str, workers: int):
+    """
+    Runs upload tasks on a pool of worker processes, keeping a couple of tasks per worker in flight so no process sits
+    idle while the file isn't parsed far ahead of the writes
+    :param tasks: iterable of task dictionaries (see plan_upload_tasks)
+    :param settings: Pydantic Settings object that stores application settings
+    :param client_uri: connection string the workers open their own MongoClient with
+    :param workers: number of worker processes
+    :return: Generator of (task, result) tuples in the order of the tasks
+    """
+    # Workers are spawned instead of forked, a fork would copy the threads and open sockets of the app's MongoClient
+    executor = ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=init_upload_worker,
+        initargs=(settings, client_uri),
+    )
+    pending = deque()
+    try:
+        for task in tasks:
+            pending.append((task, executor.submit(run_upload_task, task)))
+            if len(pending) >= 2 * workers:
+                task, future = pending.popleft()
+                yield task, future.result()
+        while pending:
+            task, future = pending.popleft()
+            yield task, future.result()
+    finally:
+        # Tasks that haven't started yet are dropped when the upload fails or is stopped
+        executor.shutdown(wait=True, cancel_futures=True)
+    return
+
+
+def init_upload_worker(settings, client_uri: str) -> None:
+    global worker_connection
+    # Imported here as src.mongo imports this module
+    from src.mongo import MongoConnection
+
+    # A worker only ever has one write in flight, so it doesn't keep the warm connections of the app's pool
+    client = MongoClient(client_uri, **{**settings.mongo_client_options, "minPoolSize": 0})
+    # Nor does it open the local replica, the app process keeps that file to itself (see iter_parallel_upload)
+    worker_connection = MongoConnection(settings.model_copy(update={"replica_path": ""}), mongo_client=client)
+    return
+
+
+def iter_task_chunks(task: dict):
+    """
+    Reads the DataFrame chunks of a task, parsing the row range of a sheet in this process where there is one
+    :param task: task dictionary (see plan_upload_tasks)
+    :return: Generator of DataFrame chunks
+    """
+    if task["kind"] == "chunks":
+        yield from task["chunks"]
+        return
+    workbook_key = (task["path"], task["engine"])
+    if workbook_key not in worker_workbooks:
+        # Never closed here, closing would remove the spooled upload the app and the other workers still read
+        worker_workbooks[workbook_key] = UploadedWorkbook(
+            Path(task["path"]), engine=task["engine"], file_name=task["file_name"]
+        )
+    yield from worker_workbooks[workbook_key].iter_chunks(
+        task["sheet"], task["batch_size"], task["start"], task["stop"]
+    )
+    return
+
+
+def encode_documents(documents: list[dict]) -> list[RawBSONDocument]:
+    """
+    Converts upload documents to BSON, so the CPU-bound encoding happens in the worker process and PyMongo only
+    copies the bytes into its messages
+    :param documents: list of the documents of a chunk
+    :return: list of the encoded documents
+    """
+    encoded = []
+    for document in documents:
+        # insert_many can't add an _id to an encoded document, so it is added here the same way PyMongo would
+        if "_id" not in document:
+            document["_id"] = ObjectId()
+        encoded.append(RawBSONDocument(bson.encode(document)))
+    return encoded
+
+
+def run_upload_task(task: dict) -> dict:
+    """
+    Parses, encodes and writes the rows of one task in a worker process.
+    Upserts only skip keys repeated within the task, a key repeated in another task updates the same document.
+    Likewise the pre-flight checks only find values of unique fields repeated within the task, a value repeated in
+    another task is refused by the server and comes back with the failed rows all the same.
+    :param task: task dictionary (see plan_upload_tasks)
+    :return: Dictionary of the rows, the inserted, updated and skipped counts, the errors, the failed rows and the
+        seconds it took
+    """
+    from src.schema import join_failed_rows
+
+    task_started = time.perf_counter()
+    result = {"rows": 0, "inserted": 0, "updated": 0, "skipped": 0, "rejected": 0, "errors": []}
+    seen_keys = set()  # hashes of the key values sent so far by this task
+    seen_unique = {}  # hashes of the values of unique fields checked so far by this task
+    failed = []
+    for chunk in iter_task_chunks(task):
+        if chunk.empty:
+            continue
+        if task["key_fields"]:
+            chunk_result = worker_connection.upsert_chunk(
+                task["collection"],
+                chunk,
+                task["key_fields"],
+                seen_keys,
+                task["schema"],
+                task["unique_keys"],
+                seen_unique,
+            )
+        else:
+            chunk_result = worker_connection.insert_chunk(
+                task["collection"], chunk, task["schema"], True, task["unique_keys"], seen_unique
+            )
+        result["rows"] += len(chunk)
+        for count in ("inserted", "updated", "skipped", "rejected"):
+            result[count] += chunk_result[count]
+        result["errors"] += chunk_result["errors"]
+        failed.append(chunk_result["failed_rows"])
+    result["failed_rows"] = join_failed_rows(failed)
+    result["seconds"] = time.perf_counter() - task_started
+    return result
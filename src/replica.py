@@ -0,0 +1,434 @@
+import functools
+import itertools
+import re
+import sqlite3
+import threading
+import time
+from collections.abc import Mapping
+from datetime import timedelta
+from pathlib import Path
+
+import bson
+from bson import ObjectId
+from bson.raw_bson import RawBSONDocument
+from pymongo.errors import PyMongoError
+
+from src.serialize import search_candidates
+
+# Search modes the replica answers like the server does, text searches need the collection's text index
+REPLICA_SEARCH_MODES = ("contains", "exact", "prefix", "prefix_ci")
+# Change stream events that change the documents of a collection
+REPLICA_EVENTS = ("insert", "update", "replace", "delete", "drop", "rename", "dropDatabase")
+# ObjectIds made by different clients are only ordered to the second, so every sync re-reads this window
+SYNC_OVERLAP_SECONDS = 60
+# Highest code point, every string starting with a prefix sorts below the prefix followed by it
+PREFIX_END = "\U0010ffff"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS documents (
+    collection TEXT NOT NULL,
+    id_key TEXT NOT NULL,
+    body BLOB NOT NULL,
+    PRIMARY KEY (collection, id_key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS field_values (
+    collection TEXT NOT NULL,
+    id_key TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value
+);
+CREATE INDEX IF NOT EXISTS field_values_search ON field_values (collection, field, value);
+DROP INDEX IF EXISTS field_values_folded;
+CREATE INDEX IF NOT EXISTS field_values_casefold ON field_values (collection, field, casefold(value));
+CREATE INDEX IF NOT EXISTS field_values_document ON field_values (collection, id_key, field);
+CREATE TABLE IF NOT EXISTS collections (
+    collection TEXT PRIMARY KEY,
+    high_water BLOB,
+    synced_at REAL,
+    documents INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+
+def id_key(item_id) -> str:
+    # ObjectIds are keyed by their hex string, which sorts in the same order as the ObjectIds themselves
+    return str(item_id) if isinstance(item_id, ObjectId) else f"{type(item_id).__name__}:{item_id}"
+
+
+def path_values(path: str, value):
+    """
+    Yields the searchable values of a document field, the same ones a query on the server would match: strings and
+    numbers, the elements of arrays and the fields of embedded documents under their dotted path
+    :param path: dotted path of the field
+    :param value: value of the field
+    :return: Generator of (path, value) tuples
+    """
+    if isinstance(value, bool):
+        return  # booleans never match a string search or its numeric candidates
+    if isinstance(value, (str, int, float)):
+        yield path, value
+    elif isinstance(value, Mapping):
+        for field, field_value in value.items():
+            yield from path_values(f"{path}.{field}", field_value)
+    elif isinstance(value, list):
+        for item in value:
+            yield from path_values(path, item)
+
+
+@functools.lru_cache(maxsize=256)
+def compiled_pattern(pattern: str) -> re.Pattern:
+    return re.compile(pattern, re.IGNORECASE)
+
+
+def regexp(pattern: str, value) -> bool:
+    # Called by SQLite for "value REGEXP pattern", matching like the "contains" search of the server
+    return isinstance(value, str) and compiled_pattern(pattern).search(value) is not None
+
+
+def casefold(value):
+    # Called by SQLite for the "prefix_ci" search, its own lower() only folds ASCII letters
+    return value.casefold() if isinstance(value, str) else value
+
+
+class LocalReplica:
+    def __init__(self, path: str | Path):
+        """
+        Local read replica of the collections in a SQLite file, so searches are answered without a round trip to the
+        cluster and keep working while it can't be reached. Documents are stored as BSON, every string and numeric
+        value (including array elements and embedded fields) is indexed by collection and field for the searches.
+        Collections are copied by an incremental sync over their _ids and kept current by a change stream (see watch)
+        or by the writes of this app (write-through).
+        :param path: path of the SQLite file, created if it doesn't exist
+        """
+        self.path = Path(path)
+        self.watched = False
+        self._local = threading.local()  # one SQLite connection per thread, WAL lets them read at the same time
+        self._write_lock = threading.Lock()
+        with self.connection() as connection:
+            connection.executescript(SCHEMA)
+
+    def connection(self) -> sqlite3.Connection:
+        """
+        SQLite connection of the calling thread, opened on first use
+        :return: sqlite3 Connection
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.create_function("regexp", 2, regexp, deterministic=True)
+            # The casefold index needs the function on every connection that writes field_values
+            connection.create_function("casefold", 1, casefold, deterministic=True)
+            self._local.connection = connection
+        return connection
+
+    def collections(self) -> dict:
+        """
+        Collections copied into the replica so far
+        :return: Dictionary of collection name to its number of documents and the time of its last sync
+        """
+        rows = self.connection().execute("SELECT collection, documents, synced_at FROM collections").fetchall()
+        return {name: {"documents": documents, "synced_at": synced_at} for name, documents, synced_at in rows}
+
+    def can_search(self, collection: str, search_mode: str) -> bool:
+        """
+        Whether the replica can answer a search, which needs a synced collection and a mode it implements
+        :param collection: string value for the Collection name
+        :param search_mode: one of the SEARCH_MODES keys
+        :return: True if the search can be answered locally
+        """
+        if search_mode not in REPLICA_SEARCH_MODES:
+            return False
+        synced = (
+            self.connection()
+            .execute("SELECT synced_at FROM collections WHERE collection = ?", (collection,))
+            .fetchone()
+        )
+        return synced is not None and synced[0] is not None
+
+    def sync(self, mongo_collection, batch_size: int = 5000) -> int:
+        """
+        Copies the documents added to a collection since its last sync, reading on from the highest _id copied so far
+        (the high-water mark). Changes to documents already copied come from the change stream or the writes of this
+        app; without a change stream, forget the collection to copy it again from scratch.
+        :param mongo_collection: pymongo Collection to copy
+        :param batch_size: number of documents read and stored per batch
+        :return: number of documents read
+        """
+        collection = mongo_collection.name
+        state = (
+            self.connection()
+            .execute("SELECT high_water FROM collections WHERE collection = ?", (collection,))
+            .fetchone()
+        )
+        query = {}
+        if state is not None and state[0] is not None:
+            high_water = bson.decode(state[0])["_id"]
+            if isinstance(high_water, ObjectId):
+                window_start = high_water.generation_time - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+                query = {"_id": {"$gte": ObjectId.from_datetime(window_start)}}
+            else:
+                query = {"_id": {"$gt": high_water}}
+        documents_read = 0
+        cursor = mongo_collection.find(query).sort("_id", 1).batch_size(batch_size)
+        while documents := list(itertools.islice(cursor, batch_size)):
+            documents_read += len(documents)
+            # Documents of the overlap window copied by an earlier sync are already current, changes to them come
+            # from the change stream or this app's writes
+            copied = self.copied_keys(collection, [id_key(document["_id"]) for document in documents])
+            self.upsert_many(collection, [document for document in documents if id_key(document["_id"]) not in copied])
+            # A sync cut short carries on from the last stored batch
+            self.record_sync(collection, documents[-1]["_id"], finished=False)
+        self.record_sync(collection, None, finished=True)
+        return documents_read
+
+    def copied_keys(self, collection: str, keys: list[str]) -> set[str]:
+        """
+        Which of the given documents the replica already holds
+        :param collection: string value for the Collection name
+        :param keys: list of the id_keys to look up
+        :return: set of the id_keys found
+        """
+        rows = self.connection().execute(
+            f"SELECT id_key FROM documents WHERE collection = ? AND id_key IN ({', '.join('?' * len(keys))})",
+            [collection, *keys],
+        )
+        return {key for (key,) in rows}
+
+    def record_sync(self, collection: str, high_water, finished: bool) -> None:
+        """
+        Stores the high-water mark of a collection and, once a sync has finished, its time, a collection is only
+        searched locally after its first sync has finished
+        :param collection: string value for the Collection name
+        :param high_water: highest _id copied, None to keep the previous mark
+        :param finished: whether the sync has copied everything
+        :return: None
+        """
+        with self._write_lock, self.connection() as connection:
+            connection.execute(
+                "INSERT INTO collections (collection, high_water, synced_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (collection) DO UPDATE SET high_water = COALESCE(excluded.high_water, high_water), "
+                "synced_at = COALESCE(excluded.synced_at, synced_at)",
+                (
+                    collection,
+                    bson.encode({"_id": high_water}) if high_water is not None else None,
+                    time.time() if finished else None,
+                ),
+            )
+            self.update_document_count(connection, collection)
+        return
+
+    def update_document_count(self, connection: sqlite3.Connection, collection: str) -> None:
+        # Kept in the collections table, so listing the replicated collections never counts their documents
+        connection.execute(
+            "UPDATE collections SET documents = (SELECT COUNT(*) FROM documents WHERE collection = ?) "
+            "WHERE collection = ?",
+            (collection, collection),
+        )
+        return
+
+    def upsert_many(self, collection: str, documents: list[dict]) -> None:
+        """
+        Stores documents, replacing the ones with the same _id, and indexes their values
+        :param collection: string value for the Collection name
+        :param documents: list of documents, each one with its _id
+        :return: None
+        """
+        if not documents:
+            return
+        keys = [(collection, id_key(document["_id"])) for document in documents]
+        values = [
+            (collection, key, path, value)
+            for (_, key), document in zip(keys, documents)
+            for field, field_value in document.items()
+            if field != "_id"
+            for path, value in path_values(field, field_value)
+        ]
+        with self._write_lock, self.connection() as connection:
+            connection.executemany("DELETE FROM field_values WHERE collection = ? AND id_key = ?", keys)
+            connection.executemany(
+                "INSERT OR REPLACE INTO documents (collection, id_key, body) VALUES (?, ?, ?)",
+                [(collection, key, bson.encode(document)) for (_, key), document in zip(keys, documents)],
+            )
+            connection.executemany(
+                "INSERT INTO field_values (collection, id_key, field, value) VALUES (?, ?, ?, ?)", values
+            )
+        return
+
+    def upsert(self, collection: str, document: dict) -> None:
+        """
+        Stores a single document written by this app, only once its collection is being replicated
+        :param collection: string value for the Collection name
+        :param document: the document, with its _id
+        :return: None
+        """
+        if collection in self.collections():
+            self.upsert_many(collection, [document])
+            with self._write_lock, self.connection() as connection:
+                self.update_document_count(connection, collection)
+        return
+
+    def delete(self, collection: str, item_id) -> None:
+        """
+        Removes a document from the replica
+        :param collection: string value for the Collection name
+        :param item_id: _id of the document
+        :return: None
+        """
+        key = (collection, id_key(item_id))
+        with self._write_lock, self.connection() as connection:
+            connection.execute("DELETE FROM documents WHERE collection = ? AND id_key = ?", key)
+            connection.execute("DELETE FROM field_values WHERE collection = ? AND id_key = ?", key)
+            self.update_document_count(connection, collection)
+        return
+
+    def forget(self, collection: str | None = None) -> None:
+        """
+        Removes a collection from the replica, its searches go to the server again until the next sync copies it anew
+        :param collection: string value for the Collection name, or None to forget every collection
+        :return: None
+        """
+        where, parameters = ("WHERE collection = ?", (collection,)) if collection is not None else ("", ())
+        with self._write_lock, self.connection() as connection:
+            for table in ("documents", "field_values", "collections"):
+                connection.execute(f"DELETE FROM {table} {where}", parameters)
+        return
+
+    def watch(self, db) -> bool:
+        """
+        Starts a background change stream applying the inserts, updates and deletes of any client to the replica
+        :param db: pymongo Database to follow
+        :return: True if the change stream is running, False if the deployment does not support change streams
+        """
+        pipeline = [{"$match": {"operationType": {"$in": list(REPLICA_EVENTS)}}}]
+        try:
+            change_stream = db.watch(pipeline, full_document="updateLookup")
+        except PyMongoError as watch_error:
+            print(f"Change streams unavailable, the local replica only follows new documents: {watch_error}")
+            return False
+
+        def apply_changes():
+            try:
+                with change_stream:
+                    for change in change_stream:
+                        self.apply_change(change)
+            except PyMongoError as stream_error:
+                print(f"Local replica change stream stopped: {stream_error}")
+            self.watched = False
+
+        self.watched = True
+        threading.Thread(target=apply_changes, name="replica-watch", daemon=True).start()
+        return True
+
+    def apply_change(self, change: dict) -> None:
+        """
+        Applies a single change stream event (see watch)
+        :param change: the change event document
+        :return: None
+        """
+        operation = change["operationType"]
+        collection = change.get("ns", {}).get("coll")
+        if operation == "dropDatabase":
+            self.forget()
+        elif operation in ("drop", "rename"):
+            self.forget(collection)
+        elif collection in self.collections():
+            if change.get("fullDocument") is not None:
+                self.upsert(collection, change["fullDocument"])
+            else:
+                # Deleted, or deleted again before the update could be looked up
+                self.delete(collection, change["documentKey"]["_id"])
+        return
+
+    def match_query(
+        self, collection: str, search_field: str, search_value: str, search_mode: str
+    ) -> tuple[str, list] | None:
+        """
+        Builds the SQL selecting the documents a search matches, mirroring MongoConnection.build_search_query
+        :param collection: string value for the Collection name
+        :param search_field: string value for the field to search
+        :param search_value: string value to search for in the field
+        :param search_mode: one of the REPLICA_SEARCH_MODES
+        :return: Tuple of the SQL selecting the matching id_keys and its parameters, or None if nothing can match
+        """
+        if search_mode not in REPLICA_SEARCH_MODES:
+            raise ValueError(f"The local replica can't search in mode '{search_mode}'")
+        if search_field == "_id":
+            if not ObjectId.is_valid(search_value):
+                return None
+            return "SELECT ? AS id_key", [id_key(ObjectId(search_value))]
+        values_query = "SELECT id_key FROM field_values WHERE collection = ? AND field = ? AND "
+        parameters = [collection, search_field]
+        if search_mode == "exact":
+            candidates = search_candidates(search_value)
+            return values_query + f"value IN ({', '.join('?' * len(candidates))})", parameters + candidates
+        if search_mode == "prefix":
+            # Numbers sort before any text in SQLite, so the range only holds strings, like the server's regex
+            return values_query + "value >= ? AND value < ?", parameters + [search_value, search_value + PREFIX_END]
+        if search_mode == "prefix_ci":
+            folded = search_value.casefold()
+            return (
+                values_query + "casefold(value) >= ? AND casefold(value) < ? AND typeof(value) = 'text'",
+                parameters + [folded, folded + PREFIX_END],
+            )
+        return values_query + "value REGEXP ?", parameters + [search_value]
+
+    def search_page(
+        self,
+        collection: str,
+        search_field: str,
+        search_value: str,
+        page: int = 1,
+        rows_per_page: int | None = 25,
+        fields: list[str] | None = None,
+        sort_by: str | None = None,
+        descending: bool = False,
+        after_id: str | None = None,
+        search_mode: str = "contains",
+        raw: bool = False,
+    ) -> tuple[list, int]:
+        """
+        Answers a search from the replica, with the same arguments and results as MongoConnection.search_collection_page
+        :param rows_per_page: number of documents per page, None for all the matching documents
+        :return: Tuple of the list of documents on the page and the total number of matching documents
+        """
+        match = self.match_query(collection, search_field, search_value, search_mode)
+        if match is None:
+            return [], 0
+        match_query, match_parameters = match
+        connection = self.connection()
+        documents_query = f"FROM documents AS d WHERE d.collection = ? AND d.id_key IN ({match_query})"
+        parameters = [collection, *match_parameters]
+        total = connection.execute(f"SELECT COUNT(*) {documents_query}", parameters).fetchone()[0]
+
+        direction = "DESC" if descending else "ASC"
+        skip = (page - 1) * (rows_per_page or 0)
+        if sort_by in (None, "_id"):
+            if after_id is not None and ObjectId.is_valid(after_id):
+                documents_query += f" AND d.id_key {'<' if descending else '>'} ?"
+                parameters.append(id_key(ObjectId(after_id)))
+                skip = 0
+            order = f"d.id_key {direction}"
+        else:
+            # Like the server, arrays sort by their smallest element ascending and by their largest descending
+            order = (
+                f"(SELECT {'MAX' if descending else 'MIN'}(value) FROM field_values AS s WHERE s.collection = d.collection "
+                f"AND s.id_key = d.id_key AND s.field = ?) {direction}, d.id_key ASC"
+            )
+            parameters.append(sort_by)
+        rows = connection.execute(
+            f"SELECT d.body {documents_query} ORDER BY {order} LIMIT ? OFFSET ?",
+            [*parameters, rows_per_page or -1, skip],
+        ).fetchall()
+        if fields:
+            top_level = {field.split(".")[0] for field in fields}
+            documents = [
+                {field: value for field, value in bson.decode(body).items() if field == "_id" or field in top_level}
+                for (body,) in rows
+            ]
+        elif raw:
+            documents = [RawBSONDocument(body) for (body,) in rows]
+        else:
+            documents = [bson.decode(body) for (body,) in rows]
+        return documents, total
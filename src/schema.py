@@ -0,0 +1,310 @@
+import pandas as pd
+from pandas.api import types as dtypes
+from pandas.util import hash_pandas_object
+
+# Types a column can be coerced to, keyed by the BSON type names $type reports in the fields cache
+BSON_FIELD_TYPES = {
+    "string": "string",
+    "int": "int",
+    "long": "int",
+    "double": "double",
+    "decimal": "double",
+    "bool": "bool",
+    "date": "date",
+}
+FIELD_TYPES = ("string", "int", "double", "bool", "date")
+# Column holding the reason a row failed in the downloadable failed rows, left out when the file is uploaded again
+UPLOAD_ERROR_COLUMN = "Upload error"
+BSON_MAX_DOCUMENT_BYTES = 16 * 1024 * 1024
+BOOL_STRINGS = {
+    "true": True,
+    "yes": True,
+    "y": True,
+    "1": True,
+    "1.0": True,
+    "false": False,
+    "no": False,
+    "n": False,
+    "0": False,
+    "0.0": False,
+}
+
+
+def field_type(bson_types: list[str]) -> str | None:
+    """
+    Picks the type to coerce a field to from the BSON types observed in the collection
+    :param bson_types: list of the $type names of the field's values (see MongoConnection.discover_collection_schema)
+    :return: one of FIELD_TYPES, or None when the field holds mixed (or only nested) values and is left as it is
+    """
+    kinds = {BSON_FIELD_TYPES[bson_type] for bson_type in bson_types if bson_type in BSON_FIELD_TYPES}
+    if len(kinds) == 1:
+        return kinds.pop()
+    if kinds == {"int", "double"}:
+        return "double"
+    return None
+
+
+def infer_field_type(column: pd.Series) -> str | None:
+    """
+    Picks the type of an upload column that isn't in the fields cache yet from the dtype pandas parsed it as
+    :param column: Series of the column values
+    :return: one of FIELD_TYPES, or None to leave the values as they are
+    """
+    if dtypes.is_bool_dtype(column):
+        return "bool"
+    if dtypes.is_integer_dtype(column):
+        return "int"
+    if dtypes.is_float_dtype(column):
+        # A single empty cell turns a column of whole numbers (e.g. IDs) into floats
+        values = column.dropna()
+        return "int" if not values.empty and values.mod(1).eq(0).all() else "double"
+    if dtypes.is_datetime64_any_dtype(column):
+        return "date"
+    return None
+
+
+def infer_schema(sample: pd.DataFrame, cached_schema: dict | None = None) -> dict:
+    """
+    Builds the schema of an upload, the types observed in the collection win over what pandas guessed from the file
+    :param sample: DataFrame of the first rows of the sheet
+    :param cached_schema: optional dictionary of field name to type from the fields cache (see field_type)
+    :return: Dictionary of column name to one of FIELD_TYPES or None
+    """
+    cached_schema = cached_schema or {}
+    return {
+        column: cached_schema[column] if column in cached_schema else infer_field_type(sample[column])
+        for column in sample.columns
+    }
+
+
+def coerce_column(column: pd.Series, column_type: str) -> tuple[pd.Series, pd.Series]:
+    """
+    Converts a whole column to one type at once
+    :param column: Series of the column values
+    :param column_type: one of FIELD_TYPES
+    :return: Tuple of the converted Series and a boolean Series marking the values that could not be converted
+    """
+    present = column.notna()
+    if column_type == "string":
+        if dtypes.is_float_dtype(column) and column.dropna().mod(1).eq(0).all():
+            # Whole numbers read as floats would otherwise be stored as e.g. "9780000000000.0"
+            column = column.astype("Int64")
+        return column.astype(str).where(present), present & False
+    if column_type in ("int", "double"):
+        converted = pd.to_numeric(column, errors="coerce")
+        rejected = present & converted.isna()
+        if column_type == "int":
+            fractional = converted.notna() & converted.mod(1).ne(0)
+            converted = converted.mask(fractional).astype("Int64")
+            rejected |= fractional
+        return converted, rejected
+    if column_type == "bool":
+        converted = column.astype(str).str.strip().str.lower().map(BOOL_STRINGS).where(present)
+        return converted, present & converted.isna()
+    if column_type == "date":
+        converted = pd.to_datetime(column, errors="coerce")
+        # The format is inferred from the first value, dates written another way are parsed one by one
+        missed = present & converted.isna()
+        if missed.any():
+            converted = converted.mask(missed, pd.to_datetime(column[missed], errors="coerce", format="mixed"))
+        return converted, present & converted.isna()
+    raise ValueError(f"Unknown field type '{column_type}', expected one of {FIELD_TYPES}")
+
+
+def coerce_chunk(chunk: pd.DataFrame, schema: dict | None = None) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Coerces the columns of a chunk of upload rows to the types of the schema with vectorized conversions.
+    Rows holding a value that doesn't fit the type of its column are set aside as a whole instead of being stored
+    with a wrong (or missing) value.
+    :param chunk: DataFrame chunk of the sheet
+    :param schema: optional dictionary of column name to one of FIELD_TYPES or None (see infer_schema)
+    :return: Tuple of the coerced rows and the rejected rows, which get a "Rejected fields" column naming the culprits
+    """
+    schema = schema or {}
+    coerced = {}
+    rejected_columns = {}
+    for column in chunk.columns:
+        column_type = schema.get(column)
+        if column_type is None:
+            coerced[column] = chunk[column]
+            continue
+        coerced[column], rejected_columns[column] = coerce_column(chunk[column], column_type)
+    coerced = pd.DataFrame(coerced, index=chunk.index)
+    if not rejected_columns:
+        return coerced, chunk.iloc[:0]
+    rejected_cells = pd.DataFrame(rejected_columns, index=chunk.index)
+    rejected_rows = rejected_cells.any(axis=1)
+    if not rejected_rows.any():
+        return coerced, chunk.iloc[:0]
+    rejected = chunk[rejected_rows].copy()
+    culprits = rejected_cells[rejected_rows]
+    rejected["Rejected fields"] = culprits.apply(lambda row: ", ".join(culprits.columns[row]), axis=1)
+    return coerced[~rejected_rows], rejected
+
+
+def rejection_errors(rejected: pd.DataFrame, schema: dict) -> list[str]:
+    """
+    Summarizes the rejected rows of a chunk with one message per field, instead of one per cell
+    :param rejected: DataFrame of the rejected rows (see coerce_chunk)
+    :param schema: dictionary of column name to one of FIELD_TYPES or None
+    :return: list of the messages
+    """
+    if rejected.empty:
+        return []
+    field_counts = rejected["Rejected fields"].str.split(", ").explode().value_counts()
+    return [f"{count} rows rejected, {field} is not a valid {schema[field]}" for field, count in field_counts.items()]
+
+
+def frame_documents(frame: pd.DataFrame) -> list[dict]:
+    """
+    Turns coerced rows into documents, leaving out the empty cells rather than storing NaN or null
+    :param frame: DataFrame of the coerced rows
+    :return: list of the documents
+    """
+    # Missing values of every dtype (NaN, NaT, pd.NA) become None, and to_dict hands back plain Python scalars
+    records = frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+    return [{field: value for field, value in record.items() if value is not None} for record in records]
+
+
+def field_name_error(name) -> str | None:
+    """
+    Checks a column name against what MongoDB accepts as a top-level field name of an inserted document
+    :param name: the column name
+    :return: the reason the name can't be stored, or None if it is fine
+    """
+    name = str(name)
+    if name == "" or name.startswith("Unnamed: "):
+        return "has no header"
+    if name.startswith("$"):
+        return "starts with $"
+    if "." in name:
+        # Also catches headers repeated in the sheet, which pandas renames to e.g. "Title.1"
+        return "contains a ."
+    if "\x00" in name:
+        return "contains a null character"
+    return None
+
+
+def chunk_bytes_bound(chunk: pd.DataFrame) -> int:
+    """
+    Upper bound of the BSON size of all the documents of a chunk together, so chunks without large values skip the
+    estimate of every row. UTF-8 takes at most twice the bytes Python keeps a string in, every other value at most 8.
+    :param chunk: DataFrame chunk of the sheet
+    :return: the bound in bytes
+    """
+    # Document length and terminator, then per field its type, name, name terminator, and string length and terminator
+    row_bytes = 5 + sum(len(str(column).encode()) + 7 for column in chunk.columns)
+    return 2 * int(chunk.memory_usage(index=False, deep=True).sum()) + len(chunk) * row_bytes
+
+
+def estimated_bson_sizes(chunk: pd.DataFrame) -> pd.Series:
+    """
+    Estimates the BSON size of the document every row would become, a whole column at a time. Strings are counted
+    at one byte per character, so documents with a lot of non-ASCII text are underestimated and left to the server.
+    :param chunk: DataFrame chunk of the sheet
+    :return: Series of the estimated sizes in bytes
+    """
+    sizes = pd.Series(5, index=chunk.index)  # document length and terminator
+    for column in chunk.columns:
+        values = chunk[column]
+        # Element type, field name and its terminator, then the value itself: 8 bytes for numbers and dates
+        element_bytes = 2 + len(str(column).encode())
+        if dtypes.is_object_dtype(values) or dtypes.is_string_dtype(values):
+            # String length, characters and terminator, other values of a mixed column are counted as their text
+            value_bytes = values.astype(str).str.len().add(5)
+        else:
+            value_bytes = 8
+        sizes += values.notna() * (value_bytes + element_bytes)
+    return sizes
+
+
+def validate_chunk(
+    chunk: pd.DataFrame, unique_keys: list[list[str]] | None = None, seen_unique: dict | None = None
+) -> tuple[pd.DataFrame, pd.DataFrame, pd.Series]:
+    """
+    Pre-flight checks of a chunk of upload rows, run on whole columns at once before anything is written, so a row
+    the server would refuse is set aside instead of failing in the middle of a batch:
+    a value in a column whose name can't be a field name, an estimated document size over the 16 MB limit, and key
+    values (_id or those of a unique index) repeated in the sheet, where only the first row is kept.
+    :param chunk: DataFrame chunk of the sheet, indexed by spreadsheet row number (see src/ingest.py)
+    :param unique_keys: optional list of the lists of fields whose values have to be unique
+    :param seen_unique: optional dictionary of key fields to the hashes of their values in the rows checked so far,
+        updated in place so repeats are found across the chunks of the whole sheet
+    :return: Tuple of the valid rows, the invalid rows and a Series of the reason for each invalid row
+    """
+    chunk = chunk.drop(columns=[UPLOAD_ERROR_COLUMN], errors="ignore")
+    seen_unique = seen_unique if seen_unique is not None else {}
+    reasons = pd.Series(None, index=chunk.index, dtype=object)
+    for column in chunk.columns:
+        name_error = field_name_error(column)
+        if name_error is not None:
+            # Rows leaving the cell empty are fine, empty cells are never stored
+            reasons = reasons.mask(reasons.isna() & chunk[column].notna(), f"column {column} {name_error}")
+    if chunk_bytes_bound(chunk) > BSON_MAX_DOCUMENT_BYTES:
+        oversized = estimated_bson_sizes(chunk) > BSON_MAX_DOCUMENT_BYTES
+        reasons = reasons.mask(reasons.isna() & oversized, "document over the 16 MB size limit")
+    for key_fields in unique_keys or []:
+        if not all(field in chunk.columns for field in key_fields):
+            continue
+        keyed = chunk.loc[reasons.isna(), key_fields].dropna()
+        if keyed.empty:
+            continue
+        seen = seen_unique.setdefault(tuple(key_fields), set())
+        repeated = []
+        # A column with an empty cell reads as floats, so 1 and 1.0 are brought to the same dtype before hashing
+        for key_hash in hash_pandas_object(keyed.convert_dtypes(), index=False).tolist():
+            repeated.append(key_hash in seen)
+            seen.add(key_hash)
+        repeated_rows = pd.Series(repeated, index=keyed.index).reindex(chunk.index, fill_value=False)
+        reasons = reasons.mask(reasons.isna() & repeated_rows, f"{'/'.join(key_fields)} repeated in the sheet")
+    invalid = reasons.notna()
+    return chunk[~invalid], chunk[invalid], reasons[invalid]
+
+
+def validation_errors(reasons: pd.Series) -> list[str]:
+    """
+    Summarizes the invalid rows of a chunk with one message per reason
+    :param reasons: Series of the reason for each invalid row (see validate_chunk)
+    :return: list of the messages
+    """
+    return [f"{count} rows rejected, {reason}" for reason, count in reasons.value_counts().items()]
+
+
+def rejection_reasons(rejected: pd.DataFrame, schema: dict) -> pd.Series:
+    """
+    Spells out why each row was rejected by coerce_chunk
+    :param rejected: DataFrame of the rejected rows (see coerce_chunk)
+    :param schema: dictionary of column name to one of FIELD_TYPES or None
+    :return: Series of the reason for each rejected row
+    """
+    if rejected.empty:
+        return pd.Series(dtype=object)
+    return rejected["Rejected fields"].map(
+        lambda fields: ", ".join(f"{field} is not a valid {schema[field]}" for field in fields.split(", ")),
+        na_action="ignore",
+    )
+
+
+def failed_rows(rows: pd.DataFrame, reasons: pd.Series) -> pd.DataFrame:
+    """
+    Rows of a sheet that weren't stored, the way they are offered for download: the original cells, so they can be
+    corrected and uploaded again, after the spreadsheet row number and the reason in the UPLOAD_ERROR_COLUMN
+    :param rows: DataFrame of the rows, indexed by spreadsheet row number
+    :param reasons: Series of the reason for each row, with the same index
+    :return: DataFrame of the failed rows
+    """
+    failed = rows.drop(columns=["Rejected fields", UPLOAD_ERROR_COLUMN], errors="ignore")
+    failed.insert(0, UPLOAD_ERROR_COLUMN, "Row " + rows.index.astype(str) + ": " + reasons.astype(str))
+    return failed
+
+
+def join_failed_rows(frames: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Puts the failed rows of several checks, chunks or tasks together in sheet order
+    :param frames: list of DataFrames of failed rows (see failed_rows)
+    :return: DataFrame of all the failed rows
+    """
+    frames = [frame for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=[UPLOAD_ERROR_COLUMN])
+    return pd.concat(frames).sort_index(kind="stable")
@@ -1,4 +1,3 @@
-import tkinter.simpledialog
 from pathlib import Path
 
 from dotenv import load_dotenv
@@ -12,6 +11,30 @@ class Settings(BaseSettings):
     mongo_cluster: str
     mongo_database: str
     mongo_uri: str
+    bulk_upload_batch_size: int = 1000
+    bulk_upload_workers: int = 1  # worker processes parsing and writing a bulk upload, 1 uploads from the app itself
+    bulk_upload_task_rows: int = 50000  # rows handed to a worker process at a time
+    bulk_upload_failed_rows_max: int = 100000  # failed rows of an upload kept in memory for download
+    search_cache_size: int = 256
+    search_cache_ttl_seconds: float = 60.0
+    export_batch_size: int = 5000
+    catalog_ttl_seconds: float = 300.0
+    replica_path: str = ""  # SQLite file of the local read replica, empty keeps every search on the server
+    replica_sync_seconds: float = 60.0  # how often documents added by other clients are copied into the replica
+    facet_top_n: int = 10  # most common values shown per field by a summary
+    group_summary_limit: int = 100  # largest groups shown by a group-by summary
+    catalog_sync_seconds: float = 10.0  # how often new collections and fields are pushed into the UI
+    mongo_max_pool_size: int = 100
+    mongo_min_pool_size: int = 5
+    mongo_max_idle_time_ms: int | None = None
+    mongo_server_selection_timeout_ms: int = 10000
+    mongo_connect_timeout_ms: int = 10000
+    mongo_socket_timeout_ms: int | None = None
+    mongo_compressors: str = ""  # comma-separated, e.g. "zstd,snappy,zlib" (zstd/snappy need extra packages)
+    mongo_read_preference: str = "primary"
+    mongo_retry_writes: bool = True
+    mongo_retry_reads: bool = True
+    mongo_executor_workers: int = 32  # concurrent database calls from the UI, keep it below mongo_max_pool_size
 
     @property
     def mongo_connection_string(self) -> str:
@@ -20,11 +43,31 @@ class Settings(BaseSettings):
             f".{self.mongo_uri}.mongodb.net"
         )
 
+    @property
+    def mongo_client_options(self) -> dict:
+        client_options = {
+            "maxPoolSize": self.mongo_max_pool_size,
+            "minPoolSize": self.mongo_min_pool_size,
+            "serverSelectionTimeoutMS": self.mongo_server_selection_timeout_ms,
+            "connectTimeoutMS": self.mongo_connect_timeout_ms,
+            "socketTimeoutMS": self.mongo_socket_timeout_ms,
+            "maxIdleTimeMS": self.mongo_max_idle_time_ms,
+            "readPreference": self.mongo_read_preference,
+            "retryWrites": self.mongo_retry_writes,
+            "retryReads": self.mongo_retry_reads,
+        }
+        if self.mongo_compressors:
+            client_options["compressors"] = self.mongo_compressors
+        return client_options
+
 
 def check_credentials():
     mongo_filename = "mongo.env"
     mongo_path = Path(Path(__file__).parent.parent.resolve() / mongo_filename)
     if not mongo_path.exists():
+        # Only needed on the very first run, so tkinter isn't imported on every startup
+        import tkinter.simpledialog
+
         # Prompt the user for a set of credentials (username, password, cluster, database, uri)
         new_username = tkinter.simpledialog.askstring(title="Username", prompt="Please enter your MongoDB username:")
         new_password = tkinter.simpledialog.askstring(title="Password", prompt="Please enter your MongoDB password:")
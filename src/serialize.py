@@ -0,0 +1,119 @@
+import json
+from collections.abc import Mapping
+from datetime import datetime
+
+import bson
+from bson import ObjectId
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+
+# Documents fetched with these options stay as undecoded BSON bytes until a field is read
+RAW_CODEC_OPTIONS = CodecOptions(document_class=RawBSONDocument)
+# Values a table cell can hold as they are
+PLAIN_TYPES = frozenset((str, int, float, bool, type(None)))
+# Range of the 64-bit integers BSON (and SQLite) can store
+INT64_MIN, INT64_MAX = -(2**63), 2**63 - 1
+
+
+def json_default(value):
+    if isinstance(value, Mapping):
+        return dict(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return str(value)
+
+
+# One reusable encoder saves json.dumps from setting up a new one for every nested cell
+JSON_ENCODER = json.JSONEncoder(default=json_default, check_circular=False, ensure_ascii=False)
+
+
+def search_candidates(search_value: str) -> list:
+    """
+    Values an exact search has to look for, spreadsheet uploads store numbers as numbers
+    :param search_value: string value to search for
+    :return: List of the value itself and, if it reads as one, the number it stands for
+    """
+    try:
+        # Parsed as an int first, a float would round the digits of long barcodes and ISBNs away
+        number = int(search_value)
+    except ValueError:
+        try:
+            number = float(search_value)
+        except ValueError:
+            return [search_value]
+        if number.is_integer() and INT64_MIN <= number <= INT64_MAX:
+            number = int(number)
+        return [search_value, number]
+    if not INT64_MIN <= number <= INT64_MAX:
+        # No stored number can be that large, and encoding it would overflow
+        return [search_value]
+    return [search_value, number]
+
+
+def datetime_cell(value: datetime) -> str:
+    return value.isoformat(sep=" ")
+
+
+# Converters looked up by the exact type of the value, the common BSON types skip the isinstance chain below
+CELL_CONVERTERS = {
+    ObjectId: str,
+    datetime: datetime_cell,
+    dict: JSON_ENCODER.encode,
+    list: JSON_ENCODER.encode,
+}
+
+
+def cell_value(value):
+    """
+    Converts a BSON value into something a NiceGUI table cell can show
+    :param value: value of a document field
+    :return: the value itself for plain scalars, a JSON string for nested documents and arrays, otherwise a string
+    """
+    if type(value) in PLAIN_TYPES:
+        return value
+    converter = CELL_CONVERTERS.get(type(value))
+    if converter is not None:
+        return converter(value)
+    if isinstance(value, datetime):
+        return datetime_cell(value)
+    if isinstance(value, (Mapping, list)):
+        return JSON_ENCODER.encode(value)
+    return str(value)
+
+
+def table_columns(fields, sortable: bool = False) -> list[dict]:
+    """
+    Builds the column definitions of a NiceGUI table
+    :param fields: iterable of field names, in display order
+    :param sortable: let the user sort by every column
+    :return: list of column definitions
+    """
+    if sortable:
+        return [{"name": field, "label": field, "field": field, "sortable": True} for field in fields]
+    return [{"name": field, "label": field, "field": field} for field in fields]
+
+
+def documents_to_table(documents, sortable: bool = False) -> tuple[list[dict], list[dict]]:
+    """
+    Turns documents into table columns and rows in a single pass, without going through a DataFrame.
+    RawBSONDocuments are decoded one at a time as their row is built, so the decoded documents never all sit in
+    memory next to the rows. Columns appear in the order the fields are first seen.
+    :param documents: iterable of dicts or RawBSONDocuments
+    :param sortable: let the user sort by every column
+    :return: Tuple of the list of column definitions and the list of row dictionaries
+    """
+    fields = {}
+    shapes = set()
+    rows = []
+    for document in documents:
+        if type(document) is RawBSONDocument:
+            # The C decoder is much faster than RawBSONDocument.items(), which wraps every nested document again
+            document = bson.decode(document.raw)
+        row = {key: value if type(value) in PLAIN_TYPES else cell_value(value) for key, value in document.items()}
+        # Documents of a collection mostly share their fields, so new columns are only looked for on a new shape
+        shape = tuple(row)
+        if shape not in shapes:
+            shapes.add(shape)
+            fields.update(dict.fromkeys(shape))
+        rows.append(row)
+    return table_columns(fields, sortable), rows
@@ -0,0 +1,102 @@
+class UserSession:
+    def __init__(self, client_id: str, max_summary_rows: int = 500):
+        """
+        State of one browser tab: what the user picked, searched and uploaded, and the widgets of its page.
+        The MongoDB connection, the fields cache and the caches behind them are shared by every session, only what
+        one user is doing lives here, so concurrent users no longer overwrite each other's state.
+        :param client_id: id of the NiceGUI client (one per browser tab) the session belongs to
+        :param max_summary_rows: most batch summary rows kept in the bulk change table of the session
+        """
+        self.client_id = client_id
+        self.max_summary_rows = max_summary_rows
+        self.closed = False
+        self.uploading = False  # a bulk upload is reading bulk_upload_file in a worker thread
+        self.lazy_tab_panels = {}  # tab name to the (panel, builder) of each tab panel not built yet
+
+        # Add One tab
+        self.current_add_one_fields = {}  # store the Add One inputs by element id
+        self.current_add_one_fields_enums = {}  # store the field name of each Add One input
+        self.current_add_one_schema = {}  # store the field types of the collection picked on the Add One tab
+        # Add Bulk tab
+        self.bulk_upload_file = None  # store a bulk upload file, spooled to disk and parsed lazily
+        self.bulk_upload_data = None  # store the lazily parsed sheets of the bulk upload file
+        self.bulk_upload_resume = {}  # store the number of committed batches per collection to resume a failed upload
+        self.bulk_upload_key_selects = {}  # store the per sheet selects of the fields to upsert on
+        self.bulk_upload_failed = {}  # store the DataFrames of the rows of each collection the upload didn't store
+        # Search tab
+        self.search_collection_picked = ""  # store the collection picked for search
+        self.search_field_picked = ""  # store the field picked for search
+        self.search_results_data = []  # store the results shown on the current page of the search
+        self.search_query_picked = None  # store the (collection, field, value) of the search being paged through
+        self.search_page_last_ids = {}  # store the last _id shown on each page of the search
+        self.current_search_fields = {}
+        self.current_search_fields_enums = {}
+        # Summarize tab
+        self.summary_collection_picked = ""  # store the collection picked for the summaries
+        self.summary_filters = []  # store the (field, value, mode) filters every summary has to match
+        # Delete tab
+        self.delete_from_collection = ""  # store the collection picked for deletion method
+        self.delete_id = ""  # store the ID of the item to delete
+        self.bulk_change_file = None  # store the spooled file of bulk updates or _ids to delete
+
+        # Widgets updated from outside their own tab, each one only exists once its tab panel has been built
+        self.available_collections_label = None
+        self.search_cache_label = None
+        self.connection_pool_label = None
+        self.replica_label = None
+        self.collection_stats_table = None
+        self.collection_coverage_select = None
+        self.collection_coverage_table = None
+        self.collection_selection = None
+        self.add_item_button = None
+        self.update_add_one_card = None
+        self.confirm_upload_button = None
+        self.download_failed_button = None
+        self.bulk_upload_progress = None
+        self.bulk_upload_status = None
+        self.export_collections_select = None
+        self.search_collection_select = None
+        self.search_fields = None
+        self.search_button = None
+        self.search_results_table = None
+        self.summary_collection_select = None
+        self.summary_filter_field_select = None
+        self.summary_facet_fields_select = None
+        self.summary_group_fields_select = None
+        self.summary_value_field_select = None
+        self.delete_from_collection_select = None
+        self.delete_button = None
+        self.delete_check_table = None
+        self.stats_table = None
+        self.stats_histogram_select = None
+        self.stats_chart = None
+        self.profiler_engine_select = None
+        self.profile_report = None
+
+    def close_upload(self) -> None:
+        """
+        Removes the spooled bulk upload from disk, unless an upload is still reading it (it is closed when it stops)
+        :return: None
+        """
+        if self.bulk_upload_file is not None and not self.uploading:
+            self.bulk_upload_file.close()
+            self.bulk_upload_file = None
+            self.bulk_upload_data = None
+        return
+
+    def close(self) -> None:
+        """
+        Releases what the session holds once its browser tab is gone: the spooled upload files and the results
+        :return: None
+        """
+        self.closed = True
+        self.close_upload()
+        if self.bulk_change_file is not None:
+            self.bulk_change_file.close()
+            self.bulk_change_file = None
+        self.bulk_upload_key_selects.clear()
+        self.bulk_upload_failed.clear()
+        self.search_results_data = []
+        self.search_page_last_ids = {}
+        self.lazy_tab_panels.clear()
+        return
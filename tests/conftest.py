@@ -0,0 +1,34 @@
+import pytest
+
+from src.mongo import MongoConnection
+from src.security import Settings
+
+
+@pytest.fixture
+def make_connection(tmp_path):
+    """
+    Builds MongoConnections against an in-process mongomock client, with the fields cache kept in a temporary directory
+    :param tmp_path: pytest's temporary directory of the test
+    :return: Callable taking any Settings values to override, e.g. replica_path
+    """
+    mongomock = pytest.importorskip("mongomock")
+
+    def connection(**settings_overrides) -> MongoConnection:
+        settings = Settings(
+            mongo_username="test",
+            mongo_password="test",
+            mongo_cluster="local",
+            mongo_database="collections_test",
+            mongo_uri="local",
+            **settings_overrides,
+        )
+        mongo_conn = MongoConnection(settings, mongo_client=mongomock.MongoClient())
+        mongo_conn.CACHE_PATH = tmp_path / "fields_cache.json"
+        return mongo_conn
+
+    return connection
+
+
+@pytest.fixture
+def mongo_conn(make_connection) -> MongoConnection:
+    return make_connection()
@@ -0,0 +1,90 @@
+import pandas as pd
+import pytest
+from bson import ObjectId
+
+BOOKS = [
+    {"Title": "Ender's Game", "Series": "Ender", "Year": 1985},
+    {"Title": "Ender in Exile", "Series": "Ender", "Year": 2008},
+    {"Title": "Lord of the Flies", "Year": 1954},
+]
+
+
+@pytest.fixture
+def books_conn(make_connection):
+    mongo_conn = make_connection(bulk_upload_batch_size=2)
+    mongo_conn.db["books"].insert_many([dict(book) for book in BOOKS])
+    return mongo_conn
+
+
+def book_ids(mongo_conn) -> list[ObjectId]:
+    return [document["_id"] for document in mongo_conn.db["books"].find({}, {"_id": 1})]
+
+
+def test_bulk_delete_of_ids_skips_invalid_ones(books_conn):
+    ids = book_ids(books_conn)
+    item_ids = [str(ids[0]), "not an id", None, ids[1], str(ObjectId())]
+    assert books_conn.dry_run_bulk_delete("books", item_ids=item_ids) == {
+        "collection": "books",
+        "requested": 4,
+        "matched": 2,
+        "invalid": 1,
+    }
+    batches = list(books_conn.iter_bulk_delete("books", item_ids=item_ids))
+    assert [(batch["batch"], batch["batches"], batch["requested"]) for batch in batches] == [
+        (0, 3, 2),
+        (1, 3, 1),
+        (2, 3, 1),
+    ]
+    assert sum(batch["deleted"] for batch in batches) == 2
+    assert [error for batch in batches for error in batch["errors"]] == ["Invalid _id not an id skipped"]
+    assert book_ids(books_conn) == ids[2:]
+
+
+def test_bulk_delete_of_search_matches(books_conn):
+    search = {"search_field": "Series", "search_value": "Ender", "search_mode": "exact"}
+    assert books_conn.dry_run_bulk_delete("books", **search)["matched"] == 2
+    batches = list(books_conn.iter_bulk_delete("books", **search, batch_size=1))
+    assert [batch["deleted"] for batch in batches] == [1, 1]
+    assert books_conn.db["books"].count_documents({}) == 1
+    # An invalid _id can't match anything
+    assert list(books_conn.iter_bulk_delete("books", search_field="_id", search_value="nope")) == []
+
+
+def test_bulk_update_on_ids(books_conn):
+    ids = book_ids(books_conn)
+    sheet = pd.DataFrame(
+        {
+            "_id": [str(ids[0]), "not an id", str(ObjectId()), str(ids[1]), None],
+            "Year": [1986, 2000, 2001, None, 2002],
+        }
+    )
+    (summary,) = books_conn.dry_run_bulk_update({"books": sheet})
+    assert summary == {"collection": "books", "rows": 5, "matched": 1, "unmatched": 1, "skipped": 3, "documents": 1}
+    batches = list(books_conn.iter_bulk_update({"books": sheet}))
+    assert sum(batch["modified"] for batch in batches) == 1
+    assert [error.split(" (")[0] for batch in batches for error in batch["errors"]] == [
+        "Row with an invalid _id",
+        f"Row _id={ids[1]} has nothing to update, skipped",
+        "Row without a _id value skipped",
+    ]
+    assert books_conn.db["books"].find_one({"_id": ids[0]})["Year"] == 1986
+    # Without upsert the unknown _id isn't inserted
+    assert books_conn.db["books"].count_documents({}) == len(BOOKS)
+
+
+def test_bulk_update_on_a_shared_key_updates_every_match(books_conn):
+    sheet = pd.DataFrame({"Series": ["Ender", "Xeelee"], "Author": ["Orson Scott Card", "Stephen Baxter"]})
+    (summary,) = books_conn.dry_run_bulk_update({"books": sheet}, "Series")
+    assert (summary["matched"], summary["unmatched"], summary["documents"]) == (1, 1, 2)
+    (batch,) = books_conn.iter_bulk_update({"books": sheet}, "Series")
+    assert (batch["matched"], batch["modified"], batch["upserted"]) == (2, 2, 0)
+    assert books_conn.db["books"].count_documents({"Author": "Orson Scott Card"}) == 2
+    assert books_conn.db["books"].count_documents({"Series": "Xeelee"}) == 0
+
+
+def test_bulk_upsert_inserts_the_unmatched_rows(books_conn):
+    sheet = pd.DataFrame({"Title": ["Lord of the Flies", "Xenocide"], "Year": [1955, 1991]})
+    (batch,) = books_conn.iter_bulk_update({"books": sheet}, "Title", upsert=True)
+    assert (batch["matched"], batch["modified"], batch["upserted"]) == (1, 1, 1)
+    assert books_conn.db["books"].find_one({"Title": "Xenocide"})["Year"] == 1991
+    assert books_conn.db["books"].find_one({"Title": "Lord of the Flies"})["Year"] == 1955
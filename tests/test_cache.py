@@ -0,0 +1,75 @@
+import pytest
+
+from src import cache
+from src.cache import ResultCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, "time", clock)
+    return clock
+
+
+def test_least_recently_used_results_are_evicted():
+    result_cache = ResultCache(max_entries=2, ttl_seconds=60)
+    result_cache.store(("books", "a"), 1)
+    result_cache.store(("books", "b"), 2)
+    # Reading "a" makes "b" the least recently used one
+    assert result_cache.lookup(("books", "a")) == (True, 1)
+    result_cache.store(("books", "c"), 3)
+    assert result_cache.lookup(("books", "b")) == (False, None)
+    assert result_cache.lookup(("books", "a")) == (True, 1)
+    assert result_cache.lookup(("books", "c")) == (True, 3)
+    assert result_cache.stats()["evictions"] == 1
+
+
+def test_results_expire_after_the_ttl(clock):
+    result_cache = ResultCache(max_entries=10, ttl_seconds=60)
+    result_cache.store(("books", "a"), 1)
+    clock.now += 59
+    assert result_cache.lookup(("books", "a")) == (True, 1)
+    clock.now += 1
+    assert result_cache.lookup(("books", "a")) == (False, None)
+    stats = result_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["entries"], stats["hit_ratio"]) == (1, 1, 0, 0.5)
+
+
+@pytest.mark.parametrize(("max_entries", "ttl_seconds"), [(0, 60), (10, 0)])
+def test_disabled_cache_stores_nothing(max_entries, ttl_seconds):
+    result_cache = ResultCache(max_entries, ttl_seconds)
+    result_cache.store(("books", "a"), 1)
+    assert result_cache.lookup(("books", "a")) == (False, None)
+
+
+def test_invalidate_one_collection_or_all():
+    result_cache = ResultCache(max_entries=10, ttl_seconds=60)
+    for key in (("books", "a"), ("books", "b"), ("authors", "a")):
+        result_cache.store(key, key)
+    result_cache.invalidate("books")
+    assert [result_cache.lookup(key)[0] for key in (("books", "a"), ("books", "b"), ("authors", "a"))] == [
+        False,
+        False,
+        True,
+    ]
+    result_cache.invalidate()
+    assert result_cache.lookup(("authors", "a")) == (False, None)
+    assert result_cache.stats()["invalidations"] == 2
+
+
+def test_writes_invalidate_cached_searches(mongo_conn):
+    mongo_conn.db["books"].insert_one({"Title": "Ender's Game"})
+    assert mongo_conn.search_collection_page("books", "Title", "Ender", search_mode="prefix")[1] == 1
+    mongo_conn.add_item("books", {"Title": "Ender in Exile"})
+    assert mongo_conn.search_collection_page("books", "Title", "Ender", search_mode="prefix")[1] == 2
+    # Writes from other clients are only seen once the cached result expires or the change stream invalidates it
+    mongo_conn.db["books"].insert_one({"Title": "Ender's Shadow"})
+    assert mongo_conn.search_collection_page("books", "Title", "Ender", search_mode="prefix")[1] == 2
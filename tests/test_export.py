@@ -0,0 +1,104 @@
+import csv
+import json
+import zipfile
+from datetime import datetime, timezone
+
+import pytest
+from bson import Decimal128, ObjectId
+from openpyxl import load_workbook
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+
+from src import export
+from src.export import EXCEL_ILLEGAL_CHARACTERS, export_value, write_xlsx
+
+OBJECT_ID = ObjectId("65a000000000000000000001")
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        (None, None),
+        ("Ender's Game", "Ender's Game"),
+        (True, True),
+        (1985, 1985),
+        (7.99, 7.99),
+        (OBJECT_ID, "65a000000000000000000001"),
+        (datetime(2024, 1, 5, 10, 30, tzinfo=timezone.utc), datetime(2024, 1, 5, 10, 30)),
+        ({"Name": "Faber", "Since": 1929}, '{"Name": "Faber", "Since": 1929}'),
+        (["sci-fi", OBJECT_ID], '["sci-fi", "65a000000000000000000001"]'),
+        (Decimal128("1.10"), "1.10"),
+    ],
+)
+def test_export_value(value, expected):
+    assert export_value(value) == expected
+
+
+def test_export_value_strips_what_excel_cells_cannot_hold():
+    assert export_value("bad\x07char\ttab\nline", xlsx=True) == "badchar\ttab\nline"
+    assert export_value("bad\x07char") == "bad\x07char"
+    # Nested values are written as JSON, which escapes control characters itself
+    assert export_value({"Note": "bad\x07char"}, xlsx=True) == '{"Note": "bad\\u0007char"}'
+
+
+def test_illegal_characters_match_openpyxl():
+    assert EXCEL_ILLEGAL_CHARACTERS.pattern == ILLEGAL_CHARACTERS_RE.pattern
+
+
+def test_write_xlsx_continues_in_overflow_sheets(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "EXCEL_MAX_ROWS", 3)
+    rows = [[number, f"Book {number}"] for number in range(5)]
+    written = write_xlsx(tmp_path / "books.xlsx", [("books", ["_id", "Title"], [rows[:3], rows[3:]])])
+    workbook = load_workbook(tmp_path / "books.xlsx")
+    assert written == 5
+    assert workbook.sheetnames == ["books", "books_2", "books_3"]
+    assert [[cell.value for cell in row] for row in workbook["books_2"].iter_rows()] == [
+        ["_id", "Title"],
+        [2, "Book 2"],
+        [3, "Book 3"],
+    ]
+    assert workbook["books_3"].max_row == 2
+
+
+def test_write_xlsx_sanitizes_sheet_titles_and_headers(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "EXCEL_MAX_ROWS", 2)
+    name = "library/books:[2024]?" + "x" * 40
+    write_xlsx(tmp_path / "books.xlsx", [(name, ["_id", "bad\x07field"], [[[1], [2]]])])
+    workbook = load_workbook(tmp_path / "books.xlsx")
+    assert workbook.sheetnames == [("library_books__2024__" + "x" * 40)[:31], "library_books__2024__" + "x" * 8 + "_2"]
+    assert workbook.worksheets[0]["B1"].value == "badfield"
+
+
+def test_write_xlsx_without_sheets(tmp_path):
+    assert write_xlsx(tmp_path / "empty.xlsx", []) == 0
+    assert load_workbook(tmp_path / "empty.xlsx").sheetnames == ["empty"]
+
+
+def cache_fields(mongo_conn, fields):
+    # mongomock can't run the $type aggregation of the schema discovery, the export columns come from the cache
+    mongo_conn.CACHE_PATH.write_text(json.dumps(fields))
+
+
+def test_export_collections_writes_control_characters_to_excel(mongo_conn, tmp_path):
+    cache_fields(mongo_conn, {"books": ["Title", "Year", "_id"], "authors": ["Name", "_id"]})
+    mongo_conn.db["books"].insert_one({"_id": 1, "Title": "bad\x07char", "Year": 1985})
+    mongo_conn.db["authors"].insert_one({"_id": 2, "Name": "Card"})
+    path = mongo_conn.export_collections(tmp_path / "export", ["books", "authors"], "xlsx")
+    workbook = load_workbook(path)
+    assert workbook.sheetnames == ["books", "authors"]
+    assert [cell.value for cell in workbook["books"][2]] == [1, "badchar", 1985]
+
+    # Other formats keep the value as it is, several collections are zipped together
+    path = mongo_conn.export_collections(tmp_path / "export", ["books", "authors"], "csv")
+    with zipfile.ZipFile(path) as zip_file:
+        rows = list(csv.reader(zip_file.read("books.csv").decode().splitlines()))
+    assert rows == [["_id", "Title", "Year"], ["1", "bad\x07char", "1985"]]
+
+
+def test_export_collections_limits_to_a_search(mongo_conn, tmp_path):
+    cache_fields(mongo_conn, {"books": ["Title", "_id"]})
+    mongo_conn.db["books"].insert_many([{"Title": "Ender's Game"}, {"Title": "Lord of the Flies"}])
+    path = mongo_conn.export_collections(tmp_path / "export", ["books"], "csv", "Title", "ender")
+    with open(path, newline="") as csv_file:
+        assert [row[1] for row in csv.reader(csv_file)] == ["Title", "Ender's Game"]
+    with pytest.raises(ValueError):
+        mongo_conn.export_collections(tmp_path / "export", ["books"], "json")
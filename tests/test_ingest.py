@@ -0,0 +1,79 @@
+import shutil
+from datetime import date, datetime
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+from src.ingest import UploadedWorkbook, calamine_value
+
+ROWS = [
+    ["Title", "Published", "Year", "Price", "In print", "Notes"],
+    ["Ender's Game", date(1985, 1, 15), 1985, 7.99, True, "classic"],
+    ["Lord of the Flies", datetime(1954, 9, 17, 10, 30), 1954, None, False],
+    [None, None, None, None, None, None],
+    ["A Tale of Two Cities", None, 1859, 3.5],
+    ["Ender in Exile", date(2008, 11, 18), None, 12.0, True, ""],
+]
+
+
+@pytest.fixture
+def books_xlsx(tmp_path):
+    # A write-only workbook keeps the short rows short, like the files other tools export
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("books")
+    for row in ROWS:
+        sheet.append(row)
+    workbook.save(tmp_path / "books.xlsx")
+    return tmp_path / "books.xlsx"
+
+
+def read_sheet(path, engine, read):
+    # Closing an upload removes its spooled file, so each read gets a copy
+    spooled = path.with_name(f"{engine}.xlsx")
+    shutil.copyfile(path, spooled)
+    uploaded = UploadedWorkbook(spooled, engine=engine, file_name="books.xlsx")
+    try:
+        return read(uploaded.sheets()["books"])
+    finally:
+        uploaded.close()
+
+
+@pytest.mark.parametrize(
+    "read",
+    [
+        pytest.param(lambda sheet: sheet.head(2), id="preview"),
+        pytest.param(lambda sheet: sheet.head(10), id="head"),
+        pytest.param(lambda sheet: pd.concat(sheet.iter_chunks(2)), id="chunks"),
+    ],
+)
+def test_calamine_reads_like_openpyxl(books_xlsx, read):
+    pytest.importorskip("python_calamine")
+    openpyxl_frame = read_sheet(books_xlsx, "openpyxl", read)
+    calamine_frame = read_sheet(books_xlsx, "calamine", read)
+    pd.testing.assert_frame_equal(calamine_frame, openpyxl_frame)
+
+
+def test_sheet_rows_read_with_openpyxl(books_xlsx):
+    frame = read_sheet(books_xlsx, "openpyxl", lambda sheet: sheet.head(10))
+    # The blank row 4 is skipped, the short rows are padded with missing values
+    assert frame.index.tolist() == [2, 3, 5, 6]
+    assert frame["Published"].tolist()[:2] == [pd.Timestamp(1985, 1, 15), pd.Timestamp(1954, 9, 17, 10, 30)]
+    assert frame.loc[5].isna().tolist() == [False, True, False, False, True, True]
+
+
+@pytest.mark.parametrize(
+    ("value", "expected"),
+    [
+        ("", None),
+        (3.0, 3),
+        (1.5, 1.5),
+        (True, True),
+        (date(2024, 1, 5), datetime(2024, 1, 5)),
+        (datetime(2024, 1, 5, 10, 30), datetime(2024, 1, 5, 10, 30)),
+        ("x", "x"),
+    ],
+)
+def test_calamine_value(value, expected):
+    converted = calamine_value(value)
+    assert converted == expected and type(converted) is type(expected)
@@ -0,0 +1,148 @@
+import sqlite3
+
+import pytest
+from bson import ObjectId
+
+from src.replica import LocalReplica
+
+BOOKS = [
+    {"Title": "Ender's Game", "Author": "Orson Scott Card", "Year": 1985, "Tags": ["sci-fi", "classic"]},
+    {"Title": "Lord of the Flies", "Author": "William Golding", "Year": 1954, "Publisher": {"Name": "Faber"}},
+    {"Title": "A Tale of Two Cities", "Author": "Charles Dickens", "Year": 1859},
+    {"Title": "Ender in Exile", "Author": "Orson Scott Card", "Year": 2008},
+]
+
+
+@pytest.fixture
+def replica_conn(make_connection, tmp_path):
+    mongo_conn = make_connection(replica_path=str(tmp_path / "replica.sqlite"), search_cache_ttl_seconds=0)
+    mongo_conn.db["books"].insert_many([dict(book) for book in BOOKS])
+    return mongo_conn
+
+
+def server_and_replica_pages(mongo_conn, *search):
+    replica = mongo_conn.replica
+    mongo_conn.replica = None
+    try:
+        server_page = mongo_conn.search_collection_page(*search)
+    finally:
+        mongo_conn.replica = replica
+    return server_page, replica.search_page(*search)
+
+
+@pytest.mark.parametrize(
+    ("search_field", "search_value", "search_mode"),
+    [
+        ("Title", "ender", "contains"),
+        ("Title", "Ender", "prefix"),
+        ("Author", "Orson Scott Card", "exact"),
+        ("Year", "1954", "exact"),
+        ("Tags", "classic", "exact"),
+        ("Publisher.Name", "Faber", "exact"),
+    ],
+)
+def test_replica_answers_searches_like_the_server(replica_conn, search_field, search_value, search_mode):
+    replica_conn.sync_replica()
+    search = ("books", search_field, search_value, 1, 25, None, None, False, None, search_mode)
+    (server_documents, server_total), (replica_documents, replica_total) = server_and_replica_pages(
+        replica_conn, *search
+    )
+    assert replica_total == server_total > 0
+    assert replica_documents == server_documents
+
+
+def test_replica_pages_on_after_id(replica_conn):
+    replica_conn.sync_replica()
+    first_page, total = replica_conn.replica.search_page("books", "Title", "e", 1, 2, search_mode="contains")
+    second_page, _ = replica_conn.replica.search_page(
+        "books", "Title", "e", 2, 2, after_id=str(first_page[-1]["_id"]), search_mode="contains"
+    )
+    assert total == 4
+    assert [document["_id"] for document in first_page + second_page] == sorted(
+        document["_id"] for document in replica_conn.db["books"].find()
+    )
+
+
+def test_only_finished_syncs_are_searched(tmp_path):
+    replica = LocalReplica(tmp_path / "replica.sqlite")
+    replica.record_sync("books", ObjectId(), finished=False)
+    assert not replica.can_search("books", "exact")
+    replica.record_sync("books", None, finished=True)
+    assert replica.can_search("books", "exact")
+    assert not replica.can_search("books", "text")
+
+
+def test_incremental_sync_copies_only_new_documents(replica_conn):
+    assert replica_conn.sync_replica() == {"books": len(BOOKS)}
+    replica_conn.db["books"].insert_one({"Title": "Speaker for the Dead", "Year": 1986})
+    replica_conn.sync_replica()
+    assert replica_conn.replica.collections()["books"]["documents"] == len(BOOKS) + 1
+    documents, total = replica_conn.replica.search_page("books", "Title", "Speaker", search_mode="prefix")
+    assert total == 1 and documents[0]["Year"] == 1986
+
+
+def test_writes_of_the_app_reach_the_replica(replica_conn):
+    replica_conn.sync_replica()
+    replica_conn.add_item("books", {"Title": "Xenocide", "Year": 1991})
+    documents, total = replica_conn.search_collection_page("books", "Title", "Xenocide", search_mode="exact")
+    assert total == 1
+    replica_conn.delete_item("books", str(documents[0]["_id"]))
+    assert replica_conn.replica.search_page("books", "Title", "Xenocide", search_mode="exact") == ([], 0)
+
+
+def test_change_events_and_forget(replica_conn):
+    replica_conn.sync_replica()
+    replica = replica_conn.replica
+    book = replica_conn.db["books"].find_one({"Year": 1859})
+    replica.apply_change(
+        {"operationType": "update", "ns": {"coll": "books"}, "fullDocument": {**book, "Title": "Bleak House"}}
+    )
+    assert replica.search_page("books", "Title", "Bleak House", search_mode="exact")[1] == 1
+    replica.apply_change({"operationType": "delete", "ns": {"coll": "books"}, "documentKey": {"_id": book["_id"]}})
+    assert replica.search_page("books", "Title", "Bleak House", search_mode="exact")[1] == 0
+    replica.forget("books")
+    assert not replica.can_search("books", "exact")
+    assert "books" not in replica.collections()
+
+
+def test_replica_exact_search_for_long_digit_strings(replica_conn):
+    replica_conn.db["books"].insert_many([{"Barcode": "12345678901234567890"}, {"Barcode": 9007199254740993}])
+    replica_conn.sync_replica()
+    for barcode in ("12345678901234567890", "9007199254740993"):
+        (server_documents, server_total), (replica_documents, replica_total) = server_and_replica_pages(
+            replica_conn, "books", "Barcode", barcode, 1, 25, None, None, False, None, "exact"
+        )
+        assert replica_total == server_total == 1
+        assert replica_documents == server_documents
+
+
+@pytest.mark.parametrize(
+    ("search_value", "search_mode", "titles"),
+    [
+        # Characters past U+FFFF after the prefix
+        ("Ender", "prefix", ["Ender in Exile", "Ender's Game", "Ender\U0001f680 Redux"]),
+        ("émile", "prefix_ci", ["ÉMILE ZOLA, a life", "Émile Zola"]),
+        ("STRASSE", "prefix_ci", ["Straße der Sehnsucht"]),
+        ("ender\U0001f680", "prefix_ci", ["Ender\U0001f680 Redux"]),
+    ],
+)
+def test_replica_prefix_searches_beyond_ascii(replica_conn, search_value, search_mode, titles):
+    replica_conn.db["books"].insert_many(
+        [
+            {"Title": title}
+            for title in ("Ender\U0001f680 Redux", "Émile Zola", "ÉMILE ZOLA, a life", "Straße der Sehnsucht")
+        ]
+    )
+    replica_conn.sync_replica()
+    documents, total = replica_conn.replica.search_page("books", "Title", search_value, search_mode=search_mode)
+    assert total == len(titles)
+    assert sorted(document["Title"] for document in documents) == titles
+
+
+def test_replica_drops_the_ascii_folded_index(tmp_path):
+    path = tmp_path / "replica.sqlite"
+    with sqlite3.connect(path) as connection:
+        connection.execute("CREATE TABLE field_values (collection TEXT, id_key TEXT, field TEXT, value)")
+        connection.execute("CREATE INDEX field_values_folded ON field_values (collection, field, lower(value))")
+    indexes = [row[0] for row in LocalReplica(path).connection().execute("SELECT name FROM sqlite_master")]
+    assert "field_values_casefold" in indexes and "field_values_folded" not in indexes
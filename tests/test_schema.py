@@ -0,0 +1,63 @@
+import pandas as pd
+import pytest
+
+from src.schema import (
+    coerce_chunk,
+    coerce_column,
+    frame_documents,
+    infer_field_type,
+    infer_schema,
+    rejection_errors,
+)
+
+
+def test_coerce_int_rejects_text_and_fractions():
+    converted, rejected = coerce_column(pd.Series(["1", 2.0, "abc", 3.5, None]), "int")
+    assert converted.tolist()[:2] == [1, 2]
+    assert rejected.tolist() == [False, False, True, True, False]
+    assert str(converted.dtype) == "Int64"
+
+
+def test_coerce_string_keeps_whole_numbers_whole():
+    converted, rejected = coerce_column(pd.Series([9780000000000.0, None]), "string")
+    assert converted.iloc[0] == "9780000000000"
+    assert pd.isna(converted.iloc[1])
+    assert not rejected.any()
+
+
+@pytest.mark.parametrize(("value", "expected"), [("Yes", True), (" no ", False), ("1", True), ("maybe", None)])
+def test_coerce_bool(value, expected):
+    converted, rejected = coerce_column(pd.Series([value]), "bool")
+    if expected is None:
+        assert rejected.iloc[0]
+    else:
+        assert converted.iloc[0] == expected and not rejected.iloc[0]
+
+
+def test_coerce_date_accepts_mixed_formats():
+    converted, rejected = coerce_column(
+        pd.Series(["2024-01-05", "01/05/2024", "5 Jan 2024", "not a date", None]), "date"
+    )
+    assert converted.iloc[:3].tolist() == [pd.Timestamp("2024-01-05")] * 3
+    assert rejected.tolist() == [False, False, False, True, False]
+
+
+def test_coerce_chunk_sets_aside_whole_rows():
+    chunk = pd.DataFrame({"Title": ["a", "b", "c"], "Year": [2001, "abc", 2003]}, index=[2, 3, 4])
+    schema = {"Title": "string", "Year": "int"}
+    coerced, rejected = coerce_chunk(chunk, schema)
+    assert coerced.index.tolist() == [2, 4]
+    assert rejected.index.tolist() == [3]
+    assert rejected["Rejected fields"].tolist() == ["Year"]
+    assert rejection_errors(rejected, schema) == ["1 rows rejected, Year is not a valid int"]
+
+
+def test_infer_schema_prefers_the_collection_types():
+    sample = pd.DataFrame({"Year": [2001.0, 2002.0], "Price": [1.5, 2.0], "Title": ["a", "b"]})
+    assert infer_field_type(sample["Year"]) == "int"
+    assert infer_schema(sample, {"Price": "string"}) == {"Year": "int", "Price": "string", "Title": None}
+
+
+def test_frame_documents_leaves_out_empty_cells():
+    frame = pd.DataFrame({"Title": ["a", None], "Year": pd.array([2001, None], dtype="Int64")})
+    assert frame_documents(frame) == [{"Title": "a", "Year": 2001}, {}]
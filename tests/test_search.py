@@ -0,0 +1,114 @@
+import bson
+import pytest
+
+from src.mongo import CASE_INSENSITIVE_COLLATION
+from src.serialize import search_candidates
+
+BOOKS = [
+    {"Title": "Ender's Game", "Year": 1985, "Code": "1985"},
+    {"Title": "ender in exile", "Year": 2008, "Code": "C++ 2008"},
+    {"Title": "Lord of the Flies", "Year": 1954.0, "Code": "C.A.T"},
+    {"Title": "A Tale of Two Cities", "Year": "1859", "Code": "CxAT"},
+]
+
+
+@pytest.fixture
+def books_conn(make_connection):
+    mongo_conn = make_connection(search_cache_ttl_seconds=0)
+    mongo_conn.db["books"].insert_many([dict(book) for book in BOOKS])
+    return mongo_conn
+
+
+def search_titles(mongo_conn, search_field, search_value, search_mode):
+    documents, total = mongo_conn.search_collection_page("books", search_field, search_value, search_mode=search_mode)
+    assert total == len(documents)
+    return sorted(document["Title"] for document in documents)
+
+
+@pytest.mark.parametrize(
+    ("search_field", "search_value", "search_mode", "titles"),
+    [
+        # Contains ignores case and takes a regular expression
+        ("Title", "ENDER", "contains", ["Ender's Game", "ender in exile"]),
+        ("Title", "^l.*s$", "contains", ["Lord of the Flies"]),
+        # Exact finds numbers stored as ints, floats or text
+        ("Year", "1985", "exact", ["Ender's Game"]),
+        ("Year", "1954", "exact", ["Lord of the Flies"]),
+        ("Year", "1859", "exact", ["A Tale of Two Cities"]),
+        ("Code", "1985", "exact", ["Ender's Game"]),
+        ("Title", "ender's game", "exact", []),
+        # Prefix is case-sensitive and matches the value literally, not as a regular expression
+        ("Title", "Ender", "prefix", ["Ender's Game"]),
+        ("Code", "C++", "prefix", ["ender in exile"]),
+        ("Code", "C.A", "prefix", ["Lord of the Flies"]),
+    ],
+)
+def test_search_modes(books_conn, search_field, search_value, search_mode, titles):
+    assert search_titles(books_conn, search_field, search_value, search_mode) == titles
+
+
+def test_case_insensitive_prefix_query(books_conn):
+    # mongomock has no collations, so only the query and collation that reach the server are checked
+    assert books_conn.build_search_query("Title", "end", "prefix_ci") == {"Title": {"$gte": "end", "$lt": "end\uffff"}}
+    assert books_conn.search_collation("prefix_ci") == CASE_INSENSITIVE_COLLATION
+    assert books_conn.search_collation("prefix") is None
+
+
+def test_text_and_id_queries(books_conn):
+    assert books_conn.build_search_query("Title", "ender", "text") == {"$text": {"$search": "ender"}}
+    assert books_conn.build_search_query("_id", "not an id", "exact") is None
+    assert books_conn.search_collection_page("books", "_id", "not an id", search_mode="exact") == ([], 0)
+    with pytest.raises(ValueError):
+        books_conn.build_search_query("Title", "ender", "fuzzy")
+
+
+def test_search_collection_page_pages_through_the_matches(books_conn):
+    search = ("books", "Title", "e")
+    first_page, total = books_conn.search_collection_page(*search, page=1, rows_per_page=3)
+    second_page, _ = books_conn.search_collection_page(*search, page=2, rows_per_page=3)
+    after_page, _ = books_conn.search_collection_page(
+        *search, page=2, rows_per_page=3, after_id=str(first_page[-1]["_id"])
+    )
+    assert total == 4 and len(first_page) == 3
+    assert second_page == after_page
+    assert [document["_id"] for document in first_page + second_page] == sorted(
+        document["_id"] for document in books_conn.db["books"].find()
+    )
+
+
+def test_search_collection_page_sorts_and_projects(books_conn):
+    documents, _ = books_conn.search_collection_page(
+        "books", "Title", "e", fields=["Title"], sort_by="Title", descending=True
+    )
+    assert [document["Title"] for document in documents] == sorted((book["Title"] for book in BOOKS), reverse=True)
+    assert all(set(document) == {"_id", "Title"} for document in documents)
+
+
+@pytest.mark.parametrize(
+    ("search_value", "expected"),
+    [
+        ("1954", ["1954", 1954]),
+        ("2.0", ["2.0", 2]),
+        ("1.5", ["1.5", 1.5]),
+        ("abc", ["abc"]),
+        # Past 2**53 a float would turn these into a different number
+        ("9007199254740993", ["9007199254740993", 9007199254740993]),
+        ("-9223372036854775808", ["-9223372036854775808", -(2**63)]),
+        # Past the 64-bit range only the text can be stored
+        ("12345678901234567890", ["12345678901234567890"]),
+        ("9223372036854775808", ["9223372036854775808"]),
+    ],
+)
+def test_search_candidates(search_value, expected):
+    candidates = search_candidates(search_value)
+    assert candidates == expected and [type(value) for value in candidates] == [type(value) for value in expected]
+
+
+def test_exact_search_for_long_digit_strings(mongo_conn):
+    barcode = "12345678901234567890"
+    mongo_conn.db["books"].insert_many([{"Barcode": barcode}, {"Barcode": 9007199254740993}, {"Barcode": 2**53}])
+    query = mongo_conn.build_search_query("Barcode", barcode, "exact")
+    bson.encode(query)
+    assert mongo_conn.search_collection_page("books", "Barcode", barcode, search_mode="exact")[1] == 1
+    documents, total = mongo_conn.search_collection_page("books", "Barcode", "9007199254740993", search_mode="exact")
+    assert total == 1 and documents[0]["Barcode"] == 9007199254740993
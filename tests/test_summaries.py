@@ -0,0 +1,60 @@
+import pytest
+
+BOOKS = [
+    {"Title": "Ender's Game", "Author": "Orson Scott Card", "Year": 1985, "Price": 7.99},
+    {"Title": "Speaker for the Dead", "Author": "Orson Scott Card", "Year": 1986, "Price": 8.99},
+    {"Title": "Ender in Exile", "Author": "Orson Scott Card", "Year": 2008},
+    {"Title": "Lord of the Flies", "Author": "William Golding", "Year": 1954, "Price": 5.5},
+    {"Title": "The Inheritors", "Author": "William Golding", "Year": 1955},
+    {"Title": "A Tale of Two Cities", "Year": 1859, "Price": 3.0},
+]
+
+
+@pytest.fixture
+def books_conn(make_connection):
+    mongo_conn = make_connection()
+    mongo_conn.db["books"].insert_many([dict(book) for book in BOOKS])
+    return mongo_conn
+
+
+def test_facet_summary_counts_the_most_common_values(books_conn):
+    summary = books_conn.facet_summary("books", [], ["Author", "Year"], top_n=2)
+    assert summary["total"] == len(BOOKS)
+    assert summary["facets"]["Author"] == {
+        "distinct": 3,
+        "top": [{"value": "Orson Scott Card", "count": 3}, {"value": "William Golding", "count": 2}],
+    }
+    assert summary["facets"]["Year"]["distinct"] == len(BOOKS)
+
+
+def test_facet_summary_of_filtered_documents(books_conn):
+    summary = books_conn.facet_summary("books", [("Title", "ender", "contains"), ("Year", "2008", "exact")], ["Author"])
+    assert summary == {
+        "total": 1,
+        "facets": {"Author": {"distinct": 1, "top": [{"value": "Orson Scott Card", "count": 1}]}},
+    }
+    # A filter that can never match, and one nothing matches
+    empty = {"total": 0, "facets": {"Author": {"distinct": 0, "top": []}}}
+    assert books_conn.facet_summary("books", [("_id", "not an id", "exact")], ["Author"]) == empty
+    assert books_conn.facet_summary("books", [("Title", "Dune", "exact")], ["Author"]) == empty
+    with pytest.raises(ValueError):
+        books_conn.facet_summary("books", [("Title", "ender", "prefix_ci")], ["Author"])
+
+
+def test_group_summary_totals_a_numeric_field(books_conn):
+    summary = books_conn.group_summary("books", [], ["Author"], value_field="Price")
+    assert summary["groups"] == 3
+    card, golding, missing = summary["rows"]
+    # Documents without a price are left out of the totals, but still counted
+    assert card["Author"] == "Orson Scott Card" and card["count"] == 3
+    assert card["sum"] == pytest.approx(16.98) and card["avg"] == pytest.approx(8.49)
+    assert (card["min"], card["max"]) == (7.99, 8.99)
+    assert (golding["count"], golding["sum"]) == (2, 5.5)
+    assert (missing["Author"], missing["count"]) == (None, 1)
+
+
+def test_group_summary_on_several_fields_and_a_limit(books_conn):
+    summary = books_conn.group_summary("books", [("Author", "Golding", "contains")], ["Author", "Year"], limit=1)
+    assert summary["groups"] == 2
+    assert summary["rows"] == [{"Author": "William Golding", "Year": 1954, "count": 1}]
+    assert books_conn.group_summary("books", [], []) == {"groups": 0, "rows": []}
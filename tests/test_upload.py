@@ -0,0 +1,173 @@
+import pandas as pd
+import pytest
+from openpyxl import Workbook, load_workbook
+
+from src.export import export_value, write_xlsx
+from src.ingest import UploadedWorkbook, iter_frame_chunks
+from src.schema import (
+    BSON_MAX_DOCUMENT_BYTES,
+    UPLOAD_ERROR_COLUMN,
+    chunk_bytes_bound,
+    estimated_bson_sizes,
+    failed_rows,
+    field_name_error,
+    join_failed_rows,
+    validate_chunk,
+)
+
+
+@pytest.mark.parametrize(
+    ("name", "error"),
+    [
+        ("Title", None),
+        ("Unnamed: 3", "has no header"),
+        ("$set", "starts with $"),
+        ("Title.1", "contains a ."),
+        ("a\x00b", "contains a null character"),
+    ],
+)
+def test_field_name_error(name, error):
+    assert field_name_error(name) == error
+
+
+def test_validate_chunk_only_rejects_rows_using_a_bad_column():
+    chunk = pd.DataFrame({"Title": ["a", "b"], "Bad.col": [None, "x"]}, index=[2, 3])
+    valid, invalid, reasons = validate_chunk(chunk)
+    assert valid.index.tolist() == [2]
+    assert reasons.to_dict() == {3: "column Bad.col contains a ."}
+
+
+def test_validate_chunk_finds_repeated_keys_across_chunks():
+    seen_unique = {}
+    first = pd.DataFrame({"_id": [1, 2, 2], "Title": ["a", "b", "c"]}, index=[2, 3, 4])
+    second = pd.DataFrame({"_id": [1, 5, None], "Title": ["d", "e", "f"]}, index=[5, 6, 7])
+    _, _, first_reasons = validate_chunk(first, [["_id"]], seen_unique)
+    valid, _, second_reasons = validate_chunk(second, [["_id"]], seen_unique)
+    assert first_reasons.to_dict() == {4: "_id repeated in the sheet"}
+    assert second_reasons.to_dict() == {5: "_id repeated in the sheet"}
+    # Rows without a value can't repeat one
+    assert valid.index.tolist() == [6, 7]
+
+
+def test_validate_chunk_rejects_oversized_documents():
+    chunk = pd.DataFrame({"Notes": ["x" * BSON_MAX_DOCUMENT_BYTES, "short"], "Year": [1, 2]}, index=[2, 3])
+    _, invalid, reasons = validate_chunk(chunk)
+    assert reasons.to_dict() == {2: "document over the 16 MB size limit"}
+
+
+def test_chunk_bytes_bound_covers_the_estimates():
+    chunk = pd.DataFrame({"Title": ["Ender's Game", "Ça"], "Year": [1985, 2001], "Price": [1.5, None]})
+    assert chunk_bytes_bound(chunk) >= estimated_bson_sizes(chunk).sum()
+
+
+def test_validate_chunk_ignores_the_upload_error_column():
+    chunk = pd.DataFrame({UPLOAD_ERROR_COLUMN: ["Row 4: x"], "Title": ["a"]}, index=[2])
+    valid, invalid, _ = validate_chunk(chunk)
+    assert valid.columns.tolist() == ["Title"] and invalid.empty
+
+
+def test_failed_rows_lead_with_the_row_number_and_reason():
+    rows = pd.DataFrame({"Title": ["b"], "Rejected fields": ["Year"]}, index=[7])
+    failed = failed_rows(rows, pd.Series(["Year is not a valid int"], index=[7]))
+    assert failed.columns.tolist() == [UPLOAD_ERROR_COLUMN, "Title"]
+    assert failed.loc[7, UPLOAD_ERROR_COLUMN] == "Row 7: Year is not a valid int"
+
+
+def test_insert_maps_write_errors_back_to_sheet_rows(mongo_conn):
+    mongo_conn.db["books"].insert_one({"_id": 4, "Title": "already there"})
+    sheet = pd.DataFrame(
+        {"_id": [1, 2, 2, 3, 4], "Title": ["a", "b", "c", "d", "e"], "Year": [2001, 2002, 2003, "abc", 2005]}
+    )
+    schema = {"_id": "int", "Title": "string", "Year": "int"}
+    (chunk,) = iter_frame_chunks(sheet, 5)
+    result = mongo_conn.insert_chunk("books", chunk, schema, unique_keys=[["_id"]], seen_unique={})
+    assert result["inserted"] == 2
+    assert result["rejected"] == 2
+    failed = result["failed_rows"]
+    # Sheet row 2 holds the first data row, so the 5th row is spreadsheet row 6
+    assert failed.index.tolist() == [4, 5, 6]
+    assert failed[UPLOAD_ERROR_COLUMN].str.startswith(("Row 4: _id repeated", "Row 5: Year", "Row 6: E11000")).all()
+    assert "Row 6: " in result["errors"][-1]
+
+
+def test_upsert_maps_write_errors_and_unkeyed_rows(mongo_conn):
+    mongo_conn.db["books"].create_index("Code", unique=True)
+    mongo_conn.db["books"].insert_one({"ISBN": 9, "Code": "taken"})
+    sheet = pd.DataFrame({"ISBN": [1, None, 2], "Code": ["a", "b", "taken"]})
+    (chunk,) = iter_frame_chunks(sheet, 10)
+    result = mongo_conn.upsert_chunk(
+        "books", chunk, ["ISBN"], set(), None, mongo_conn.upload_unique_keys("books", ["ISBN"]), {}
+    )
+    assert result["inserted"] == 1
+    assert result["failed_rows"][UPLOAD_ERROR_COLUMN].tolist() == ["Row 3: no ISBN value", result["errors"][-1]]
+    assert result["errors"][-1].startswith("Row 4: E11000")
+
+
+def test_upsert_counts_add_up_on_a_re_upload(mongo_conn):
+    sheet = pd.DataFrame({"ISBN": [1, 2, 2], "Title": ["a", "b", "c"]})
+    for expected in ({"inserted": 2, "updated": 0}, {"inserted": 0, "updated": 2}):
+        (batch,) = mongo_conn.iter_upload_bulk({"books": sheet}, key_fields={"books": ["ISBN"]})
+        assert {count: batch[count] for count in expected} == expected
+        assert batch["skipped"] == 1
+
+
+def test_upload_unique_keys(mongo_conn):
+    mongo_conn.db["books"].create_index("Code", unique=True)
+    mongo_conn.db["books"].create_index("ISBN", unique=True)
+    assert mongo_conn.upload_unique_keys("books") == [["_id"], ["Code"], ["ISBN"]]
+    assert mongo_conn.upload_unique_keys("books", ["ISBN"]) == [["Code"]]
+
+
+def test_excel_chunks_keep_their_row_numbers(tmp_path):
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.title = "books"
+    for row in (["Title", "Year"], ["a", 2001], [None, None], ["b", 2002], ["c", 2003]):
+        sheet.append(row)
+    workbook.save(tmp_path / "books.xlsx")
+    uploaded = UploadedWorkbook(tmp_path / "books.xlsx", engine="openpyxl", file_name="books.xlsx")
+    try:
+        chunks = list(uploaded.sheets()["books"].iter_chunks(2))
+    finally:
+        uploaded.close()
+    # The blank row 3 is skipped but still counted
+    assert [chunk.index.tolist() for chunk in chunks] == [[2, 4], [5]]
+
+
+def test_csv_chunks_keep_their_row_numbers(tmp_path):
+    (tmp_path / "books.csv").write_text("Title,Year\na,2001\nb,2002\nc,2003\n")
+    uploaded = UploadedWorkbook(tmp_path / "books.csv", file_name="books.csv")
+    try:
+        chunks = list(uploaded.sheets()["books"].iter_chunks(2))
+    finally:
+        uploaded.close()
+    assert [chunk.index.tolist() for chunk in chunks] == [[2, 3], [4]]
+
+
+def test_failed_rows_download_can_be_uploaded_again(mongo_conn, tmp_path):
+    sheet = pd.DataFrame({"_id": [1, 1], "Title": ["a", "b"], "Year": [2001, None]})
+    (batch,) = mongo_conn.iter_upload_bulk({"books": sheet})
+    failed = join_failed_rows([batch["failed_rows"]])
+    rows = failed.astype(object).where(failed.notna(), None).values.tolist()
+    write_xlsx(
+        tmp_path / "failed_rows.xlsx",
+        [
+            (
+                "books",
+                [str(column) for column in failed.columns],
+                [[[export_value(value, xlsx=True) for value in row] for row in rows]],
+            )
+        ],
+    )
+    assert load_workbook(tmp_path / "failed_rows.xlsx")["books"]["A2"].value == "Row 3: _id repeated in the sheet"
+
+    # Corrected and uploaded again, the reason column is left out of the documents and the schema
+    uploaded = UploadedWorkbook(tmp_path / "failed_rows.xlsx", engine="openpyxl", file_name="failed_rows.xlsx")
+    try:
+        corrected = uploaded.sheets()["books"].head(10).assign(_id=2)
+    finally:
+        uploaded.close()
+    assert UPLOAD_ERROR_COLUMN not in mongo_conn.upload_schema("books", corrected)
+    (batch,) = mongo_conn.iter_upload_bulk({"books": corrected})
+    assert batch["inserted"] == 1 and batch["failed_rows"].empty
+    assert UPLOAD_ERROR_COLUMN not in mongo_conn.db["books"].find_one({"_id": 2})